@@ -2,18 +2,34 @@ import os
 import json
 import datetime
 import logging
-from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify
+import click
+from flask import (Flask, Response, render_template, request, redirect, url_for, flash, session, jsonify,
+                   stream_with_context)
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user
 from werkzeug.security import check_password_hash
 from werkzeug.middleware.proxy_fix import ProxyFix
 from flask_wtf.csrf import CSRFProtect
-from models import User, get_all_users, get_user_by_username, create_user, update_user, get_user_positions
+from models import (get_cached_user, get_user_by_username, get_user_by_id, create_user, update_user,
+                    get_user_positions, get_account_summaries)
 from forms import LoginForm, RegisterForm, DepositForm, WithdrawalForm, TradeForm, PriceForm
-from utils import (load_data, save_data, initialize_data_files, calculate_liquidation_price, 
-                  load_prices, save_prices, update_price, get_deposits, get_withdrawals, 
+from utils import (load_data, initialize_data_files, calculate_liquidation_price, 
+                  load_prices, update_price, 
                   process_deposit, process_withdrawal, create_position, close_position, 
-                  get_user_balance, adjust_balance, add_bonus_to_new_user, authenticate_admin,
-                  get_leaderboard, get_positions_analysis)
+                  get_user_balance, adjust_balance, deduct_balance, add_bonus_to_new_user, authenticate_admin,
+                  get_leaderboard, get_positions_analysis, get_cache_stats, store,
+                  convert_data_format, get_recent_records,
+                  archive_settled_records, start_archive_job, user_cache, get_trade_prices,
+                  price_service, get_price, price_history,
+                  broadcaster, get_data_version,
+                  start_scheduler, start_risk_engine, use_bonus, get_scheduled_jobs, cancel_scheduled_job,
+                  close_positions, get_open_position_ids, ensure_position_stats, check_position_stats,
+                  ensure_leaderboard, get_history_page, PAGE_SIZE, iter_export)
+from serialization import FORMATS
+from prices import StalePricesError
+from price_history import CANDLE_INTERVALS
+from user_cache import touch_user
+from http_cache import VersionedBody, SerializedBody, json_response, is_fresh, not_modified
+from export import EXPORT_FIELDS, csv_chunks, jsonl_chunks
 
 # Configure logging
 logging.basicConfig(level=logging.DEBUG)
@@ -43,17 +59,32 @@ if not os.path.exists('data'):
 # Initialize data files if they don't exist
 initialize_data_files()
 
+# Compute the position statistics and trader totals once for data that predates them
+ensure_position_stats()
+ensure_leaderboard()
+
+# Move settled records out of the live data files periodically
+start_archive_job()
+
+# Poll prices in the background so requests read them from memory
+price_service.start()
+
+# Run delayed jobs (bonus and price override expiry), including ones due during downtime
+start_scheduler()
+
+# Index the open positions' liquidation, stop loss and take profit prices
+start_risk_engine()
+
 # Load supported cryptocurrencies
 SUPPORTED_COINS = ["BTC", "ETH", "ETC", "LTC", "BNB", "TRX", "PEPE", "AAVE", "DOGE", 
                    "SOL", "ADA", "AVAX", "SHIB", "TON", "POL", "FIL", "ATOM"]
 
 @login_manager.user_loader
 def load_user(user_id):
-    users = load_data('users.json')
-    for user in users:
-        if str(user['id']) == user_id:
-            return User(user)
-    return None
+    try:
+        return get_cached_user(int(user_id))
+    except ValueError:
+        return None
 
 # Public Routes
 @app.route('/')
@@ -171,9 +202,13 @@ def user_deposit():
             else:
                 flash('Failed to process deposit', 'danger')
 
-    # Get user's deposit history
-    deposits = get_deposits(current_user.id)
-    return render_template('user/deposit.html', form=form, deposits=deposits)
+    # Get one page of the user's deposit history
+    try:
+        page = history_page('deposits.json', ('status',), user_id=current_user.id)
+    except ValueError:
+        return redirect(url_for('user_deposit'))
+    return render_template('user/deposit.html', form=form, deposits=page['items'],
+                           next_cursor=page['next_cursor'], filters=page['filters'])
 
 @app.route('/user/withdrawals', methods=['GET', 'POST'])
 @login_required
@@ -209,9 +244,13 @@ def user_withdrawals():
             else:
                 flash('Failed to process withdrawal', 'danger')
 
-    # Get user's withdrawal history
-    withdrawals = get_withdrawals(current_user.id)
-    return render_template('user/withdrawals.html', form=form, withdrawals=withdrawals, balance=balance)
+    # Get one page of the user's withdrawal history
+    try:
+        page = history_page('withdrawals.json', ('status',), user_id=current_user.id)
+    except ValueError:
+        return redirect(url_for('user_withdrawals'))
+    return render_template('user/withdrawals.html', form=form, withdrawals=page['items'], balance=balance,
+                           next_cursor=page['next_cursor'], filters=page['filters'])
 
 @app.route('/user/trade/<coin>')
 @login_required
@@ -264,11 +303,11 @@ def open_position():
     if leverage < 1:
         return jsonify({'success': False, 'message': 'Leverage must be at least 1x'})
 
-    balance = get_user_balance(current_user.id)
-    if amount > balance:
-        return jsonify({'success': False, 'message': 'Insufficient balance'})
-
-    prices = load_prices()
+    try:
+        prices = get_trade_prices()
+    except StalePricesError as e:
+        app.logger.warning(f"Refusing to open position: {str(e)}")
+        return jsonify({'success': False, 'message': 'Prices are out of date, please try again'})
     entry_price = prices.get(f"{coin}/USDT", 0)
 
     if entry_price <= 0:
@@ -277,12 +316,20 @@ def open_position():
     # Calculate liquidation price
     liquidation_price = calculate_liquidation_price(entry_price, leverage, position_type)
 
+    # Deduct the margin first; the balance is checked under the same lock
+    if not deduct_balance(current_user.id, amount):
+        return jsonify({'success': False, 'message': 'Insufficient balance'})
+
     # Create position
-    position_id = create_position(current_user.id, coin, amount, leverage, entry_price, liquidation_price, position_type, take_profit, stop_loss)
+    try:
+        position_id = create_position(current_user.id, coin, amount, leverage, entry_price, liquidation_price, position_type, take_profit, stop_loss)
+    except Exception as e:
+        app.logger.error(f"Error opening position: {str(e)}")
+        position_id = None
 
     if position_id:
-        # Deduct amount from balance
-        adjust_balance(current_user.id, -amount)
+        # Trading with the new user bonus uses it up, so it no longer expires
+        use_bonus(current_user.id)
         return jsonify({
             'success': True, 
             'message': 'Position opened successfully',
@@ -293,6 +340,8 @@ def open_position():
             'stop_loss': stop_loss
         })
     else:
+        # Give the margin back
+        adjust_balance(current_user.id, amount)
         return jsonify({'success': False, 'message': 'Failed to open position'})
 
 @app.route('/api/close-position/<position_id>', methods=['POST'])
@@ -310,7 +359,11 @@ def close_position_route(position_id):
     if not position:
         return jsonify({'success': False, 'message': 'Position not found'})
 
-    prices = load_prices()
+    try:
+        prices = get_trade_prices()
+    except StalePricesError as e:
+        app.logger.warning(f"Refusing to close position: {str(e)}")
+        return jsonify({'success': False, 'message': 'Prices are out of date, please try again'})
     close_price = prices.get(f"{position['coin']}/USDT", 0)
 
     if close_price <= 0:
@@ -331,6 +384,60 @@ def close_position_route(position_id):
     else:
         return jsonify({'success': False, 'message': 'Failed to close position'})
 
+@app.route('/api/close-all', methods=['POST'])
+@login_required
+@csrf.exempt
+def close_all_positions_route():
+    position_ids = get_open_position_ids(user_id=current_user.id)
+    if not position_ids:
+        return jsonify({'success': False, 'message': 'No open positions'})
+
+    try:
+        prices = get_trade_prices()
+    except StalePricesError as e:
+        app.logger.warning(f"Refusing to close positions: {str(e)}")
+        return jsonify({'success': False, 'message': 'Prices are out of date, please try again'})
+
+    # All positions are settled and credited in one write per file
+    results = close_positions(position_ids, prices)
+    profit_loss = sum(result.get('profit_loss', 0) for result in results.values())
+
+    return jsonify({
+        'success': True,
+        'message': 'Positions closed successfully',
+        'profit_loss': round(profit_loss, 2),
+        'results': results
+    })
+
+def history_page(filename, filters, **fixed):
+    """Get the page of a history view named by the cursor, limit and filter query arguments
+
+    filters are the query arguments the view accepts (coin, status, type,
+    user); fixed are filters the caller imposes, such as the current user.
+    Raises ValueError for a malformed cursor.
+    """
+    criteria = {name: request.args.get(name) or None for name in filters if name != 'user'}
+    if criteria.get('coin'):
+        criteria['coin'] = criteria['coin'].upper()
+    if 'user' in filters:
+        criteria['user_id'] = request.args.get('user', type=int)
+    criteria.update(fixed)
+    page = get_history_page(filename, request.args.get('cursor'), request.args.get('limit', PAGE_SIZE, type=int),
+                            **criteria)
+    page['filters'] = {name: request.args.get(name, '') for name in filters}
+    return page
+
+def with_usernames(records):
+    """Add the owner's username to each record of a page"""
+    usernames = {}
+    for record in records:
+        user_id = record.get('user_id')
+        if user_id not in usernames:
+            user = get_user_by_id(user_id)
+            usernames[user_id] = user.username if user else "Unknown"
+        record['username'] = usernames[user_id]
+    return records
+
 # Admin Routes
 @app.route('/admin/dashboard')
 def admin_dashboard():
@@ -338,22 +445,18 @@ def admin_dashboard():
         flash('Admin login required', 'danger')
         return redirect(url_for('login', type='admin'))
 
-    users = get_all_users()
-    total_users = len(users)
+    summaries = get_account_summaries()
+    total_users = len(summaries)
 
     # Calculate total balance
-    total_balance = sum(get_user_balance(user.id) for user in users)
+    total_balance = sum(summary['balance'] for summary in summaries)
 
     # Get recent deposit and withdrawal requests
-    deposits = load_data('deposits.json')
-    withdrawals = load_data('withdrawals.json')
-
-    recent_deposits = sorted(deposits, key=lambda x: x.get('date'), reverse=True)[:5]
-    recent_withdrawals = sorted(withdrawals, key=lambda x: x.get('date'), reverse=True)[:5]
+    recent_deposits = get_recent_records('deposits.json', 5)
+    recent_withdrawals = get_recent_records('withdrawals.json', 5)
 
     # Get active positions
-    trades = load_data('trades.json')
-    active_positions = [trade for trade in trades if trade.get('status') == 'open']
+    active_positions = [position for summary in summaries for position in summary['positions']]
 
     return render_template('admin/dashboard.html', 
                           total_users=total_users,
@@ -368,18 +471,8 @@ def admin_user_management():
         flash('Admin login required', 'danger')
         return redirect(url_for('login', type='admin'))
 
-    users = get_all_users()
-    user_data = []
-
-    for user in users:
-        positions = get_user_positions(user.id)
-        balance = get_user_balance(user.id)
-
-        user_data.append({
-            'user': user,
-            'balance': balance,
-            'positions': positions
-        })
+    # One read of users and open trades for the whole table
+    user_data = get_account_summaries()
 
     return render_template('admin/user_management.html', users=user_data)
 
@@ -390,13 +483,7 @@ def admin_user_detail(user_id):
         flash('Admin login required', 'danger')
         return redirect(url_for('login', type='admin'))
 
-    users = load_data('users.json')
-    user_data = None
-
-    for user in users:
-        if str(user.get('id')) == user_id:
-            user_data = user
-            break
+    user_data = store.get('users.json', int(user_id)) if user_id.isdigit() else None
 
     if not user_data:
         flash('User not found', 'danger')
@@ -404,38 +491,42 @@ def admin_user_detail(user_id):
 
     if request.method == 'POST':
         action = request.form.get('action')
+        form = request.form
+
+        # Applied to the stored user under its lock so concurrent changes are not lost
+        def apply(user):
+            if action == 'update':
+                # Update user data
+                user['name'] = form.get('name')
+                user['email'] = form.get('email')
+                user['balance'] = float(form.get('balance'))
+            elif action == 'ban':
+                # Ban user
+                user['is_active'] = False
+                user['ban_reason'] = form.get('ban_reason')
+            elif action == 'unban':
+                # Unban user
+                user['is_active'] = True
+                user.pop('ban_reason', None)
+            else:
+                return None
+            touch_user(user)
+            return True
+
+        if store.update('users.json', int(user_id), apply):
+            flash({'update': 'User updated successfully', 'ban': 'User banned successfully',
+                   'unban': 'User unbanned successfully'}[action], 'success')
+            user_data = store.get('users.json', int(user_id)) or user_data
 
-        if action == 'update':
-            # Update user data
-            user_data['name'] = request.form.get('name')
-            user_data['email'] = request.form.get('email')
-            user_data['balance'] = float(request.form.get('balance'))
-
-            save_data('users.json', users)
-            flash('User updated successfully', 'success')
-        elif action == 'ban':
-            # Ban user
-            reason = request.form.get('ban_reason')
-            user_data['is_active'] = False
-            user_data['ban_reason'] = reason
-
-            save_data('users.json', users)
-            flash('User banned successfully', 'success')
-        elif action == 'unban':
-            # Unban user
-            user_data['is_active'] = True
-            if 'ban_reason' in user_data:
-                del user_data['ban_reason']
-
-            save_data('users.json', users)
-            flash('User unbanned successfully', 'success')
+        # Drop the cached login user so a ban applies to their next request
+        user_cache.invalidate(int(user_id))
 
     positions = get_user_positions(int(user_id))
 
-    # Get user's recent activity
-    deposits = [d for d in load_data('deposits.json') if d.get('user_id') == int(user_id)]
-    withdrawals = [w for w in load_data('withdrawals.json') if w.get('user_id') == int(user_id)]
-    trades = [t for t in load_data('trades.json') if t.get('user_id') == int(user_id)]
+    # Get user's recent activity, the newest page of each history is enough
+    deposits = get_history_page('deposits.json', limit=10, user_id=int(user_id))['items']
+    withdrawals = get_history_page('withdrawals.json', limit=10, user_id=int(user_id))['items']
+    trades = get_history_page('trades.json', limit=10, user_id=int(user_id))['items']
 
     recent_activity = []
     for deposit in deposits:
@@ -477,15 +568,20 @@ def admin_requests():
         flash('Admin login required', 'danger')
         return redirect(url_for('login', type='admin'))
 
-    deposits = load_data('deposits.json')
-    withdrawals = load_data('withdrawals.json')
-
-    pending_deposits = [d for d in deposits if d.get('status') == 'pending']
-    pending_withdrawals = [w for w in withdrawals if w.get('status') == 'pending']
+    # Pending requests a page at a time; each list has its own cursor
+    try:
+        deposits = get_history_page('deposits.json', request.args.get('deposits_cursor'), PAGE_SIZE,
+                                    status='pending', user_id=request.args.get('user', type=int))
+        withdrawals = get_history_page('withdrawals.json', request.args.get('withdrawals_cursor'), PAGE_SIZE,
+                                       status='pending', user_id=request.args.get('user', type=int))
+    except ValueError:
+        return redirect(url_for('admin_requests'))
 
     return render_template('admin/requests.html', 
-                          pending_deposits=pending_deposits,
-                          pending_withdrawals=pending_withdrawals)
+                          pending_deposits=with_usernames(deposits['items']),
+                          pending_withdrawals=with_usernames(withdrawals['items']),
+                          deposits_cursor=deposits['next_cursor'],
+                          withdrawals_cursor=withdrawals['next_cursor'])
 
 @app.route('/admin/request/deposit/<request_id>', methods=['POST'])
 @csrf.exempt
@@ -495,28 +591,34 @@ def admin_deposit_action(request_id):
         return redirect(url_for('login', type='admin'))
 
     action = request.form.get('action')
-    deposits = load_data('deposits.json')
-
-    for deposit in deposits:
-        if str(deposit.get('id')) == request_id:
-            if action == 'approve':
-                deposit['status'] = 'approved'
-                deposit['approved_date'] = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-
-                # Add amount to user's balance
-                adjust_balance(deposit.get('user_id'), deposit.get('amount'))
-
-                flash('Deposit approved successfully', 'success')
-            elif action == 'reject':
-                reason = request.form.get('reject_reason')
-                deposit['status'] = 'rejected'
-                deposit['rejected_date'] = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                deposit['reject_reason'] = reason
-
-                flash('Deposit rejected successfully', 'success')
-
-            save_data('deposits.json', deposits)
-            break
+    reason = request.form.get('reject_reason')
+    if action not in ('approve', 'reject'):
+        return redirect(url_for('admin_requests'))
+
+    # The status is checked and changed under the deposits lock
+    def apply(deposit):
+        if deposit.get('status') != 'pending':
+            return None
+        now = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        if action == 'approve':
+            deposit['status'] = 'approved'
+            deposit['approved_date'] = now
+        else:
+            deposit['status'] = 'rejected'
+            deposit['rejected_date'] = now
+            deposit['reject_reason'] = reason
+        return (deposit.get('user_id'), deposit.get('amount'))
+
+    credit = store.update('deposits.json', request_id, apply)
+    if credit is None:
+        # Already handled, possibly by a concurrent request
+        flash('Request was already processed', 'warning')
+    elif action == 'approve':
+        # Add amount to user's balance once the approval is saved
+        adjust_balance(*credit)
+        flash('Deposit approved successfully', 'success')
+    else:
+        flash('Deposit rejected successfully', 'success')
 
     return redirect(url_for('admin_requests'))
 
@@ -528,28 +630,34 @@ def admin_withdrawal_action(request_id):
         return redirect(url_for('login', type='admin'))
 
     action = request.form.get('action')
-    withdrawals = load_data('withdrawals.json')
-
-    for withdrawal in withdrawals:
-        if str(withdrawal.get('id')) == request_id:
-            if action == 'approve':
-                withdrawal['status'] = 'approved'
-                withdrawal['approved_date'] = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-
-                flash('Withdrawal approved successfully', 'success')
-            elif action == 'reject':
-                reason = request.form.get('reject_reason')
-                withdrawal['status'] = 'rejected'
-                withdrawal['rejected_date'] = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                withdrawal['reject_reason'] = reason
-
-                # Refund amount to user's balance
-                adjust_balance(withdrawal.get('user_id'), withdrawal.get('amount'))
-
-                flash('Withdrawal rejected successfully', 'success')
-
-            save_data('withdrawals.json', withdrawals)
-            break
+    reason = request.form.get('reject_reason')
+    if action not in ('approve', 'reject'):
+        return redirect(url_for('admin_requests'))
+
+    # The status is checked and changed under the withdrawals lock
+    def apply(withdrawal):
+        if withdrawal.get('status') != 'pending':
+            return None
+        now = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        if action == 'approve':
+            withdrawal['status'] = 'approved'
+            withdrawal['approved_date'] = now
+        else:
+            withdrawal['status'] = 'rejected'
+            withdrawal['rejected_date'] = now
+            withdrawal['reject_reason'] = reason
+        return (withdrawal.get('user_id'), withdrawal.get('amount'))
+
+    refund = store.update('withdrawals.json', request_id, apply)
+    if refund is None:
+        # Already handled, possibly by a concurrent request
+        flash('Request was already processed', 'warning')
+    elif action == 'approve':
+        flash('Withdrawal approved successfully', 'success')
+    else:
+        # Refund amount to user's balance once the rejection is saved
+        adjust_balance(*refund)
+        flash('Withdrawal rejected successfully', 'success')
 
     return redirect(url_for('admin_requests'))
 
@@ -578,9 +686,8 @@ def admin_price():
             if result and result.get('success'):
                 flash(f'Price updated successfully for {duration} minutes', 'success')
 
-                # Reload the prices to make sure we have the latest
-                updated_prices = load_prices()
-                current_price = updated_prices.get(f"{coin}/USDT")
+                # Read back the effective price
+                current_price = get_price(f"{coin}/USDT")
 
                 # Log success with details
                 app.logger.info(f"Admin price change: {coin} to {current_price}$ for {duration} minutes")
@@ -591,7 +698,7 @@ def admin_price():
                         'success': True, 
                         'message': f'Price updated successfully for {duration} minutes',
                         'coin': coin,
-                        'price': current_price,  # Use the actual price from updated_prices
+                        'price': current_price,  # Effective price after the override
                         'duration': duration
                     })
             else:
@@ -614,37 +721,216 @@ def admin_positions():
     # Get position statistics
     position_analysis = get_positions_analysis()
 
-    # Get all positions
-    trades = load_data('trades.json')
-
-    # Get user information for positions
-    users = {user.id: user for user in get_all_users()}
-
-    for trade in trades:
-        user_id = trade.get('user_id')
-        if user_id in users:
-            trade['username'] = users[user_id].username
-        else:
-            trade['username'] = "Unknown"
+    # Get one page of positions, including archived history
+    try:
+        page = history_page('trades.json', ('coin', 'status', 'type', 'user'))
+    except ValueError:
+        return redirect(url_for('admin_positions'))
 
     return render_template('admin/positions.html', 
                           position_analysis=position_analysis,
-                          trades=trades,
+                          trades=with_usernames(page['items']),
+                          next_cursor=page['next_cursor'],
+                          filters=page['filters'],
                           SUPPORTED_COINS=SUPPORTED_COINS)
 
+def admin_close_positions(position_ids):
+    """Close positions for an admin action and flash the outcome"""
+    if not position_ids:
+        flash('No open positions', 'warning')
+        return
+
+    try:
+        prices = get_trade_prices()
+    except StalePricesError:
+        flash('Prices are out of date, please try again', 'danger')
+        return
+
+    results = close_positions(position_ids, prices)
+    closed = sum(1 for result in results.values() if result.get('success'))
+    flash(f'{closed} positions closed', 'success')
+
+@app.route('/admin/positions/close-coin/<coin>', methods=['POST'])
+@csrf.exempt
+def admin_close_coin_positions(coin):
+    if 'admin' not in session:
+        flash('Admin login required', 'danger')
+        return redirect(url_for('login', type='admin'))
+
+    if coin not in SUPPORTED_COINS:
+        flash('Invalid cryptocurrency', 'danger')
+    else:
+        admin_close_positions(get_open_position_ids(coin=coin))
+
+    return redirect(url_for('admin_positions'))
+
+@app.route('/admin/user/<int:user_id>/close-positions', methods=['POST'])
+@csrf.exempt
+def admin_close_user_positions(user_id):
+    if 'admin' not in session:
+        flash('Admin login required', 'danger')
+        return redirect(url_for('login', type='admin'))
+
+    admin_close_positions(get_open_position_ids(user_id=user_id))
+    return redirect(url_for('admin_user_detail', user_id=user_id))
+
+@app.route('/admin/api/cache-stats')
+def admin_cache_stats():
+    if 'admin' not in session:
+        return jsonify({'success': False, 'message': 'Admin login required'}), 403
+
+    return jsonify(get_cache_stats())
+
+@app.route('/admin/api/jobs')
+def admin_jobs():
+    if 'admin' not in session:
+        return jsonify({'success': False, 'message': 'Admin login required'}), 403
+
+    return jsonify(get_scheduled_jobs())
+
+@app.route('/admin/api/jobs/<job_id>/cancel', methods=['POST'])
+@csrf.exempt
+def admin_cancel_job(job_id):
+    if 'admin' not in session:
+        return jsonify({'success': False, 'message': 'Admin login required'}), 403
+
+    if cancel_scheduled_job(job_id):
+        return jsonify({'success': True, 'message': 'Job cancelled'})
+    return jsonify({'success': False, 'message': 'Job not found'}), 404
+
+@app.route('/admin/export/<dataset>.<fmt>')
+def admin_export(dataset, fmt):
+    if 'admin' not in session:
+        flash('Admin login required', 'danger')
+        return redirect(url_for('login', type='admin'))
+    if dataset not in EXPORT_FIELDS or fmt not in ('csv', 'jsonl'):
+        return jsonify({'success': False, 'message': 'Unknown export'}), 404
+
+    # Date range as YYYY-MM-DD, both days included
+    try:
+        start = request.args.get('from')
+        end = request.args.get('to')
+        if start:
+            start = datetime.datetime.strptime(start, '%Y-%m-%d').strftime('%Y-%m-%d 00:00:00')
+        if end:
+            end = datetime.datetime.strptime(end, '%Y-%m-%d').strftime('%Y-%m-%d 23:59:59')
+    except ValueError:
+        return jsonify({'success': False, 'message': 'Dates must be YYYY-MM-DD'}), 400
+
+    records = iter_export(f'{dataset}.json', start or None, end or None,
+                          user_id=request.args.get('user', type=int),
+                          status=request.args.get('status') or None)
+    if fmt == 'csv':
+        body, mimetype = csv_chunks(records, EXPORT_FIELDS[dataset]), 'text/csv'
+    else:
+        body, mimetype = jsonl_chunks(records), 'application/x-ndjson'
+
+    # No Content-Length, so the body goes out with chunked transfer encoding
+    return Response(stream_with_context(body), mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename={dataset}.{fmt}',
+                             'X-Accel-Buffering': 'no'})
+
+@app.route('/admin/api/positions')
+def admin_positions_page():
+    if 'admin' not in session:
+        return jsonify({'success': False, 'message': 'Admin login required'}), 403
+
+    try:
+        page = history_page('trades.json', ('coin', 'status', 'type', 'user'))
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    with_usernames(page['items'])
+    return jsonify(page)
+
+@app.route('/admin/api/requests/<kind>')
+def admin_requests_page(kind):
+    if 'admin' not in session:
+        return jsonify({'success': False, 'message': 'Admin login required'}), 403
+    if kind not in ('deposits', 'withdrawals'):
+        return jsonify({'success': False, 'message': 'Unknown request type'}), 404
+
+    try:
+        page = history_page(f'{kind}.json', ('status', 'user'))
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    with_usernames(page['items'])
+    return jsonify(page)
+
 # API routes
+
+# Most users whose last /api/positions ETag is remembered for early 304s
+POSITIONS_ETAG_CACHE_SIZE = int(os.environ.get('POSITIONS_ETAG_CACHE_SIZE', 10000))
+
+# /api/prices body, serialized once per price version
+prices_body = VersionedBody()
+
 @app.route('/api/prices')
 @csrf.exempt
 def api_prices():
-    prices = load_prices()
-    return jsonify(prices)
+    snapshot = price_service.snapshot()
+    version = (snapshot.version, snapshot.overrides_version)
+    body = prices_body.get(version, lambda: dict(snapshot.prices))
+    return json_response(body, f"prices-{body.etag}")
+
+@app.route('/api/stream')
+@csrf.exempt
+def api_stream():
+    # Prices for everyone, position events for the logged-in user
+    user_id = current_user.id if current_user.is_authenticated else None
+    subscription = broadcaster.subscribe(user_id)
+    return Response(stream_with_context(broadcaster.stream(subscription)),
+                    mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/api/candles/<coin>')
+@csrf.exempt
+def api_candles(coin):
+    if coin not in SUPPORTED_COINS:
+        return jsonify({'success': False, 'message': 'Invalid cryptocurrency'}), 404
+
+    interval = request.args.get('interval', '1m')
+    if interval not in CANDLE_INTERVALS:
+        return jsonify({'success': False, 'message': f"Interval must be one of {', '.join(CANDLE_INTERVALS)}"}), 400
+
+    limit = min(max(request.args.get('limit', 100, type=int), 1), 1000)
+    candles = price_history.candles(f"{coin}/USDT", CANDLE_INTERVALS[interval], limit)
+    return jsonify({'coin': coin, 'interval': interval, 'candles': candles})
+
+@app.route('/api/deposits')
+@login_required
+def api_deposits():
+    try:
+        return jsonify(history_page('deposits.json', ('status',), user_id=current_user.id))
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+
+@app.route('/api/withdrawals')
+@login_required
+def api_withdrawals():
+    try:
+        return jsonify(history_page('withdrawals.json', ('status',), user_id=current_user.id))
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+
+# {user_id: (versions, etag)} of the last /api/positions body, oldest first
+positions_etags = {}
 
 @app.route('/api/positions')
 @login_required
 @csrf.exempt
 def api_positions():
+    # The ETag hashes the body, so it holds across workers and restarts.
+    # The versions it was built at (only meaningful in this process) let an
+    # unchanged client get its 304 before trades are read
+    snapshot = price_service.snapshot()
+    versions = (snapshot.version, snapshot.overrides_version, get_data_version('trades.json'))
+    cached = positions_etags.get(current_user.id)
+    if cached is not None and cached[0] == versions and is_fresh(cached[1]):
+        return not_modified(cached[1])
+
+    # Take profit, stop loss and liquidation are settled by the risk engine
     positions = get_user_positions(current_user.id)
-    prices = load_prices()
+    prices = dict(snapshot.prices)
 
     # Include current price for each position
     for position in positions:
@@ -670,52 +956,50 @@ def api_positions():
                 position['current_profit_loss'] = round(profit_loss, 2)
                 position['price_change_percentage'] = round(price_change_percentage * 100, 2)
 
-                # Check if take profit or stop loss has been hit
-                take_profit = position.get('take_profit')
-                stop_loss = position.get('stop_loss')
-
-                if position_type == 'long':
-                    # For long positions
-                    if take_profit is not None and current_price >= float(take_profit):
-                        # Take profit hit for long position
-                        result = close_position(position['id'], current_price)
-                        if result:
-                            adjust_balance(current_user.id, result.get('profit_loss', 0))
-                            position['status'] = 'closed'
-                            position['close_price'] = current_price
-                            position['profit_loss'] = result.get('profit_loss', 0)
-                            position['close_reason'] = 'take_profit'
-                    elif stop_loss is not None and current_price <= float(stop_loss):
-                        # Stop loss hit for long position
-                        result = close_position(position['id'], current_price)
-                        if result:
-                            adjust_balance(current_user.id, result.get('profit_loss', 0))
-                            position['status'] = 'closed'
-                            position['close_price'] = current_price
-                            position['profit_loss'] = result.get('profit_loss', 0)
-                            position['close_reason'] = 'stop_loss'
-                else:  # short position
-                    # For short positions
-                    if take_profit is not None and current_price <= float(take_profit):
-                        # Take profit hit for short position
-                        result = close_position(position['id'], current_price)
-                        if result:
-                            adjust_balance(current_user.id, result.get('profit_loss', 0))
-                            position['status'] = 'closed'
-                            position['close_price'] = current_price
-                            position['profit_loss'] = result.get('profit_loss', 0)
-                            position['close_reason'] = 'take_profit'
-                    elif stop_loss is not None and current_price >= float(stop_loss):
-                        # Stop loss hit for short position
-                        result = close_position(position['id'], current_price)
-                        if result:
-                            adjust_balance(current_user.id, result.get('profit_loss', 0))
-                            position['status'] = 'closed'
-                            position['close_price'] = current_price
-                            position['profit_loss'] = result.get('profit_loss', 0)
-                            position['close_reason'] = 'stop_loss'
-
-    return jsonify(positions)
+    body = SerializedBody(positions)
+    etag = f"positions-{body.etag}"
+    positions_etags.pop(current_user.id, None)
+    positions_etags[current_user.id] = (versions, etag)
+    if len(positions_etags) > POSITIONS_ETAG_CACHE_SIZE:
+        positions_etags.pop(next(iter(positions_etags)), None)
+    return json_response(body, etag)
+
+# CLI commands
+@app.cli.command('convert-data')
+@click.argument('fmt', type=click.Choice(FORMATS))
+def convert_data_command(fmt):
+    """Rewrite all data files as json, compact or msgpack"""
+    for filename, old_format, size_before, size_after in convert_data_format(fmt):
+        click.echo(f"{filename}: {old_format} -> {fmt} ({size_before} -> {size_after} bytes)")
+    click.echo(f"Set DATA_FORMAT={fmt} so new writes use the same format")
+
+@app.cli.command('rebuild-position-stats')
+def rebuild_position_stats_command():
+    """Recompute the position statistics from every trade"""
+    stats = ensure_position_stats(rebuild=True).get()
+    click.echo(f"Counted {stats['total_positions']} positions ({stats['open_count']} open)")
+
+@app.cli.command('check-position-stats')
+def check_position_stats_command():
+    """Compare the position statistics with a full scan of the trades"""
+    differences = check_position_stats()
+    for name, (stored, scanned) in differences.items():
+        click.echo(f"{name}: stored {stored}, scanned {scanned}")
+    if differences:
+        raise click.ClickException("Position statistics are out of date; run rebuild-position-stats")
+    click.echo("Position statistics match the trades")
+
+@app.cli.command('rebuild-leaderboard')
+def rebuild_leaderboard_command():
+    """Recompute the per-user trading totals behind the leaderboard"""
+    board = ensure_leaderboard(rebuild=True)
+    click.echo(f"Ranked {len(load_data(board.filename))} traders")
+
+@app.cli.command('archive-data')
+def archive_data_command():
+    """Move settled trades, deposits and withdrawals into monthly partitions"""
+    for filename, moved in archive_settled_records().items():
+        click.echo(f"{filename}: archived {moved} records")
 
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000, debug=True)
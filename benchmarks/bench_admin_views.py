@@ -0,0 +1,101 @@
+"""Compare per-user and bulk loading of the admin dashboard and user management data
+
+Fills a temporary data directory with users and trades, then times building
+the data of both views the old way (a balance and a positions read per user)
+and with the bulk loaders (one pass per data file).
+
+Usage: python benchmarks/bench_admin_views.py [--users 100,300,1000] [--trades-per-user 20]
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+COINS = ["BTC", "ETH", "ETC", "LTC", "BNB", "TRX", "PEPE", "AAVE", "DOGE",
+         "SOL", "ADA", "AVAX", "SHIB", "TON", "POL", "FIL", "ATOM"]
+
+
+def generate(users, trades_per_user, seed=1):
+    rng = random.Random(seed)
+    user_records = [{
+        'id': user_id,
+        'username': f"user{user_id}",
+        'email': f"user{user_id}@example.com",
+        'name': f"User {user_id}",
+        'password_hash': '',
+        'balance': round(rng.uniform(0, 10000), 2),
+        'is_active': True,
+        'registered_date': '2024-05-01 12:00:00'
+    } for user_id in range(1, users + 1)]
+    trades = [{
+        'id': f"{i:08x}-0000-4000-8000-{rng.getrandbits(48):012x}",
+        'user_id': rng.randint(1, users),
+        'coin': rng.choice(COINS),
+        'amount': round(rng.uniform(10, 5000), 2),
+        'leverage': rng.choice([1, 2, 5, 10, 20]),
+        'entry_price': 100.0,
+        'liquidation_price': 50.0,
+        'type': rng.choice(['long', 'short']),
+        'status': 'open' if rng.random() < 0.2 else 'closed',
+        'open_date': '2024-05-01 12:00:00'
+    } for i in range(users * trades_per_user)]
+    return user_records, trades
+
+
+def per_user(models, utils):
+    """The admin views before the bulk loaders"""
+    users = models.get_all_users()
+    total_balance = sum(utils.get_user_balance(user.id) for user in users)
+    rows = [{'user': user, 'balance': utils.get_user_balance(user.id),
+             'positions': models.get_user_positions(user.id)} for user in users]
+    return total_balance, rows
+
+
+def bulk(models, utils):
+    summaries = models.get_account_summaries()
+    return sum(summary['balance'] for summary in summaries), summaries
+
+
+def timed(fn, *args, repeat=3):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', default='100,300,1000')
+    parser.add_argument('--trades-per-user', type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        # utils keeps its data directory relative to the working directory
+        os.chdir(directory)
+        import utils
+        import models
+
+        print(f"backend: {utils.store.name}")
+        print(f"{'users':>7} {'trades':>9} {'per-user s':>11} {'bulk s':>9} {'speedup':>8}")
+        for users in [int(u) for u in args.users.split(',')]:
+            user_records, trades = generate(users, args.trades_per_user)
+            utils.save_data('users.json', user_records, wait=True)
+            utils.save_data('trades.json', trades, wait=True)
+
+            slow, (slow_total, slow_rows) = timed(per_user, models, utils, repeat=1)
+            fast, (fast_total, fast_rows) = timed(bulk, models, utils)
+            assert round(slow_total, 2) == round(fast_total, 2)
+            assert [len(row['positions']) for row in slow_rows] == [len(row['positions']) for row in fast_rows]
+            print(f"{users:>7} {len(trades):>9} {slow:>11.3f} {fast:>9.3f} {slow / fast:>7.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+"""Compare load/save time and on-disk size of the data file formats
+
+Usage: python benchmarks/bench_serialization.py [--sizes 10000,100000,1000000]
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import serialization  # noqa: E402
+
+COINS = ["BTC", "ETH", "ETC", "LTC", "BNB", "TRX", "PEPE", "AAVE", "DOGE",
+         "SOL", "ADA", "AVAX", "SHIB", "TON", "POL", "FIL", "ATOM"]
+
+
+def generate_trades(count, seed=1):
+    """Generate trade records shaped like the ones create_position/close_position write"""
+    rng = random.Random(seed)
+    trades = []
+    for i in range(count):
+        entry_price = rng.uniform(0.1, 60000)
+        leverage = rng.choice([1, 2, 5, 10, 20, 50, 100])
+        position_type = rng.choice(['long', 'short'])
+        trade = {
+            'id': f"{i:08x}-0000-4000-8000-{rng.getrandbits(48):012x}",
+            'user_id': rng.randint(1, max(count // 20, 1)),
+            'coin': rng.choice(COINS),
+            'amount': round(rng.uniform(10, 5000), 2),
+            'leverage': leverage,
+            'entry_price': entry_price,
+            'liquidation_price': entry_price * (1 - 1 / leverage if position_type == 'long' else 1 + 1 / leverage),
+            'take_profit': None,
+            'stop_loss': None,
+            'type': position_type,
+            'status': 'open',
+            'open_date': '2024-05-01 12:00:00'
+        }
+        if rng.random() < 0.8:
+            close_price = entry_price * rng.uniform(0.9, 1.1)
+            trade.update({
+                'status': 'closed',
+                'close_price': close_price,
+                'profit_loss': round(rng.uniform(-500, 500), 2),
+                'close_date': '2024-05-02 12:00:00',
+                'price_change_percentage': round(rng.uniform(-10, 10), 2)
+            })
+        trades.append(trade)
+    return trades
+
+
+def bench(trades, fmt, directory):
+    path = os.path.join(directory, f"trades.{fmt}")
+
+    start = time.perf_counter()
+    content = serialization.dumps(trades, fmt)
+    with open(path, 'wb') as f:
+        f.write(content)
+    save_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    with open(path, 'rb') as f:
+        loaded = serialization.loads(f.read())
+    load_time = time.perf_counter() - start
+
+    assert len(loaded) == len(trades)
+    return save_time, load_time, os.path.getsize(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', default='10000,100000,1000000')
+    args = parser.parse_args()
+
+    formats = [fmt for fmt in serialization.FORMATS
+               if fmt != 'msgpack' or serialization.msgpack is not None]
+    print(f"orjson: {'yes' if serialization.orjson else 'no'}, "
+          f"msgpack: {'yes' if serialization.msgpack else 'no'}")
+    print(f"{'trades':>9}  {'format':<8} {'save s':>8} {'load s':>8} {'size MB':>9}")
+
+    with tempfile.TemporaryDirectory() as directory:
+        for size in [int(s) for s in args.sizes.split(',')]:
+            trades = generate_trades(size)
+            for fmt in formats:
+                save_time, load_time, file_size = bench(trades, fmt, directory)
+                print(f"{size:>9}  {fmt:<8} {save_time:>8.3f} {load_time:>8.3f} {file_size / 1e6:>9.2f}")
+
+
+if __name__ == '__main__':
+    main()
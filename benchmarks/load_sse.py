@@ -0,0 +1,84 @@
+"""Load test for the /api/stream Server-Sent Events endpoint
+
+Starts the app on a local threaded server, opens many stream connections
+and publishes synthetic price updates through the broadcaster, then reports
+connections and events per second received by the clients.
+
+Usage: python benchmarks/load_sse.py [--clients 200] [--rate 20] [--duration 10]
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import threading
+import http.client
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from werkzeug.serving import make_server  # noqa: E402
+from app import app  # noqa: E402
+from prices import PriceSnapshot  # noqa: E402
+from utils import broadcaster, DEFAULT_PRICES  # noqa: E402
+
+
+def client(port, counts, index, connected, stop):
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+    conn.request('GET', '/api/stream')
+    response = conn.getresponse()
+    connected.release()
+    while not stop.is_set():
+        line = response.readline()
+        if not line:
+            break
+        if line.startswith(b'event: '):
+            counts[index] += 1
+    conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--clients', type=int, default=200)
+    parser.add_argument('--rate', type=float, default=20, help='price updates published per second')
+    parser.add_argument('--duration', type=float, default=10)
+    args = parser.parse_args()
+
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    counts = [0] * args.clients
+    connected = threading.Semaphore(0)
+    stop = threading.Event()
+    start = time.perf_counter()
+    for i in range(args.clients):
+        threading.Thread(target=client, args=(server.port, counts, i, connected, stop), daemon=True).start()
+    for _ in range(args.clients):
+        connected.acquire()
+    connect_time = time.perf_counter() - start
+    print(f"{args.clients} connections in {connect_time:.2f}s ({args.clients / connect_time:.0f}/s), "
+          f"broadcaster sees {broadcaster.stats()['connections']}")
+
+    prices = dict(DEFAULT_PRICES)
+    base = sum(counts)
+    published = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < args.duration:
+        pair = random.choice(list(prices))
+        prices[pair] *= 1 + random.uniform(-0.01, 0.01)
+        published += 1
+        broadcaster.publish_prices(PriceSnapshot(prices, 1_000_000 + published, time.time()))
+        time.sleep(1 / args.rate)
+    elapsed = time.perf_counter() - start
+    time.sleep(0.5)
+
+    received = sum(counts) - base
+    print(f"published {published} events ({published / elapsed:.0f}/s), "
+          f"clients received {received} ({received / elapsed:.0f}/s, "
+          f"{received / max(published * args.clients, 1) * 100:.1f}% delivered)")
+
+    stop.set()
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
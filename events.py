@@ -0,0 +1,121 @@
+import os
+import json
+import queue
+import threading
+import logging
+
+# Events buffered per connection before it is told to resync
+SSE_QUEUE_SIZE = int(os.environ.get('SSE_QUEUE_SIZE', 100))
+
+# Seconds between keep-alive comments on an idle stream
+SSE_HEARTBEAT = float(os.environ.get('SSE_HEARTBEAT', 15))
+
+
+def format_event(event, data):
+    """Encode one Server-Sent Event"""
+    return f"event: {event}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n"
+
+
+class Subscription:
+    """One stream connection: a bounded queue of encoded events"""
+
+    def __init__(self, user_id, size):
+        self.user_id = user_id
+        self.queue = queue.Queue(maxsize=size)
+        self.dropped = 0
+
+    def put(self, message):
+        try:
+            self.queue.put_nowait(message)
+        except queue.Full:
+            # The client is too slow; replace the backlog with a resync
+            self.dropped += 1
+            while True:
+                try:
+                    self.queue.get_nowait()
+                except queue.Empty:
+                    break
+            self.queue.put_nowait(format_event('resync', {}))
+
+
+class EventBroadcaster:
+    """In-process fan-out of price and position events to stream clients
+
+    Every event is encoded once and pushed onto the queue of each
+    subscriber it concerns: price diffs go to everyone, position events
+    only to the owner's connections. Queues are bounded, so a connection
+    holds constant memory no matter how slow its client is. Only events of
+    this process are seen; with several workers each streams its own.
+    """
+
+    def __init__(self, queue_size=SSE_QUEUE_SIZE, heartbeat=SSE_HEARTBEAT):
+        self.queue_size = queue_size
+        self.heartbeat = heartbeat
+        self._subscribers = set()
+        self._by_user = {}
+        self._lock = threading.Lock()
+        self._prices = {}
+        self._price_version = None
+        self.published = 0
+
+    def subscribe(self, user_id=None):
+        subscription = Subscription(user_id, self.queue_size)
+        with self._lock:
+            self._subscribers.add(subscription)
+            if user_id is not None:
+                self._by_user.setdefault(user_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+            subscriptions = self._by_user.get(subscription.user_id)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self._by_user[subscription.user_id]
+
+    def publish(self, event, data, user_id=None):
+        """Send an event to every subscriber, or only to one user's"""
+        message = format_event(event, data)
+        with self._lock:
+            targets = list(self._subscribers if user_id is None else self._by_user.get(user_id, ()))
+        for subscription in targets:
+            subscription.put(message)
+        self.published += 1
+
+    def publish_prices(self, snapshot):
+        """Send the pairs that changed since the last price event"""
+        with self._lock:
+            changed = {pair: price for pair, price in snapshot.prices.items() if self._prices.get(pair) != price}
+            self._prices = dict(snapshot.prices)
+            self._price_version = snapshot.version
+        if changed:
+            self.publish('prices', {'version': snapshot.version, 'timestamp': snapshot.timestamp, 'prices': changed})
+
+    def publish_position(self, event, position):
+        """Send a position event (opened, closed, take_profit, stop_loss, liquidated) to its owner"""
+        self.publish('position', {'event': event, 'position': position}, user_id=position.get('user_id'))
+
+    def stream(self, subscription):
+        """Yield the encoded events of a subscription, starting with all prices"""
+        try:
+            with self._lock:
+                prices, version = dict(self._prices), self._price_version
+            yield format_event('prices', {'version': version, 'prices': prices, 'full': True})
+            while True:
+                try:
+                    yield subscription.queue.get(timeout=self.heartbeat)
+                except queue.Empty:
+                    yield ': keep-alive\n\n'
+        finally:
+            self.unsubscribe(subscription)
+            if subscription.dropped:
+                logging.info(f"Stream for user {subscription.user_id} closed after {subscription.dropped} resyncs")
+
+    def stats(self):
+        return {
+            'connections': len(self._subscribers),
+            'users': len(self._by_user),
+            'published': self.published
+        }
@@ -0,0 +1,46 @@
+import io
+import csv
+import serialization
+
+# CSV columns per dataset; JSONL rows carry every field of the record
+EXPORT_FIELDS = {
+    'trades': ('id', 'user_id', 'coin', 'type', 'status', 'amount', 'leverage', 'entry_price',
+               'liquidation_price', 'take_profit', 'stop_loss', 'close_price', 'profit_loss',
+               'price_change_percentage', 'close_reason', 'open_date', 'close_date'),
+    'deposits': ('id', 'user_id', 'amount', 'tx_hash', 'status', 'date', 'approved_date',
+                 'rejected_date', 'reject_reason'),
+    'withdrawals': ('id', 'user_id', 'amount', 'wallet_address', 'status', 'date', 'approved_date',
+                    'rejected_date', 'reject_reason'),
+}
+
+# Rows encoded per chunk of the response body
+EXPORT_CHUNK_ROWS = 500
+
+
+def csv_chunks(records, fields, chunk_rows=EXPORT_CHUNK_ROWS):
+    """Encode records as CSV with a header row, yielding chunk_rows rows at a time"""
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=fields, extrasaction='ignore')
+    writer.writeheader()
+    rows = 0
+    for record in records:
+        writer.writerow(record)
+        rows += 1
+        if rows % chunk_rows == 0:
+            yield buffer.getvalue().encode()
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+
+def jsonl_chunks(records, chunk_rows=EXPORT_CHUNK_ROWS):
+    """Encode records as JSON lines, yielding chunk_rows lines at a time"""
+    lines = []
+    for record in records:
+        lines.append(serialization.json_dumps(record) + b'\n')
+        if len(lines) == chunk_rows:
+            yield b''.join(lines)
+            lines = []
+    if lines:
+        yield b''.join(lines)
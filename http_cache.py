@@ -0,0 +1,80 @@
+import os
+import gzip
+import hashlib
+import threading
+from flask import Response, request
+import serialization
+
+# Smallest body worth compressing (bytes) and the gzip level used
+GZIP_MIN_SIZE = int(os.environ.get('GZIP_MIN_SIZE', 1024))
+GZIP_LEVEL = int(os.environ.get('GZIP_LEVEL', 6))
+
+
+class SerializedBody:
+    """A JSON body encoded once, with its gzip variant built on first use
+
+    etag is derived from the bytes, so it means the same body in every
+    worker process and across restarts.
+    """
+
+    def __init__(self, data):
+        self.body = serialization.json_dumps(data)
+        self.etag = hashlib.blake2b(self.body, digest_size=12).hexdigest()
+        self._gzipped = None
+        self._lock = threading.Lock()
+
+    @property
+    def gzipped(self):
+        if self._gzipped is None:
+            with self._lock:
+                if self._gzipped is None:
+                    self._gzipped = gzip.compress(self.body, GZIP_LEVEL)
+        return self._gzipped
+
+
+class VersionedBody:
+    """Keeps the serialized body of the latest version of some data"""
+
+    def __init__(self):
+        self._entry = None
+
+    def get(self, version, build):
+        """Get the SerializedBody for version, calling build() for the data on a change"""
+        entry = self._entry
+        if entry is None or entry[0] != version:
+            entry = (version, SerializedBody(build()))
+            self._entry = entry
+        return entry[1]
+
+
+def is_fresh(etag):
+    """Whether the client's If-None-Match already names etag (or its gzip variant)"""
+    matches = request.if_none_match
+    return matches.star_tag or etag in matches or f"{etag}-gz" in matches
+
+
+def not_modified(etag):
+    """Build a 304 response for etag"""
+    response = Response(status=304)
+    response.set_etag(etag)
+    response.headers['Vary'] = 'Accept-Encoding'
+    return response
+
+
+def json_response(body, etag=None):
+    """Send a SerializedBody with its ETag, gzip-compressed if large and accepted
+
+    The gzip variant is a different byte sequence, so it gets its own
+    strong ETag ('<etag>-gz'); is_fresh accepts either.
+    """
+    if etag is not None and is_fresh(etag):
+        return not_modified(etag)
+
+    compress = len(body.body) >= GZIP_MIN_SIZE and 'gzip' in request.accept_encodings
+    response = Response(body.gzipped if compress else body.body, mimetype='application/json')
+    if compress:
+        response.headers['Content-Encoding'] = 'gzip'
+    if etag is not None:
+        response.set_etag(f"{etag}-gz" if compress else etag)
+    response.headers['Vary'] = 'Accept-Encoding'
+    return response
@@ -0,0 +1,261 @@
+import os
+import threading
+import logging
+import serialization
+from writer import FileLock, write_atomic
+
+# Fold the journal into a new snapshot once it grows past this many bytes
+JOURNAL_COMPACT_BYTES = int(os.environ.get('JOURNAL_COMPACT_BYTES', 4 * 1024 * 1024))
+
+
+class TradeJournal:
+    """Trade records kept as a snapshot file plus an append-only JSONL journal
+
+    Each change is one line in the journal ({"event": ..., "trade": {...}}),
+    so opening or closing a position is a single small write. The current
+    state is the snapshot with the journal replayed on top. Replay is
+    idempotent: an "opened" event for a known id is ignored and every other
+    event replaces the record, so replaying a journal over a snapshot that
+    already contains it gives the same state.
+
+    A background thread folds the journal into a new snapshot once it passes
+    compact_bytes. Records held in memory are never mutated in place, only
+    replaced, so they can be shared with readers. Writers hold the file lock
+    of the snapshot, so appends and compactions from several processes
+    interleave safely; readers only take the in-process mutex.
+    """
+
+    def __init__(self, snapshot_path, compact_bytes=JOURNAL_COMPACT_BYTES, fmt=serialization.DATA_FORMAT):
+        self.snapshot_path = snapshot_path
+        self.format = fmt
+        self.journal_path = os.path.splitext(snapshot_path)[0] + '.journal.jsonl'
+        self.compact_bytes = compact_bytes
+        self._mutex = threading.RLock()
+        self.lock = FileLock(snapshot_path)
+        self._records = []
+        self._index = {}
+        self._snapshot_signature = None
+        self._journal_inode = None
+        self._offset = 0
+        self._compact_requested = threading.Event()
+        self._compactor = None
+        self._reload()
+
+    def _signature(self, path):
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+        return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+    def _apply(self, event, record):
+        record_id = record.get('id')
+        position = self._index.get(record_id)
+        if position is None:
+            self._index[record_id] = len(self._records)
+            self._records.append(record)
+        elif event != 'opened':
+            self._records[position] = record
+
+    def _replay(self, raw):
+        """Apply complete journal lines from raw, returning bytes consumed"""
+        consumed = 0
+        for line in raw.splitlines(keepends=True):
+            if not line.endswith(b'\n'):
+                # Torn write at the tail, pick it up once it is complete
+                break
+            consumed += len(line)
+            if not line.strip():
+                continue
+            try:
+                entry = serialization.json_loads(line)
+            except ValueError:
+                logging.error(f"Skipping corrupt line in {self.journal_path}")
+                continue
+            self._apply(entry.get('event'), entry.get('trade', {}))
+        return consumed
+
+    def _inode(self, path):
+        try:
+            return os.stat(path).st_ino
+        except FileNotFoundError:
+            return None
+
+    def _reload(self):
+        """Rebuild state from the snapshot plus the whole journal
+
+        Readers do not take the file lock, so a compaction can replace both
+        files between the two reads. The snapshot is replaced first, so if
+        it is unchanged after the journal was read the pair is consistent;
+        otherwise read both again.
+        """
+        while True:
+            signature = self._signature(self.snapshot_path)
+            records = []
+            if signature is not None:
+                with open(self.snapshot_path, 'rb') as f:
+                    try:
+                        records = serialization.loads(f.read())
+                    except ValueError:
+                        logging.error(f"Error decoding JSON from {self.snapshot_path}")
+
+            self._records = records
+            self._index = {record.get('id'): i for i, record in enumerate(records)}
+            self._snapshot_signature = signature
+            self._journal_inode = None
+            self._offset = 0
+
+            if os.path.exists(self.journal_path):
+                with open(self.journal_path, 'rb') as f:
+                    self._journal_inode = os.fstat(f.fileno()).st_ino
+                    self._offset = self._replay(f.read())
+
+            if self._signature(self.snapshot_path) == signature:
+                return
+
+    def _refresh(self):
+        """Pick up changes written by other processes"""
+        if self._signature(self.snapshot_path) != self._snapshot_signature:
+            self._reload()
+            return
+
+        try:
+            f = open(self.journal_path, 'rb')
+        except FileNotFoundError:
+            if self._journal_inode is not None:
+                self._reload()
+            return
+        with f:
+            stat = os.fstat(f.fileno())
+            # A compaction replaces the journal; offsets into the old one mean nothing
+            if stat.st_ino != self._journal_inode or stat.st_size < self._offset:
+                self._reload()
+            elif stat.st_size > self._offset:
+                f.seek(self._offset)
+                self._offset += self._replay(f.read())
+
+    def version(self):
+        """Get a token that changes whenever the snapshot or the journal changes"""
+        return (self._signature(self.snapshot_path), self._signature(self.journal_path))
+
+    def records(self):
+        """Get the current list of records (shared, do not mutate)"""
+        with self._mutex:
+            self._refresh()
+            return self._records
+
+    def get(self, record_id):
+        with self._mutex:
+            self._refresh()
+            position = self._index.get(record_id)
+            return None if position is None else self._records[position]
+
+    def append(self, event, record):
+        """Record one event with a single write to the journal"""
+        self.append_many([(event, record)])
+
+    def append_many(self, events):
+        """Record (event, record) pairs with a single write to the journal"""
+        if not events:
+            return
+        lines = b''.join(serialization.json_dumps({'event': event, 'trade': record}) + b'\n'
+                         for event, record in events)
+        with self.lock, self._mutex:
+            self._refresh()
+            fd = os.open(self.journal_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, lines)
+                self._journal_inode = os.fstat(fd).st_ino
+            finally:
+                os.close(fd)
+            self._offset += len(lines)
+            for event, record in events:
+                self._apply(event, dict(record))
+
+            if self._offset >= self.compact_bytes:
+                self._request_compaction()
+
+    def update(self, record_id, fn):
+        """Apply fn to a copy of one record and journal it when fn returns a result"""
+        return self.update_many({record_id: fn}).get(record_id)
+
+    def update_many(self, updates):
+        """Apply {record_id: fn} like update and journal all changes in one write
+
+        Returns {record_id: result} for the records fn changed.
+        """
+        with self.lock:
+            results = {}
+            events = []
+            for record_id, fn in updates.items():
+                record = self.get(record_id)
+                if record is None:
+                    continue
+                record = dict(record)
+                result = fn(record)
+                if result is not None:
+                    status = record.get('status')
+                    events.append((status if status in ('closed', 'liquidated') else 'updated', record))
+                    results[record_id] = result
+            self.append_many(events)
+            return results
+
+    def replace(self, records):
+        """Replace all records with a fresh snapshot and an empty journal"""
+        with self.lock, self._mutex:
+            write_atomic(self.snapshot_path, serialization.dumps(records, self.format))
+            write_atomic(self.journal_path, b'')
+            self._reload()
+
+    def compact(self):
+        """Fold the journal into a new snapshot
+
+        The snapshot is serialized outside the lock; only the rename and the
+        copy of the journal tail that arrived meanwhile happen under it.
+        """
+        with self._mutex:
+            self._refresh()
+            records = list(self._records)
+            offset = self._offset
+            signature = (self._snapshot_signature, self._journal_inode)
+
+        tmp_path = f"{self.snapshot_path}.compact.{os.getpid()}"
+        with open(tmp_path, 'wb') as f:
+            f.write(serialization.dumps(records, self.format))
+            f.flush()
+            os.fsync(f.fileno())
+
+        with self.lock, self._mutex:
+            # Replay what other processes appended since, the tail keeps it
+            self._refresh()
+            if (self._snapshot_signature, self._journal_inode) != signature:
+                # Another process compacted or replaced the trades meanwhile,
+                # so offset no longer points into the current journal
+                os.remove(tmp_path)
+                return
+            os.replace(tmp_path, self.snapshot_path)
+            with open(self.journal_path, 'rb') as f:
+                f.seek(offset)
+                tail = f.read()
+            write_atomic(self.journal_path, tail)
+            self._snapshot_signature = self._signature(self.snapshot_path)
+            self._journal_inode = self._inode(self.journal_path)
+            self._offset = len(tail)
+
+        logging.info(f"Compacted {self.journal_path}: {len(records)} records in snapshot, "
+                     f"{len(tail)} bytes left in journal")
+
+    def _request_compaction(self):
+        if self._compactor is None or not self._compactor.is_alive():
+            self._compactor = threading.Thread(target=self._compact_loop, daemon=True)
+            self._compactor.start()
+        self._compact_requested.set()
+
+    def _compact_loop(self):
+        while True:
+            self._compact_requested.wait()
+            self._compact_requested.clear()
+            try:
+                self.compact()
+            except Exception as e:
+                logging.error(f"Error compacting {self.journal_path}: {str(e)}")
@@ -0,0 +1,111 @@
+import heapq
+import logging
+import threading
+
+
+def empty_trader(user_id):
+    return {'id': user_id, 'total_profit': 0.0, 'invested': 0.0, 'wins': 0,
+            'leverage_sum': 0.0, 'trade_count': 0, 'largest_profit': None}
+
+
+def apply_close(trader, trade):
+    """Add one closed trade to a trader's totals"""
+    profit_loss = float(trade.get('profit_loss', 0))
+    trader['total_profit'] += profit_loss
+    trader['invested'] += float(trade.get('amount', 0))
+    trader['wins'] += 1 if profit_loss > 0 else 0
+    trader['leverage_sum'] += float(trade.get('leverage', 1))
+    trader['trade_count'] += 1
+    if trader['largest_profit'] is None or profit_loss > trader['largest_profit']:
+        trader['largest_profit'] = profit_loss
+
+
+def roi(trader):
+    """Return on investment in percent"""
+    return trader['total_profit'] / trader['invested'] * 100 if trader['invested'] > 0 else 0
+
+
+class Leaderboard:
+    """Per-user trading totals, updated as positions close, ranked by ROI
+
+    Every trader with a closed trade has one record in trader_stats.json
+    with their total profit, amount invested, winning trades, leverage sum,
+    trade count and largest profit. Closing positions updates only the
+    records of the traders involved, in one write per batch. top() pops the
+    best ROIs off a heap and keeps the result until record() or rebuild()
+    runs here or the stats change version (another process wrote them), so
+    serving the leaderboard does not depend on the number of users or trades.
+    """
+
+    def __init__(self, store, filename='trader_stats.json'):
+        self.store = store
+        self.filename = filename
+        self.generation = 0
+        self._cache = None
+        self._lock = threading.Lock()
+
+    def record(self, trades):
+        """Add closed trades to their owners' totals"""
+        by_user = {}
+        for trade in trades:
+            if trade.get('status') == 'closed':
+                by_user.setdefault(trade.get('user_id'), []).append(trade)
+        if not by_user:
+            return
+
+        def adder(user_trades):
+            def apply(trader):
+                for trade in user_trades:
+                    apply_close(trader, trade)
+                return True
+            return apply
+
+        try:
+            updated = self.store.update_many(self.filename, {user_id: adder(user_trades)
+                                                             for user_id, user_trades in by_user.items()})
+            for user_id, user_trades in by_user.items():
+                if user_id in updated:
+                    continue
+                trader = empty_trader(user_id)
+                adder(user_trades)(trader)
+                # Another process may have added the trader meanwhile
+                if not self.store.insert(self.filename, trader, unique=('id',)):
+                    self.store.update(self.filename, user_id, adder(user_trades))
+        except Exception as e:
+            logging.error(f"Error updating trader statistics: {str(e)}")
+        self.generation += 1
+
+    def rebuild(self, trades):
+        """Recompute every trader's totals from all trades"""
+        index = {}
+        for trade in trades:
+            if trade.get('status') == 'closed':
+                user_id = trade.get('user_id')
+                if user_id not in index:
+                    index[user_id] = empty_trader(user_id)
+                apply_close(index[user_id], trade)
+        self.store.save(self.filename, list(index.values()), wait=True)
+        self.generation += 1
+        return len(index)
+
+    def top(self, limit, describe):
+        """Get the limit best traders by ROI
+
+        describe(trader) turns a record into a leaderboard row, or returns
+        None to leave the trader out (unknown or admin users).
+        """
+        key = (self.generation, self.store.version(self.filename), limit)
+        cache = self._cache
+        if cache is not None and cache[0] == key:
+            return cache[1]
+
+        with self._lock:
+            heap = [(-roi(trader), i, trader) for i, trader in enumerate(self.store.load(self.filename))]
+            heapq.heapify(heap)
+            rows = []
+            while heap and len(rows) < limit:
+                row = describe(heapq.heappop(heap)[2])
+                if row is not None:
+                    rows.append(row)
+            self._cache = (key, rows)
+        return rows
@@ -4,7 +4,8 @@ import datetime
 import uuid
 from werkzeug.security import generate_password_hash
 from flask_login import UserMixin
-from utils import load_data, save_data
+from utils import load_data, store, user_cache
+from user_cache import touch_user
 
 class User(UserMixin):
     def __init__(self, user_data):
@@ -36,36 +37,71 @@ class User(UserMixin):
     def is_active(self, value):
         self._is_active = value
 
+class UserDirectory:
+    """Users indexed by id, username and email, plus the user ID sequence
+
+    Lookups go through the storage backend's hash indexes (JSON) or table
+    indexes (SQLite), which writes to users.json keep up to date. New IDs
+    come from a persisted counter instead of a max() over all users.
+    """
+
+    def __init__(self, store):
+        self.store = store
+
+    def get_by_id(self, user_id):
+        return self.store.lookup('users.json', 'id', user_id)
+
+    def get_by_username(self, username):
+        return self.store.lookup('users.json', 'username', username)
+
+    def get_by_email(self, email):
+        return self.store.lookup('users.json', 'email', email)
+
+    def next_id(self):
+        """Reserve the next user ID"""
+        def bump(sequences):
+            for sequence in sequences:
+                if sequence.get('id') == 'users':
+                    sequence['value'] += 1
+                    return sequence['value']
+            
+            # First use: continue after the highest existing ID
+            value = max((user.get('id', 0) for user in self.store.load('users.json')), default=0) + 1
+            sequences.append({'id': 'users', 'value': value})
+            return value
+        
+        return self.store.mutate('sequences.json', bump, wait=True)
+
+user_directory = UserDirectory(store)
+
 def get_all_users():
     users_data = load_data('users.json')
     return [User(user) for user in users_data]
 
 def get_user_by_username(username):
-    users_data = load_data('users.json')
-    for user_data in users_data:
-        if user_data.get('username') == username:
-            return User(user_data)
+    user_data = user_directory.get_by_username(username)
+    if user_data:
+        return User(user_data)
     return None
 
 def get_user_by_id(user_id):
-    users_data = load_data('users.json')
-    for user_data in users_data:
-        if user_data.get('id') == user_id:
-            return User(user_data)
+    user_data = user_directory.get_by_id(user_id)
+    if user_data:
+        return User(user_data)
     return None
 
+def get_cached_user(user_id):
+    """Get a User through the login cache (for flask_login's user loader)"""
+    return user_cache.get(user_id, get_user_by_id)
+
 def create_user(user_data):
-    users = load_data('users.json')
-    
     # Check if username or email already exists
-    for user in users:
-        if user.get('username') == user_data.get('username') or user.get('email') == user_data.get('email'):
-            return None
+    if (user_directory.get_by_username(user_data.get('username'))
+            or user_directory.get_by_email(user_data.get('email'))):
+        return None
     
     # Generate user ID
-    user_id = 1
-    if users:
-        user_id = max(user.get('id', 0) for user in users) + 1
+    user_id = user_directory.next_id()
     
     # Hash password
     password = user_data.get('password_hash')
@@ -74,30 +110,45 @@ def create_user(user_data):
     # Add ID to user data
     user_data['id'] = user_id
     
-    # Add user to users list
-    users.append(user_data)
-    
-    # Save users data
-    save_data('users.json', users)
+    # Add user to users; the insert checks again under the users lock, so of
+    # two concurrent registrations with the same username or email only one wins
+    if not store.insert('users.json', user_data, unique=('username', 'email')):
+        return None
     
     return User(user_data)
 
 def update_user(user_id, update_data):
-    users = load_data('users.json')
-    
-    for user in users:
-        if user.get('id') == user_id:
-            for key, value in update_data.items():
-                if key == 'password':
-                    user['password_hash'] = generate_password_hash(value)
-                else:
-                    user[key] = value
-            
-            save_data('users.json', users)
-            return True
+    def apply(user):
+        for key, value in update_data.items():
+            if key == 'password':
+                user['password_hash'] = generate_password_hash(value)
+            else:
+                user[key] = value
+        touch_user(user)
+        return True
     
-    return False
+    updated = store.update('users.json', user_id, apply) or False
+    user_cache.invalidate(user_id)
+    return updated
 
 def get_user_positions(user_id):
-    trades = load_data('trades.json')
-    return [trade for trade in trades if trade.get('user_id') == user_id and trade.get('status') == 'open']
+    return store.find('trades.json', user_id=user_id, status='open')
+
+def get_open_positions_grouped_by_user():
+    """Get {user_id: [open positions]} with one pass over the open trades"""
+    grouped = {}
+    for position in store.find('trades.json', status='open'):
+        grouped.setdefault(position.get('user_id'), []).append(position)
+    return grouped
+
+def get_account_summaries():
+    """Get every user with their balance and open positions
+    
+    Reads users.json and the open trades once each instead of once per user.
+    """
+    positions = get_open_positions_grouped_by_user()
+    return [{
+        'user': User(user_data),
+        'balance': user_data.get('balance', 0),
+        'positions': positions.get(user_data.get('id'), [])
+    } for user_data in load_data('users.json')]
@@ -0,0 +1,166 @@
+import os
+import re
+import datetime
+import logging
+
+# Settled records stay in the live file this long before being archived
+ARCHIVE_RETENTION_DAYS = float(os.environ.get('ARCHIVE_RETENTION_DAYS', 0))
+
+# Collections split into a live file and monthly archive partitions:
+# filename -> (statuses that are settled, fields holding the settle date)
+PARTITIONED = {
+    'trades.json': (('closed', 'liquidated'), ('close_date', 'open_date')),
+    'deposits.json': (('approved', 'rejected'), ('approved_date', 'rejected_date', 'date')),
+    'withdrawals.json': (('approved', 'rejected'), ('approved_date', 'rejected_date', 'date')),
+}
+
+
+def settled_at(record, fields):
+    """Get the date a record settled on ('%Y-%m-%d %H:%M:%S')"""
+    for field in fields:
+        if record.get(field):
+            return record[field]
+    return ''
+
+
+class PartitionArchive:
+    """Monthly archive partitions for settled records
+
+    The live file of a collection keeps only what hot paths need (open
+    positions, pending deposits and withdrawals). Once a record settles and
+    its retention passes, archive() moves it to archive/<name>-<YYYY-MM>.json
+    by settle month. History views read partitions one at a time through
+    iter_records. Partitions are plain data files of the storage backend, so
+    they share its format, parse cache and file locks.
+
+    archive/<name>-users.json lists the months holding each user's records
+    ({'id': user_id, 'months': [...]}), so per-user reads only open those.
+
+    Partitioning only applies to the JSON backend; SQLite answers the same
+    queries from its status index.
+    """
+
+    def __init__(self, store, directory='archive', retention_days=ARCHIVE_RETENTION_DAYS):
+        self.store = store
+        self.directory = directory
+        self.retention_days = retention_days
+        self.enabled = store.name == 'json'
+        if self.enabled:
+            os.makedirs(store.path(directory), exist_ok=True)
+
+    def partition(self, filename, month):
+        base = os.path.splitext(filename)[0]
+        return f"{self.directory}/{base}-{month}.json"
+
+    def users_index(self, filename):
+        base = os.path.splitext(filename)[0]
+        return f"{self.directory}/{base}-users.json"
+
+    def months(self, filename, status=None, user_id=None):
+        """List the archived months that may hold matching records, oldest first
+
+        Statuses that are not settled are never archived, so filtering on
+        one needs no partition. With user_id, only the months the user
+        index lists for that user are returned.
+        """
+        if not self.enabled:
+            return []
+        if status is not None and status not in PARTITIONED[filename][0]:
+            return []
+        months = self._months(filename)
+        if user_id is None or not months:
+            return months
+
+        if not self.store.exists(self.users_index(filename)):
+            self.rebuild_users_index(filename)
+        entry = self.store.lookup(self.users_index(filename), 'id', user_id)
+        return sorted(set(entry['months']) & set(months)) if entry else []
+
+    def _months(self, filename):
+        pattern = re.compile(re.escape(os.path.splitext(filename)[0]) + r'-(\d{4}-\d{2})\.json$')
+        months = []
+        for name in os.listdir(self.store.path(self.directory)):
+            match = pattern.match(name)
+            if match:
+                months.append(match.group(1))
+        return sorted(months)
+
+    def iter_records(self, filename, newest_first=False, user_id=None):
+        """Yield archived records partition by partition (only user_id's, if given)"""
+        months = self.months(filename, user_id=user_id)
+        if newest_first:
+            months.reverse()
+        for month in months:
+            partition = self.partition(filename, month)
+            records = self.store.load(partition) if user_id is None else self.store.find(partition, user_id=user_id)
+            if newest_first:
+                records.reverse()
+            yield from records
+
+    def rebuild_users_index(self, filename):
+        """Rebuild the user index of a collection from its partitions"""
+        with self.store.lock(filename):
+            users = {}
+            for month in self._months(filename):
+                for record in self.store.load(self.partition(filename, month)):
+                    users.setdefault(record.get('user_id'), set()).add(month)
+            self.store.save(self.users_index(filename),
+                            [{'id': user_id, 'months': sorted(months)} for user_id, months in users.items()],
+                            wait=True)
+
+    def _index_users(self, filename, by_month):
+        """Add the months just archived to the user index"""
+        if not self.store.exists(self.users_index(filename)):
+            self.rebuild_users_index(filename)
+            return
+
+        with self.store.transaction(self.users_index(filename)) as entries:
+            by_id = {entry['id']: entry for entry in entries}
+            for month, group in by_month.items():
+                for record in group:
+                    entry = by_id.get(record.get('user_id'))
+                    if entry is None:
+                        entry = by_id[record.get('user_id')] = {'id': record.get('user_id'), 'months': []}
+                        entries.append(entry)
+                    if month not in entry['months']:
+                        entry['months'].append(month)
+                        entry['months'].sort()
+
+    def archive(self, filename, now=None):
+        """Move settled records past their retention into monthly partitions"""
+        if not self.enabled:
+            return 0
+
+        statuses, fields = PARTITIONED[filename]
+        now = now or datetime.datetime.now()
+        cutoff = (now - datetime.timedelta(days=self.retention_days)).strftime('%Y-%m-%d %H:%M:%S')
+
+        def due(record):
+            return record.get('status') in statuses and settled_at(record, fields) <= cutoff
+
+        # Cheap unlocked check so an idle run does not rewrite the live file
+        if not any(due(record) for record in self.store.load(filename)):
+            return 0
+
+        with self.store.transaction(filename) as records:
+            moving = [record for record in records if due(record)]
+            by_month = {}
+            for record in moving:
+                by_month.setdefault(settled_at(record, fields)[:7] or '0000-00', []).append(record)
+
+            # Write partitions before dropping records from the live file; a
+            # crash in between leaves duplicates that the next run skips
+            for month, group in by_month.items():
+                with self.store.transaction(self.partition(filename, month)) as partition:
+                    archived_ids = {record.get('id') for record in partition}
+                    partition.extend(record for record in group if record.get('id') not in archived_ids)
+            self._index_users(filename, by_month)
+
+            moved_ids = {record.get('id') for record in moving}
+            records[:] = [record for record in records if record.get('id') not in moved_ids]
+
+        logging.info(f"Archived {len(moving)} settled records from {filename}")
+        return len(moving)
+
+    def archive_all(self, now=None):
+        return {filename: self.archive(filename, now) for filename in PARTITIONED}
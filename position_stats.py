@@ -0,0 +1,99 @@
+import logging
+
+# Statistics compared by check(); floats are compared rounded to cents
+COUNTERS = ('total_positions', 'open_count', 'closed_count', 'liquidated_count',
+            'long_positions', 'short_positions')
+TOTALS = ('total_profit', 'total_loss', 'total_leverage', 'total_volume')
+
+
+def empty_stats():
+    stats = {name: 0 for name in COUNTERS}
+    stats.update({name: 0.0 for name in TOTALS})
+    stats['coin_distribution'] = {}
+    return stats
+
+
+def apply_event(stats, event, trade):
+    """Update the statistics for one opened, closed or liquidated trade"""
+    if event == 'opened':
+        stats['total_positions'] += 1
+        stats['open_count'] += 1
+        side = 'long_positions' if trade.get('type') == 'long' else 'short_positions'
+        stats[side] += 1
+        coin = trade.get('coin')
+        stats['coin_distribution'][coin] = stats['coin_distribution'].get(coin, 0) + 1
+        stats['total_leverage'] += float(trade.get('leverage', 1))
+        stats['total_volume'] += float(trade.get('amount', 0))
+    else:
+        stats['open_count'] -= 1
+        stats['liquidated_count' if event == 'liquidated' else 'closed_count'] += 1
+        profit_loss = float(trade.get('profit_loss', 0))
+        if profit_loss > 0:
+            stats['total_profit'] += profit_loss
+        else:
+            stats['total_loss'] -= profit_loss
+
+
+class PositionStats:
+    """Position statistics kept up to date event by event
+
+    The aggregate is a single small record in position_stats.json, stored
+    with the rest of the data. Opening and settling positions apply their
+    events to it under the file lock, so reading the statistics is one
+    cached lookup instead of passes over every trade. rebuild() recomputes
+    it from a full scan and check() reports where the two differ.
+    """
+
+    def __init__(self, store, filename='position_stats.json'):
+        self.store = store
+        self.filename = filename
+
+    def get(self):
+        records = self.store.load(self.filename)
+        return records[0] if records else empty_stats()
+
+    def record(self, events):
+        """Apply (event, trade) pairs in one write"""
+        if not events:
+            return
+
+        def apply(records):
+            if not records:
+                records.append(empty_stats())
+            for event, trade in events:
+                apply_event(records[0], event, trade)
+            return True
+
+        try:
+            self.store.mutate(self.filename, apply)
+        except Exception as e:
+            logging.error(f"Error updating position statistics: {str(e)}")
+
+    @staticmethod
+    def scan(trades):
+        """Compute the statistics from scratch from every trade"""
+        stats = empty_stats()
+        for trade in trades:
+            apply_event(stats, 'opened', trade)
+            if trade.get('status') in ('closed', 'liquidated'):
+                apply_event(stats, trade['status'], trade)
+        return stats
+
+    def rebuild(self, trades):
+        stats = self.scan(trades)
+        self.store.save(self.filename, [stats], wait=True)
+        return stats
+
+    def check(self, trades):
+        """Compare the stored statistics with a full scan; returns {name: (stored, scanned)}"""
+        stored, scanned = self.get(), self.scan(trades)
+        differences = {}
+        for name in COUNTERS:
+            if stored.get(name) != scanned[name]:
+                differences[name] = (stored.get(name), scanned[name])
+        for name in TOTALS:
+            if round(stored.get(name, 0), 2) != round(scanned[name], 2):
+                differences[name] = (round(stored.get(name, 0), 2), round(scanned[name], 2))
+        if stored.get('coin_distribution') != scanned['coin_distribution']:
+            differences['coin_distribution'] = (stored.get('coin_distribution'), scanned['coin_distribution'])
+        return differences
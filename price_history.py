@@ -0,0 +1,144 @@
+import io
+import os
+import json
+import time
+import atexit
+import threading
+import logging
+import numpy as np
+from writer import FileLock, write_atomic
+
+# Ticks kept per pair and how often the buffer is written to disk (seconds)
+PRICE_HISTORY_SIZE = int(os.environ.get('PRICE_HISTORY_SIZE', 20000))
+PRICE_HISTORY_FLUSH = float(os.environ.get('PRICE_HISTORY_FLUSH', 60))
+
+TICK_DTYPE = np.dtype([('ts', '<f8'), ('price', '<f8')])
+
+# Candle interval name -> seconds
+CANDLE_INTERVALS = {'1m': 60, '5m': 300, '15m': 900, '1h': 3600, '4h': 14400, '1d': 86400}
+
+
+class PriceHistory:
+    """Fixed-size ring buffer of price ticks per pair
+
+    All pairs share one (pairs, capacity) array of (ts, price) ticks with a
+    head and count per pair. The buffer lives in memory and is written every
+    flush_interval seconds to ticks.npy plus meta.json (pairs, heads,
+    counts); on startup ticks.npy is opened with mmap and copied back in.
+    """
+
+    def __init__(self, directory, pairs, capacity=PRICE_HISTORY_SIZE, flush_interval=PRICE_HISTORY_FLUSH):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.ticks_path = os.path.join(directory, 'ticks.npy')
+        self.meta_path = os.path.join(directory, 'meta.json')
+        self.file_lock = FileLock(self.meta_path)
+        self.pairs = list(pairs)
+        self.index = {pair: i for i, pair in enumerate(self.pairs)}
+        self.capacity = capacity
+        self.flush_interval = flush_interval
+        self.ticks = np.zeros((len(self.pairs), capacity), dtype=TICK_DTYPE)
+        self.heads = np.zeros(len(self.pairs), dtype=np.int64)
+        self.counts = np.zeros(len(self.pairs), dtype=np.int64)
+        self._lock = threading.Lock()
+        self._flushed_at = time.monotonic()
+        self._dirty = False
+        self._load()
+        atexit.register(self.flush)
+
+    def _load(self):
+        try:
+            with open(self.meta_path, 'r') as f:
+                meta = json.load(f)
+            stored = np.load(self.ticks_path, mmap_mode='r')
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            logging.error(f"Error loading price history: {str(e)}")
+            return
+
+        for row, pair in enumerate(meta['pairs']):
+            if pair not in self.index:
+                continue
+            count, head = meta['counts'][row], meta['heads'][row]
+            # Oldest to newest, then keep what fits in this buffer
+            ordered = np.roll(stored[row], -head) if count == stored.shape[1] else stored[row, :count]
+            ordered = ordered[-self.capacity:]
+            i = self.index[pair]
+            self.ticks[i, :len(ordered)] = ordered
+            self.counts[i] = len(ordered)
+            self.heads[i] = len(ordered) % self.capacity
+        logging.info(f"Loaded price history for {len(meta['pairs'])} pairs")
+
+    def record(self, prices, timestamp=None):
+        """Append one tick for every known pair in prices"""
+        timestamp = time.time() if timestamp is None else timestamp
+        with self._lock:
+            for pair, price in prices.items():
+                i = self.index.get(pair)
+                if i is None:
+                    continue
+                head = self.heads[i]
+                self.ticks[i, head] = (timestamp, price)
+                self.heads[i] = (head + 1) % self.capacity
+                self.counts[i] = min(self.counts[i] + 1, self.capacity)
+            self._dirty = True
+
+        if time.monotonic() - self._flushed_at >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        """Write the buffer to disk if it changed"""
+        with self._lock:
+            if not self._dirty:
+                return
+            buffer = io.BytesIO()
+            np.save(buffer, self.ticks)
+            meta = {'pairs': self.pairs, 'heads': self.heads.tolist(), 'counts': self.counts.tolist()}
+            self._dirty = False
+            self._flushed_at = time.monotonic()
+
+        try:
+            with self.file_lock:
+                write_atomic(self.ticks_path, buffer.getvalue())
+                write_atomic(self.meta_path, json.dumps(meta))
+        except Exception as e:
+            logging.error(f"Error saving price history: {str(e)}")
+
+    def series(self, pair):
+        """Get (timestamps, prices) of a pair, oldest first"""
+        i = self.index[pair]
+        with self._lock:
+            count, head = self.counts[i], self.heads[i]
+            row = self.ticks[i]
+            ordered = np.roll(row, -head) if count == self.capacity else row[:count].copy()
+        return ordered['ts'], ordered['price']
+
+    def candles(self, pair, interval, limit):
+        """Build the last limit OHLCV candles of interval seconds
+
+        Volume is the number of ticks in the candle; there is no traded
+        volume to report.
+        """
+        ts, price = self.series(pair)
+        if not len(ts):
+            return []
+
+        buckets = (ts // interval).astype(np.int64)
+        keep = buckets > buckets[-1] - limit
+        buckets, price = buckets[keep], price[keep]
+
+        starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+        ends = np.r_[starts[1:], len(price)] - 1
+
+        opens = price[starts]
+        highs = np.maximum.reduceat(price, starts)
+        lows = np.minimum.reduceat(price, starts)
+        closes = price[ends]
+        volumes = ends - starts + 1
+        times = buckets[starts] * interval
+
+        return [
+            {'time': int(t), 'open': float(o), 'high': float(h), 'low': float(l), 'close': float(c), 'volume': int(v)}
+            for t, o, h, l, c, v in zip(times, opens, highs, lows, closes, volumes)
+        ]
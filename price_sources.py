@@ -0,0 +1,271 @@
+import os
+import json
+import time
+import statistics
+import threading
+import logging
+from concurrent.futures import ThreadPoolExecutor, wait
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Enabled sources in priority order, how to combine them ('median' or
+# 'priority') and the per-source request settings
+PRICE_SOURCES = os.environ.get('PRICE_SOURCES', 'coingecko,binance,okx')
+PRICE_AGGREGATION = os.environ.get('PRICE_AGGREGATION', 'median')
+PRICE_SOURCE_TIMEOUT = float(os.environ.get('PRICE_SOURCE_TIMEOUT', 3))
+PRICE_SOURCE_RETRIES = int(os.environ.get('PRICE_SOURCE_RETRIES', 1))
+
+# Longest a refresh waits for all sources; slower ones are left out
+PRICE_FETCH_DEADLINE = float(os.environ.get('PRICE_FETCH_DEADLINE', 4))
+
+
+class CircuitBreaker:
+    """Stops calling a source after repeated failures
+
+    After failure_threshold consecutive failures the breaker opens and the
+    source is skipped for reset_timeout seconds; then one trial call is let
+    through (half-open) and its outcome closes or re-opens the breaker.
+    """
+
+    def __init__(self, failure_threshold=3, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return 'half-open'
+        return 'open'
+
+    def allow(self):
+        with self._lock:
+            state = self.state
+            if state == 'half-open':
+                # Let one trial call through and hold the rest back
+                self.opened_at = time.monotonic()
+                return True
+            return state == 'closed'
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+
+
+class PriceSource:
+    """One HTTP price provider
+
+    Subclasses set name and default_url and implement request() and
+    parse(), or requests() for providers that need one call per coin (run
+    in parallel over the session's pool). Each source has its own pooled
+    session with a retry budget, a timeout and a circuit breaker, and keeps
+    latency counters.
+    """
+
+    name = None
+    default_url = None
+
+    def __init__(self, base_url=None, timeout=PRICE_SOURCE_TIMEOUT, retries=PRICE_SOURCE_RETRIES, breaker=None):
+        self.base_url = (base_url or os.environ.get(f"PRICE_SOURCE_{self.name.upper()}_URL")
+                         or self.default_url).rstrip('/')
+        self.timeout = timeout
+        self.breaker = breaker or CircuitBreaker()
+        self.session = requests.Session()
+        retry = Retry(total=retries, backoff_factor=0.1, status_forcelist=(429, 500, 502, 503, 504),
+                      allowed_methods=('GET',), raise_on_status=False)
+        self.session.mount('http://', HTTPAdapter(pool_maxsize=4, max_retries=retry))
+        self.session.mount('https://', HTTPAdapter(pool_maxsize=4, max_retries=retry))
+        self._pool = None
+        self.successes = 0
+        self.errors = 0
+        self.skipped = 0
+        self.last_latency = None
+        self.avg_latency = None
+        self.last_error = None
+
+    def request(self, coins):
+        """Get (path, params) of the request for the given coins"""
+        raise NotImplementedError
+
+    def requests(self, coins):
+        """Get the (path, params) of every request needed for the given coins"""
+        return [self.request(coins)]
+
+    def parse(self, data, coins):
+        """Turn the decoded response into {pair: price}"""
+        raise NotImplementedError
+
+    def _get(self, path, params):
+        response = self.session.get(f"{self.base_url}{path}", params=params, timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()
+
+    def fetch(self, coins):
+        calls = self.requests(coins)
+        start = time.perf_counter()
+        try:
+            if len(calls) == 1:
+                responses = [self._get(*calls[0])]
+            else:
+                if self._pool is None:
+                    self._pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix=f"price-{self.name}")
+                responses = list(self._pool.map(lambda call: self._get(*call), calls))
+            prices = {}
+            for data in responses:
+                prices.update(self.parse(data, coins))
+            prices = {pair: float(price) for pair, price in prices.items() if price and float(price) > 0}
+        except Exception as e:
+            self.errors += 1
+            self.last_error = str(e)
+            self.breaker.record_failure()
+            raise
+        finally:
+            self._record_latency(time.perf_counter() - start)
+
+        self.successes += 1
+        self.breaker.record_success()
+        return prices
+
+    def _record_latency(self, latency):
+        self.last_latency = latency
+        self.avg_latency = latency if self.avg_latency is None else 0.8 * self.avg_latency + 0.2 * latency
+
+    def stats(self):
+        return {
+            'state': self.breaker.state,
+            'successes': self.successes,
+            'errors': self.errors,
+            'skipped': self.skipped,
+            'last_latency_ms': round(self.last_latency * 1000, 1) if self.last_latency is not None else None,
+            'avg_latency_ms': round(self.avg_latency * 1000, 1) if self.avg_latency is not None else None,
+            'last_error': self.last_error
+        }
+
+
+class CoinGeckoSource(PriceSource):
+    name = 'coingecko'
+    default_url = 'https://api.coingecko.com'
+    ids = {
+        'BTC': 'bitcoin', 'ETH': 'ethereum', 'ETC': 'ethereum-classic', 'LTC': 'litecoin',
+        'BNB': 'binancecoin', 'TRX': 'tron', 'PEPE': 'pepe', 'AAVE': 'aave', 'DOGE': 'dogecoin',
+        'SOL': 'solana', 'ADA': 'cardano', 'AVAX': 'avalanche-2', 'SHIB': 'shiba-inu',
+        'TON': 'the-open-network', 'POL': 'polygon-ecosystem-token', 'FIL': 'filecoin', 'ATOM': 'cosmos'
+    }
+
+    def request(self, coins):
+        ids = ','.join(self.ids[coin] for coin in coins if coin in self.ids)
+        return '/api/v3/simple/price', {'ids': ids, 'vs_currencies': 'usd'}
+
+    def parse(self, data, coins):
+        return {f"{coin}/USDT": data[self.ids[coin]]['usd']
+                for coin in coins if coin in self.ids and self.ids[coin] in data}
+
+
+class BinanceSource(PriceSource):
+    name = 'binance'
+    default_url = 'https://api.binance.com'
+
+    def request(self, coins):
+        symbols = json.dumps([f"{coin}USDT" for coin in coins], separators=(',', ':'))
+        return '/api/v3/ticker/price', {'symbols': symbols}
+
+    def parse(self, data, coins):
+        prices = {item['symbol']: item['price'] for item in data}
+        return {f"{coin}/USDT": prices[f"{coin}USDT"] for coin in coins if f"{coin}USDT" in prices}
+
+
+class OKXSource(PriceSource):
+    name = 'okx'
+    default_url = 'https://www.okx.com'
+
+    def requests(self, coins):
+        # The multi-ticker endpoint has no instrument filter, only a whole market
+        return [('/api/v5/market/ticker', {'instId': f"{coin}-USDT"}) for coin in coins]
+
+    def parse(self, data, coins):
+        prices = {item['instId']: item['last'] for item in data.get('data', [])}
+        return {f"{coin}/USDT": prices[f"{coin}-USDT"] for coin in coins if f"{coin}-USDT" in prices}
+
+
+SOURCES = {source.name: source for source in (CoinGeckoSource, BinanceSource, OKXSource)}
+
+
+class PriceAggregator:
+    """Fetches all sources concurrently and combines their prices per pair
+
+    Sources run on a shared thread pool. A refresh waits at most deadline
+    seconds; sources that have not answered by then are left out, and a
+    source still busy with an earlier call is skipped rather than queued,
+    so one slow provider cannot stall refreshes. Pairs are combined by the
+    median of the sources that have them, or taken from the first source in
+    priority order.
+    """
+
+    def __init__(self, sources, strategy=PRICE_AGGREGATION, deadline=PRICE_FETCH_DEADLINE):
+        if strategy not in ('median', 'priority'):
+            raise ValueError(f"Unknown price aggregation {strategy!r}, expected median or priority")
+        self.sources = list(sources)
+        self.strategy = strategy
+        self.deadline = deadline
+        self._pool = ThreadPoolExecutor(max_workers=max(2 * len(self.sources), 1), thread_name_prefix='price-source')
+        self._inflight = {}
+
+    @classmethod
+    def from_env(cls, names=PRICE_SOURCES):
+        sources = []
+        for name in names.split(','):
+            name = name.strip()
+            if name not in SOURCES:
+                raise ValueError(f"Unknown price source {name!r}, expected one of {', '.join(SOURCES)}")
+            sources.append(SOURCES[name]())
+        return cls(sources)
+
+    def fetch(self, coins):
+        """Fetch {pair: price} for the coins from every available source"""
+        futures = {}
+        for source in self.sources:
+            previous = self._inflight.get(source.name)
+            if (previous is not None and not previous.done()) or not source.breaker.allow():
+                source.skipped += 1
+                continue
+            future = self._pool.submit(source.fetch, coins)
+            self._inflight[source.name] = future
+            futures[future] = source
+
+        done, _ = wait(futures, timeout=self.deadline)
+
+        results = []
+        for future, source in futures.items():
+            if future not in done:
+                logging.warning(f"Price source {source.name} missed the {self.deadline}s deadline")
+            elif future.exception() is not None:
+                logging.error(f"Error fetching prices from {source.name}: {str(future.exception())}")
+            else:
+                results.append((source, future.result()))
+
+        # Keep priority order for the 'priority' strategy
+        order = {source.name: i for i, source in enumerate(self.sources)}
+        results.sort(key=lambda result: order[result[0].name])
+        return self.combine([prices for _, prices in results])
+
+    def combine(self, results):
+        combined = {}
+        for pair in {pair for prices in results for pair in prices}:
+            values = [prices[pair] for prices in results if pair in prices]
+            combined[pair] = statistics.median(values) if self.strategy == 'median' else values[0]
+        return combined
+
+    def stats(self):
+        return {source.name: source.stats() for source in self.sources}
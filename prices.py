@@ -0,0 +1,295 @@
+import os
+import time
+import types
+import threading
+import logging
+
+# How often the background poller refreshes prices (seconds)
+PRICE_REFRESH_INTERVAL = float(os.environ.get('PRICE_REFRESH_INTERVAL', 10))
+
+# Oldest prices a trade may execute at (seconds); older ones force a refresh
+PRICE_MAX_STALENESS = float(os.environ.get('PRICE_MAX_STALENESS', 60))
+
+# How often overrides are re-read to pick up changes from other processes
+PRICE_OVERRIDE_RELOAD = float(os.environ.get('PRICE_OVERRIDE_RELOAD', 1))
+
+
+class StalePricesError(Exception):
+    """Raised when no prices fresh enough for trade execution are available"""
+
+
+class PriceSnapshot:
+    """Immutable set of prices published by the price service
+
+    version counts market updates; overrides_version identifies the set of
+    admin overrides merged in (0 for none).
+    """
+
+    __slots__ = ('prices', 'version', 'timestamp', 'overrides_version')
+
+    def __init__(self, prices, version, timestamp, overrides_version=0):
+        object.__setattr__(self, 'prices', types.MappingProxyType(dict(prices)))
+        object.__setattr__(self, 'version', version)
+        object.__setattr__(self, 'timestamp', timestamp)
+        object.__setattr__(self, 'overrides_version', overrides_version)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('PriceSnapshot is immutable')
+
+    @property
+    def age(self):
+        return time.time() - self.timestamp
+
+
+class PriceOverrides:
+    """Admin price overrides layered over the market prices
+
+    Each override is a record {'id': pair, 'pair', 'price', 'expires_at'}
+    in one small collection, so setting one is a single write and they
+    survive restarts. Active overrides are kept in memory as a dict keyed by
+    pair and re-read every PRICE_OVERRIDE_RELOAD seconds; expired entries
+    drop out when read and are purged from storage on the next write.
+    """
+
+    def __init__(self, store, filename='price_overrides.json', reload_interval=PRICE_OVERRIDE_RELOAD):
+        self.store = store
+        self.filename = filename
+        self.reload_interval = reload_interval
+        self._active = {}
+        self._next_expiry = float('inf')
+        self._loaded_at = None
+        self._lock = threading.Lock()
+        self.version = 0
+
+    def _load(self, now):
+        active = {}
+        for record in self.store.load(self.filename):
+            if record.get('expires_at', 0) > now:
+                active[record['pair']] = record
+        self._install(active, now)
+
+    def _install(self, active, now):
+        if active != self._active:
+            self.version += 1
+        self._active = active
+        self._next_expiry = min((record['expires_at'] for record in active.values()), default=float('inf'))
+        self._loaded_at = time.monotonic()
+
+    def active(self):
+        """Get the active overrides as {pair: record}"""
+        now = time.time()
+        with self._lock:
+            if self._loaded_at is None or time.monotonic() - self._loaded_at > self.reload_interval:
+                self._load(now)
+            elif now >= self._next_expiry:
+                self._install({pair: record for pair, record in self._active.items()
+                               if record['expires_at'] > now}, now)
+            return self._active
+
+    def get(self, pair):
+        record = self.active().get(pair)
+        return None if record is None else record['price']
+
+    def set(self, pair, price, duration):
+        """Override the price of a pair for duration seconds"""
+        now = time.time()
+        record = {'id': pair, 'pair': pair, 'price': float(price), 'expires_at': now + duration}
+
+        def apply(records):
+            records[:] = [r for r in records if r.get('pair') != pair and r.get('expires_at', 0) > now]
+            records.append(record)
+            return True
+
+        with self._lock:
+            self.store.mutate(self.filename, apply, wait=True)
+            self._load(now)
+        return record
+
+    def purge(self):
+        """Remove expired overrides from storage"""
+        now = time.time()
+
+        def apply(records):
+            before = len(records)
+            records[:] = [r for r in records if r.get('expires_at', 0) > now]
+            return True if len(records) != before else None
+
+        with self._lock:
+            self.store.mutate(self.filename, apply, wait=True)
+            self._load(now)
+
+    def clear(self, pair):
+        """Remove the override of a pair"""
+        now = time.time()
+
+        def apply(records):
+            before = len(records)
+            records[:] = [r for r in records if r.get('pair') != pair and r.get('expires_at', 0) > now]
+            return True if len(records) != before else None
+
+        with self._lock:
+            self.store.mutate(self.filename, apply, wait=True)
+            self._load(now)
+
+
+class PriceService:
+    """Keeps the current prices in memory, refreshed by a background thread
+
+    Request handlers read snapshot(), which never does I/O once the first
+    prices are in: a stale snapshot is returned as is while a refresh runs
+    in the background (stale-while-revalidate). Concurrent refreshes are
+    single-flight, so callers that need new prices wait for the fetch
+    already running instead of starting another. Trades use
+    trade_snapshot(), which refuses prices older than max_staleness.
+    Admin overrides, if given, are merged over the market prices.
+    """
+
+    def __init__(self, fetch, overrides=None, interval=PRICE_REFRESH_INTERVAL, max_staleness=PRICE_MAX_STALENESS):
+        self._fetch = fetch
+        self.overrides = overrides
+        self._effective = None
+        self._listeners = []
+        self.interval = interval
+        self.max_staleness = max_staleness
+        self._snapshot = None
+        self._publish_lock = threading.Lock()
+        self._flight_lock = threading.Lock()
+        self._flight = None
+        self._thread = None
+        self._pid = None
+        self.refreshes = 0
+        self.failures = 0
+
+    def start(self):
+        """Start the poller thread (again after a fork)"""
+        if self._pid != os.getpid():
+            with self._flight_lock:
+                if self._pid != os.getpid():
+                    self._flight = None
+                    self._thread = threading.Thread(target=self._run, name='price-poller', daemon=True)
+                    self._thread.start()
+                    self._pid = os.getpid()
+
+    def _run(self):
+        while True:
+            self.refresh()
+            time.sleep(self.interval)
+
+    @property
+    def current(self):
+        """The latest market snapshot, or None before the first refresh"""
+        return self._snapshot
+
+    def subscribe(self, listener):
+        """Call listener(snapshot) with the effective prices after every publish"""
+        self._listeners.append(listener)
+
+    def notify(self):
+        """Send the current effective prices to the listeners again (after overrides change)"""
+        if self._snapshot is not None:
+            self._notify(self._snapshot)
+
+    def _notify(self, snapshot):
+        if self._listeners:
+            effective = self._with_overrides(snapshot)
+            for listener in self._listeners:
+                try:
+                    listener(effective)
+                except Exception as e:
+                    logging.error(f"Error in price listener: {str(e)}")
+
+    def publish(self, prices):
+        """Publish prices as the new snapshot"""
+        with self._publish_lock:
+            version = self._snapshot.version + 1 if self._snapshot else 1
+            snapshot = self._snapshot = PriceSnapshot(prices, version, time.time())
+
+        self._notify(snapshot)
+        return snapshot
+
+    def refresh(self, timeout=None):
+        """Fetch and publish new prices, joining a fetch already in flight"""
+        with self._flight_lock:
+            flight = self._flight
+            leader = flight is None
+            if leader:
+                flight = self._flight = threading.Event()
+
+        if not leader:
+            flight.wait(timeout)
+            return self._snapshot
+
+        try:
+            self.publish(self._fetch())
+            self.refreshes += 1
+        except Exception as e:
+            self.failures += 1
+            logging.error(f"Error refreshing prices: {str(e)}")
+        finally:
+            with self._flight_lock:
+                self._flight = None
+            flight.set()
+        return self._snapshot
+
+    def refresh_async(self):
+        """Start a refresh in the background unless one is already running"""
+        if self._flight is None:
+            threading.Thread(target=self.refresh, name='price-refresh', daemon=True).start()
+
+    def _with_overrides(self, snapshot):
+        """Merge the active overrides over a market snapshot"""
+        if self.overrides is None:
+            return snapshot
+        active = self.overrides.active()
+        if not active:
+            return snapshot
+
+        key = (snapshot.version, self.overrides.version)
+        effective = self._effective
+        if effective is not None and effective[0] == key:
+            return effective[1]
+
+        prices = dict(snapshot.prices)
+        prices.update((pair, record['price']) for pair, record in active.items())
+        merged = PriceSnapshot(prices, snapshot.version, snapshot.timestamp, self.overrides.version)
+        self._effective = (key, merged)
+        return merged
+
+    def snapshot(self):
+        """Get the current prices, overrides applied"""
+        return self._with_overrides(self.market_snapshot())
+
+    def market_snapshot(self):
+        """Get the current market snapshot without waiting for the network if possible"""
+        self.start()
+        snapshot = self._snapshot
+        if snapshot is None:
+            snapshot = self.refresh()
+            if snapshot is None:
+                raise StalePricesError('No prices available')
+        elif snapshot.age > 2 * self.interval:
+            # The poller is behind; serve what we have and revalidate
+            self.refresh_async()
+        return snapshot
+
+    def trade_snapshot(self, max_staleness=None):
+        """Get a snapshot fresh enough to execute trades at"""
+        max_staleness = self.max_staleness if max_staleness is None else max_staleness
+        snapshot = self.market_snapshot()
+        if snapshot.age > max_staleness:
+            snapshot = self.refresh(timeout=max_staleness) or snapshot
+        if snapshot.age > max_staleness:
+            raise StalePricesError(f"Prices are {snapshot.age:.0f}s old")
+        return self._with_overrides(snapshot)
+
+    def stats(self):
+        snapshot = self._snapshot
+        return {
+            'version': snapshot.version if snapshot else 0,
+            'age': round(snapshot.age, 3) if snapshot else None,
+            'overrides': len(self.overrides.active()) if self.overrides else 0,
+            'refreshes': self.refreshes,
+            'failures': self.failures,
+            'interval': self.interval,
+            'max_staleness': self.max_staleness
+        }
@@ -0,0 +1,121 @@
+import os
+import time
+import threading
+import logging
+
+# Seconds between full rebuilds of the trigger book from storage
+TRIGGER_REBUILD_INTERVAL = float(os.environ.get('TRIGGER_REBUILD_INTERVAL', 60))
+
+# Which trigger wins when a price crosses several thresholds of one position
+PRIORITY = {'take_profit': 0, 'stop_loss': 1, 'liquidated': 2}
+
+
+class RiskEngine:
+    """Settles open positions whose liquidation, stop loss or take profit was crossed
+
+    Runs on every new price snapshot, on its own thread; if several
+    snapshots arrive during a sweep only the latest is checked. The
+    candidates come from a TriggerBook, so a sweep costs O(log n + k) per
+    pair instead of a scan of all open positions. Crossed positions are
+    handed to settle({position_id: (price, reason)}) in one batch.
+
+    The book is kept current by the process's own opens and closes and
+    rebuilt from storage when the trades change in a way it did not see
+    (another worker) and every rebuild_interval seconds as a safety net.
+    """
+
+    def __init__(self, book, load_positions, version, settle, rebuild_interval=TRIGGER_REBUILD_INTERVAL):
+        self.book = book
+        self._load_positions = load_positions
+        self._version = version
+        self._settle = settle
+        self.rebuild_interval = rebuild_interval
+        self._rebuilt_at = None
+        self._latest = None
+        self._ready = threading.Event()
+        self._thread = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+        self.sweeps = 0
+        self.evaluated = 0
+        self.triggered = 0
+        self.rebuilds = 0
+        self.last_sweep_ms = None
+        self.last_evaluated = 0
+
+    def on_snapshot(self, snapshot):
+        """Price listener: queue the snapshot for the next sweep"""
+        self._latest = snapshot
+        self._ensure_thread()
+        self._ready.set()
+
+    def _ensure_thread(self):
+        if self._pid != os.getpid():
+            with self._start_lock:
+                if self._pid != os.getpid():
+                    self._thread = threading.Thread(target=self._run, name='risk-engine', daemon=True)
+                    self._thread.start()
+                    self._pid = os.getpid()
+
+    def _run(self):
+        while True:
+            self._ready.wait()
+            self._ready.clear()
+            try:
+                self.sweep(self._latest.prices)
+            except Exception as e:
+                logging.error(f"Error in risk sweep: {str(e)}")
+
+    def rebuild(self):
+        """Reload the trigger book from the open positions in storage"""
+        version = self._version()
+        self.book.rebuild(self._load_positions(), version)
+        self._rebuilt_at = time.monotonic()
+        self.rebuilds += 1
+
+    def synced(self):
+        """Record that the book reflects the current trades (after this process's own writes)"""
+        self.book.version = self._version()
+
+    def _sync(self):
+        if (self._rebuilt_at is None or self._version() != self.book.version
+                or time.monotonic() - self._rebuilt_at >= self.rebuild_interval):
+            self.rebuild()
+
+    def sweep(self, prices):
+        """Settle every open position whose thresholds the prices crossed"""
+        start = time.perf_counter()
+        self._sync()
+
+        closes = {}
+        evaluated = 0
+        for pair, price in prices.items():
+            if not price:
+                continue
+            for threshold, position_id, reason in self.book.crossed(pair, price):
+                evaluated += 1
+                current = closes.get(position_id)
+                if current is None or PRIORITY[reason] > PRIORITY[current[1]]:
+                    # Liquidations close at the liquidation price, the rest at market
+                    closes[position_id] = (threshold if reason == 'liquidated' else float(price), reason)
+
+        if closes:
+            self._settle(closes)
+
+        self.sweeps += 1
+        self.evaluated += evaluated
+        self.last_evaluated = evaluated
+        self.triggered += len(closes)
+        self.last_sweep_ms = (time.perf_counter() - start) * 1000
+        return len(closes)
+
+    def stats(self):
+        return {
+            'open_positions': len(self.book),
+            'sweeps': self.sweeps,
+            'evaluated': self.evaluated,
+            'last_evaluated': self.last_evaluated,
+            'triggered': self.triggered,
+            'rebuilds': self.rebuilds,
+            'last_sweep_ms': round(self.last_sweep_ms, 3) if self.last_sweep_ms is not None else None
+        }
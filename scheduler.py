@@ -0,0 +1,171 @@
+import os
+import time
+import uuid
+import heapq
+import atexit
+import threading
+import logging
+
+# How often the scheduler re-reads jobs scheduled by other processes (seconds)
+SCHEDULER_POLL = float(os.environ.get('SCHEDULER_POLL', 30))
+
+
+class Scheduler:
+    """Delayed jobs run by one background thread from a heap ordered by due time
+
+    Jobs are records {'id', 'name', 'run_at', 'args'} in a data file, so
+    they survive restarts; jobs that came due while the app was down run at
+    startup. A job runs the handler registered under its name with its args.
+    Before running, a process claims the job by removing it from the file
+    under the file lock, so with several workers each job runs once.
+    Cancelled jobs are removed from the file and skipped when popped.
+    """
+
+    def __init__(self, store, filename='jobs.json', poll_interval=SCHEDULER_POLL):
+        self.store = store
+        self.filename = filename
+        self.poll_interval = poll_interval
+        self.handlers = {}
+        self._jobs = {}
+        self._heap = []
+        self._wakeup = threading.Condition()
+        self._thread = None
+        self._pid = None
+        self._stopped = False
+        self.runs = 0
+        self.failures = 0
+
+    def register(self, name, handler):
+        """Register handler(**args) for jobs called name"""
+        self.handlers[name] = handler
+
+    def start(self):
+        """Load the persisted jobs and start the scheduler thread (again after a fork)"""
+        if self._pid != os.getpid():
+            with self._wakeup:
+                if self._pid != os.getpid():
+                    self._jobs, self._heap = {}, []
+                    self._reload()
+                    self._thread = threading.Thread(target=self._run, name='scheduler', daemon=True)
+                    self._thread.start()
+                    if self._pid is None:
+                        atexit.register(self.stop)
+                    self._pid = os.getpid()
+
+    def stop(self):
+        with self._wakeup:
+            self._stopped = True
+            self._wakeup.notify()
+
+    def _current(self, entry):
+        """Get the job of a heap entry unless it was cancelled or rescheduled"""
+        job = self._jobs.get(entry[1])
+        return job if job is not None and job['run_at'] == entry[0] else None
+
+    def _add(self, job):
+        self._jobs[job['id']] = job
+        heapq.heappush(self._heap, (job['run_at'], job['id']))
+
+    def _reload(self):
+        """Pick up jobs scheduled or cancelled by other processes"""
+        stored = {job['id']: job for job in self.store.load(self.filename)}
+        for job_id in list(self._jobs):
+            if job_id not in stored:
+                del self._jobs[job_id]
+        for job_id, job in stored.items():
+            if job_id not in self._jobs or self._jobs[job_id]['run_at'] != job['run_at']:
+                self._add(job)
+
+    def schedule(self, name, delay=None, run_at=None, job_id=None, **args):
+        """Run the name handler with args after delay seconds or at run_at (epoch)
+
+        Scheduling a job_id that is already pending replaces it.
+        """
+        if name not in self.handlers:
+            raise ValueError(f"No handler registered for job {name!r}")
+        run_at = time.time() + (delay or 0) if run_at is None else run_at
+        job = {'id': job_id or str(uuid.uuid4()), 'name': name, 'run_at': run_at, 'args': args}
+
+        def apply(jobs):
+            jobs[:] = [existing for existing in jobs if existing.get('id') != job['id']]
+            jobs.append(job)
+            return True
+
+        self.store.mutate(self.filename, apply, wait=True)
+        self.start()
+        with self._wakeup:
+            self._add(job)
+            self._wakeup.notify()
+        return job['id']
+
+    def cancel(self, job_id):
+        """Cancel a pending job; returns whether it was pending"""
+        with self._wakeup:
+            pending = self._jobs.pop(job_id, None)
+        # Jobs of other processes may not be loaded here yet
+        if pending is None and self.store.lookup(self.filename, 'id', job_id) is None:
+            return False
+        return self._claim(job_id) is not None
+
+    def _claim(self, job_id):
+        """Remove a job from the file; returns it if this call removed it"""
+        def apply(jobs):
+            for i, job in enumerate(jobs):
+                if job.get('id') == job_id:
+                    return jobs.pop(i)
+            return None
+
+        return self.store.mutate(self.filename, apply, wait=True)
+
+    def jobs(self):
+        """List the pending jobs, soonest first"""
+        with self._wakeup:
+            return sorted((dict(job) for job in self._jobs.values()), key=lambda job: job['run_at'])
+
+    def _run(self):
+        reloaded_at = time.monotonic()
+        while True:
+            with self._wakeup:
+                while not self._stopped:
+                    # Drop cancelled and rescheduled entries from the top of the heap
+                    while self._heap and self._current(self._heap[0]) is None:
+                        heapq.heappop(self._heap)
+                    wait = self.poll_interval - (time.monotonic() - reloaded_at)
+                    if self._heap:
+                        wait = min(wait, self._heap[0][0] - time.time())
+                    if wait <= 0:
+                        break
+                    self._wakeup.wait(wait)
+                if self._stopped:
+                    return
+
+                due = []
+                while self._heap and self._heap[0][0] <= time.time():
+                    job = self._current(heapq.heappop(self._heap))
+                    if job is not None:
+                        del self._jobs[job['id']]
+                        due.append(job)
+
+            for job in due:
+                self._execute(job)
+
+            if time.monotonic() - reloaded_at >= self.poll_interval:
+                try:
+                    with self._wakeup:
+                        self._reload()
+                except Exception as e:
+                    logging.error(f"Error reloading scheduled jobs: {str(e)}")
+                reloaded_at = time.monotonic()
+
+    def _execute(self, job):
+        try:
+            if self._claim(job['id']) is None:
+                return  # cancelled, or run by another process
+            self.handlers[job['name']](**job['args'])
+            self.runs += 1
+        except Exception as e:
+            self.failures += 1
+            logging.error(f"Error running job {job['name']} ({job['id']}): {str(e)}")
+
+    def stats(self):
+        return {'pending': len(self._jobs), 'runs': self.runs, 'failures': self.failures}
@@ -0,0 +1,73 @@
+import os
+import json
+import logging
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# On-disk format for data files: 'json' (indented, the original layout),
+# 'compact' (no whitespace, orjson when installed) or 'msgpack' (binary)
+DATA_FORMAT = os.environ.get('DATA_FORMAT', 'json')
+FORMATS = ('json', 'compact', 'msgpack')
+
+# Binary files start with this header so a data directory can mix formats.
+# JSON never starts with a NUL byte.
+MSGPACK_HEADER = b'\x00MSGPACK1\n'
+
+
+def json_dumps(data):
+    """Serialize to compact JSON bytes"""
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data, separators=(',', ':')).encode()
+
+
+def json_loads(raw):
+    """Parse JSON from bytes or str"""
+    if orjson is not None:
+        return orjson.loads(raw)
+    return json.loads(raw)
+
+
+def dumps(data, fmt=DATA_FORMAT):
+    """Serialize a data file in the given format"""
+    if fmt == 'msgpack':
+        if msgpack is None:
+            raise RuntimeError('DATA_FORMAT=msgpack requires the msgpack package')
+        return MSGPACK_HEADER + msgpack.packb(data, use_bin_type=True)
+    if fmt == 'compact':
+        return json_dumps(data)
+    return json.dumps(data, indent=4).encode()
+
+
+def loads(raw):
+    """Parse a data file in any supported format, detected from its header"""
+    if raw.startswith(MSGPACK_HEADER):
+        if msgpack is None:
+            raise RuntimeError('Reading a msgpack data file requires the msgpack package')
+        return msgpack.unpackb(raw[len(MSGPACK_HEADER):], raw=False)
+    return json_loads(raw)
+
+
+def detect_format(raw):
+    """Guess the format a data file was written in"""
+    if raw.startswith(MSGPACK_HEADER):
+        return 'msgpack'
+    return 'json' if b'\n' in raw[:64] else 'compact'
+
+
+def check_format(fmt):
+    """Validate a format name, falling back to json if it cannot be written"""
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown data format {fmt!r}, expected one of {', '.join(FORMATS)}")
+    if fmt == 'msgpack' and msgpack is None:
+        logging.warning("msgpack is not installed, writing compact JSON instead")
+        return 'compact'
+    return fmt
@@ -0,0 +1,880 @@
+import os
+import heapq
+import sqlite3
+import threading
+import logging
+from collections import OrderedDict
+from contextlib import contextmanager
+import serialization
+from journal import TradeJournal
+from writer import FileLock, FileWriter, write_atomic
+
+DATA_DIR = 'data'
+
+# Storage backend selection: 'json' (one file per collection) or 'sqlite'
+STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'json')
+SQLITE_PATH = os.environ.get('SQLITE_PATH', os.path.join(DATA_DIR, 'neon.db'))
+
+# Wait for each write to reach the disk (1) or return once it is queued (0)
+SYNC_WRITES = os.environ.get('SYNC_WRITES', '1') == '1'
+
+# Bytes of data files (as stored on disk) the parse cache keeps per process
+PARSE_CACHE_BYTES = int(os.environ.get('PARSE_CACHE_BYTES', 64 * 1024 * 1024))
+
+# Collections that get their own table, with the columns we index on.
+# The full record is kept as a JSON body next to the indexed columns.
+TABLES = {
+    'users.json': ('users', ('username', 'email')),
+    'trades.json': ('trades', ('user_id', 'status')),
+    'deposits.json': ('deposits', ('user_id', 'status')),
+    'withdrawals.json': ('withdrawals', ('user_id', 'status')),
+    'trader_stats.json': ('trader_stats', ()),
+}
+
+# Date field history views are ordered and paged by, with the id breaking ties
+DATE_FIELDS = {
+    'trades.json': 'open_date',
+    'deposits.json': 'date',
+    'withdrawals.json': 'date',
+}
+
+
+def copy_data(data):
+    """Copy parsed JSON so callers can mutate it without touching the cache"""
+    if isinstance(data, list):
+        return [copy_data(item) if isinstance(item, (dict, list)) else item for item in data]
+    if isinstance(data, dict):
+        return {key: copy_data(value) if isinstance(value, (dict, list)) else value
+                for key, value in data.items()}
+    return data
+
+
+def _dumps(data):
+    return serialization.json_dumps(data).decode()
+
+
+def _page(records, date_field, before, limit, criteria):
+    """Select a page of records newest (date, id) first with a bounded heap"""
+    def key(record):
+        return (record.get(date_field) or '', record.get('id') or '')
+
+    matches = (record for record in records
+               if all(record.get(k) == v for k, v in criteria.items())
+               and (before is None or key(record) < before))
+    return heapq.nlargest(limit, matches, key=key)
+
+
+def _matches(record, date_field, start, end, criteria):
+    if not all(record.get(k) == v for k, v in criteria.items()):
+        return False
+    if not date_field:
+        return True
+    date = record.get(date_field) or ''
+    return (start is None or date >= start) and (end is None or date <= end)
+
+
+def _patch_index(index, field, changes):
+    """Apply (old, new) record changes to a {value: record} index in place
+
+    Returns False when the index has to be rebuilt instead: the changes are
+    unknown (new is None), or a record moved to another value and may have
+    hidden a duplicate under the old one.
+    """
+    for old, new in changes:
+        if new is None:
+            return False
+        value = new.get(field)
+        if old is not None and old.get(field) != value:
+            return False
+        current = index.get(value)
+        # The first record with a value wins, as in a fresh build
+        if current is None or current.get('id') == new.get('id'):
+            index[value] = new
+    return True
+
+
+def _file_signature(path):
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+
+class ParsedFileCache:
+    """Process-wide cache of parsed data files keyed by path
+
+    Entries are revalidated against (st_ino, st_mtime_ns, st_size) so writes
+    from other processes are picked up (atomic renames always change
+    st_ino). Cached objects are shared and must not be mutated; callers
+    that need to change them take a copy with copy_data.
+
+    The least recently used files are dropped once the cached files add up
+    to more than max_bytes on disk, so archive partitions read once by a
+    history view do not stay in memory for the life of the worker.
+    """
+
+    def __init__(self, max_bytes=PARSE_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.bytes_parsed = 0
+
+    def get(self, path, parse):
+        """Get the parsed contents of path, re-parsing only if it changed"""
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            self.invalidate(path)
+            return None
+
+        signature = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None and entry[0] == signature:
+                self._entries.move_to_end(path)
+                self.hits += 1
+                return entry[1]
+
+        with open(path, 'rb') as f:
+            raw = f.read()
+        data = parse(raw)
+
+        with self._lock:
+            self.misses += 1
+            self.bytes_parsed += len(raw)
+            self._store(path, signature, data)
+        return data
+
+    def put(self, path, data):
+        """Remember data just written to path"""
+        stat = os.stat(path)
+        with self._lock:
+            self._store(path, (stat.st_ino, stat.st_mtime_ns, stat.st_size), data)
+
+    def _store(self, path, signature, data):
+        old = self._entries.pop(path, None)
+        if old is not None:
+            self._bytes -= old[0][2]
+        self._entries[path] = (signature, data)
+        self._bytes += signature[2]
+        # The entry just stored stays even if it alone is over the limit
+        while self._bytes > self.max_bytes and len(self._entries) > 1:
+            evicted = self._entries.popitem(last=False)[1]
+            self._bytes -= evicted[0][2]
+            self.evictions += 1
+
+    def invalidate(self, path=None):
+        with self._lock:
+            if path is None:
+                self._entries.clear()
+                self._bytes = 0
+            else:
+                entry = self._entries.pop(path, None)
+                if entry is not None:
+                    self._bytes -= entry[0][2]
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups * 100, 2) if lookups else 0,
+            'bytes_parsed': self.bytes_parsed,
+            'evictions': self.evictions,
+            'entries': len(self._entries),
+            'bytes': self._bytes
+        }
+
+
+class JSONStorage:
+    """Keeps every collection as a whole JSON file in the data directory
+
+    Parsed files are kept in a ParsedFileCache, so repeated reads within and
+    across requests only pay for json parsing when a file actually changed.
+    Trades are kept in a TradeJournal, so opening or closing a position
+    appends one line instead of rewriting trades.json. Every other file has
+    a FileWriter thread that groups concurrent changes into one atomic write.
+
+    Every write happens under the file's FileLock (fcntl), so several worker
+    processes can share the data directory. Plain reads take no lock.
+    """
+
+    name = 'json'
+
+    def __init__(self, data_dir=DATA_DIR, sync_writes=SYNC_WRITES, fmt=serialization.DATA_FORMAT):
+        self.data_dir = data_dir
+        self.sync_writes = sync_writes
+        self.format = serialization.check_format(fmt)
+        self.cache = ParsedFileCache()
+        self.journals = {'trades.json': TradeJournal(self.path('trades.json'), fmt=self.format)}
+        self.writers = {}
+        self.locks = {'trades.json': self.journals['trades.json'].lock}
+        self._indexes = {}
+        self._batches = {}
+        self._lock = threading.RLock()
+
+    def path(self, filename):
+        return os.path.join(self.data_dir, filename)
+
+    def exists(self, filename):
+        return os.path.exists(self.path(filename))
+
+    def version(self, filename):
+        """Get a token that changes whenever the collection changes (stat only, no read)"""
+        if filename in self.journals:
+            return self.journals[filename].version()
+        return _file_signature(self.path(filename))
+
+    def _read(self, filename):
+        """Get the shared cached copy of a collection (do not mutate)"""
+        if filename in self.journals:
+            return self.journals[filename].records()
+
+        file_path = self.path(filename)
+
+        def parse(raw):
+            try:
+                return serialization.loads(raw)
+            except ValueError:
+                logging.error(f"Error decoding data from {file_path}")
+                return []
+
+        data = self.cache.get(file_path, parse)
+        return [] if data is None else data
+
+    def _begin_batch(self, filename):
+        """Copy a collection for its FileWriter and start tracking changed records"""
+        base = self._read(filename)
+        state = copy_data(base)
+        self._batches[filename] = (base, state, [])
+        return state
+
+    def _track(self, filename, old, new):
+        """Note a record changed by the current writer batch
+
+        old is None for inserts; both are None when any record may change.
+        """
+        batch = self._batches.get(filename)
+        if batch is not None:
+            batch[2].append((old, new))
+
+    def _write(self, filename, data):
+        """Write a whole collection to disk (called from its FileWriter)"""
+        file_path = self.path(filename)
+        write_atomic(file_path, serialization.dumps(data, self.format))
+        self.cache.put(file_path, data)
+
+        base, state, changes = self._batches.pop(filename, (None, None, None))
+        self._reindex(filename, base, data, changes if data is state else None)
+
+    def _reindex(self, filename, base, records, changes):
+        """Carry the lookup indexes of a collection over to the records just written
+
+        Only the entries of the records the batch changed are updated. An
+        index is dropped, and rebuilt by the next lookup, when it does not
+        cover base (another process wrote the file) or the changes are
+        unknown (save, mutate and transaction).
+        """
+        for key, index in list(self._indexes.items()):
+            if key[0] != filename:
+                continue
+            if changes is None or index[0] is not base or not _patch_index(index[1], key[1], changes):
+                self._indexes.pop(key, None)
+            else:
+                index[0] = records
+
+    def lock(self, filename):
+        """Get the cross-process lock of a data file"""
+        lock = self.locks.get(filename)
+        if lock is None:
+            with self._lock:
+                lock = self.locks.setdefault(filename, FileLock(self.path(filename)))
+        return lock
+
+    def _writer(self, filename):
+        writer = self.writers.get(filename)
+        if writer is None:
+            with self._lock:
+                writer = self.writers.get(filename)
+                if writer is None:
+                    writer = FileWriter(filename,
+                                        read=lambda: self._begin_batch(filename),
+                                        write=lambda data: self._write(filename, data),
+                                        lock=self.lock(filename))
+                    self.writers[filename] = writer
+        return writer
+
+    def _durable(self, wait):
+        """Whether a write should wait for its flush (wait=None uses SYNC_WRITES)"""
+        return self.sync_writes if wait is None else wait
+
+    def load(self, filename):
+        """Load a whole collection"""
+        return copy_data(self._read(filename))
+
+    def save(self, filename, data, wait=None):
+        """Replace a whole collection"""
+        if filename in self.journals:
+            self.journals[filename].replace(data)
+            return
+
+        pending = self._writer(filename).replace(copy_data(data))
+        if self._durable(wait):
+            pending.result()
+
+    def get(self, filename, record_id):
+        """Get a single record by id"""
+        if filename in self.journals:
+            record = self.journals[filename].get(record_id)
+            return None if record is None else copy_data(record)
+
+        return self.lookup(filename, 'id', record_id)
+
+    def lookup(self, filename, field, value):
+        """Get the first record whose field equals value through a hash index
+
+        The index is built on first use and then patched by each write with
+        just the records it changed, so lookups stay O(1). It is only rebuilt
+        after a write it cannot follow, such as one from another process.
+        """
+        records = self._read(filename)
+        index = self._indexes.get((filename, field))
+        if index is None or index[0] is not records:
+            index = [records, {record.get(field): record for record in reversed(records)}]
+            self._indexes[(filename, field)] = index
+        record = index[1].get(value)
+        return None if record is None else copy_data(record)
+
+    def find(self, filename, **criteria):
+        """Get all records whose fields equal the given values"""
+        return [copy_data(record) for record in self._read(filename)
+                if all(record.get(key) == value for key, value in criteria.items())]
+
+    def page(self, filename, date_field, before=None, limit=50, **criteria):
+        """Get up to limit matching records, newest (date, id) first, older than before
+
+        before is the (date, id) of the last record of the previous page.
+        """
+        return [copy_data(record) for record in _page(self._read(filename), date_field, before, limit, criteria)]
+
+    def iter_records(self, filename, date_field=None, start=None, end=None, **criteria):
+        """Yield matching records one at a time, in file order
+
+        With date_field, only records dated from start to end (inclusive,
+        either may be None) are yielded.
+        """
+        for record in self._read(filename):
+            if _matches(record, date_field, start, end, criteria):
+                yield copy_data(record)
+
+    def insert(self, filename, record, wait=None, unique=()):
+        """Append a record to a collection
+
+        With unique field names, the record is only added if no record has
+        the same value in any of them, and whether it was added is returned.
+        The check (through the lookup indexes) and the append are one step
+        of the file's writer.
+        """
+        if filename in self.journals:
+            self.journals[filename].append('opened', record)
+            return True
+
+        def taken(records, field):
+            base, state, changes = self._batches[filename]
+            if records is not state or any(new is None for _, new in changes):
+                # This batch replaced or changed records it did not track
+                return any(other.get(field) == record.get(field) for other in records)
+            # The index covers the file as of this batch, changes has the rest
+            return (self.lookup(filename, field, record.get(field)) is not None
+                    or any(new.get(field) == record.get(field) for _, new in changes))
+
+        def append(records):
+            if any(taken(records, field) for field in unique):
+                return None
+            records.append(record)
+            self._track(filename, None, record)
+            return True
+
+        pending = self._writer(filename).submit(append)
+        if unique:
+            return pending.result(durable=self._durable(wait)) is not None
+        if self._durable(wait):
+            pending.result()
+        return True
+
+    def update(self, filename, record_id, fn, wait=None):
+        """Apply fn to one record and save it when fn returns a result
+
+        fn mutates the record in place and returns None to leave it untouched.
+        """
+        if filename in self.journals:
+            return self.journals[filename].update(record_id, fn)
+
+        def apply(records):
+            for record in records:
+                if record.get('id') == record_id:
+                    self._track(filename, dict(record), record)
+                    return fn(record)
+            return None
+
+        # Fire-and-forget callers still wait for the (in-memory) apply to get the result
+        return self._writer(filename).submit(apply).result(durable=self._durable(wait))
+
+    def update_many(self, filename, updates, wait=None):
+        """Apply {record_id: fn} like update, saving all changes in one write
+
+        Returns {record_id: result} for the records fn changed.
+        """
+        if filename in self.journals:
+            return self.journals[filename].update_many(updates)
+
+        def apply(records):
+            results = {}
+            for record in records:
+                fn = updates.get(record.get('id'))
+                if fn is not None:
+                    self._track(filename, dict(record), record)
+                    result = fn(record)
+                    if result is not None:
+                        results[record.get('id')] = result
+            return results or None
+
+        return self._writer(filename).submit(apply).result(durable=self._durable(wait)) or {}
+
+    def mutate(self, filename, fn, wait=None):
+        """Apply fn to the whole collection and save it when fn returns a result"""
+        if filename in self.journals:
+            with self.transaction(filename) as records:
+                return fn(records)
+
+        def apply(records):
+            # Any record may change, so the lookup indexes are rebuilt
+            self._track(filename, None, None)
+            return fn(records)
+
+        return self._writer(filename).submit(apply).result(durable=self._durable(wait))
+
+    @contextmanager
+    def transaction(self, filename):
+        """Lock a collection, yield it for in-place changes and write it on exit
+
+        The file is only re-read if another process changed it since it was
+        cached. Nothing is written if the block raises.
+        """
+        with self.lock(filename):
+            data = self.load(filename)
+            yield data
+            if filename in self.journals:
+                self.journals[filename].replace(data)
+            else:
+                self._write(filename, copy_data(data))
+
+    def convert(self, fmt):
+        """Rewrite every data file in the given format (one-shot migration)
+
+        Returns a list of (filename, old_format, bytes_before, bytes_after).
+        """
+        fmt = serialization.check_format(fmt)
+        converted = []
+
+        for journal in self.journals.values():
+            journal.compact()
+
+        for filename in sorted(os.listdir(self.data_dir)):
+            if not filename.endswith('.json'):
+                continue
+            with self.lock(filename):
+                file_path = self.path(filename)
+                with open(file_path, 'rb') as f:
+                    raw = f.read()
+                content = serialization.dumps(serialization.loads(raw), fmt)
+                write_atomic(file_path, content)
+                converted.append((filename, serialization.detect_format(raw), len(raw), len(content)))
+
+        self.format = fmt
+        for journal in self.journals.values():
+            journal.format = fmt
+        self.cache.invalidate()
+        return converted
+
+
+class SQLiteStorage:
+    """Keeps collections in an SQLite database in WAL mode
+
+    Users, trades, deposits, withdrawals and trader stats get a table each
+    with indexes on user_id, status, username and email, so lookups and
+    single-record updates touch one row instead of the whole collection. Prices live in their own
+    table and any other file is kept as a document blob.
+    """
+
+    name = 'sqlite'
+
+    def __init__(self, db_path=SQLITE_PATH, data_dir=DATA_DIR):
+        self.db_path = db_path
+        self.data_dir = data_dir
+        self._local = threading.local()
+        self._create_schema()
+
+    @property
+    def conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def _create_schema(self):
+        conn = self.conn
+        conn.execute('CREATE TABLE IF NOT EXISTS users '
+                     '(id INTEGER PRIMARY KEY, username TEXT, email TEXT, data TEXT NOT NULL)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_users_username ON users (username)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_users_email ON users (email)')
+
+        for table in ('trades', 'deposits', 'withdrawals'):
+            conn.execute(f'CREATE TABLE IF NOT EXISTS {table} '
+                         '(id TEXT PRIMARY KEY, user_id INTEGER, status TEXT, data TEXT NOT NULL)')
+            conn.execute(f'CREATE INDEX IF NOT EXISTS idx_{table}_user_status ON {table} (user_id, status)')
+            conn.execute(f'CREATE INDEX IF NOT EXISTS idx_{table}_status ON {table} (status)')
+
+        for filename, date_field in DATE_FIELDS.items():
+            table = TABLES[filename][0]
+            conn.execute(f'CREATE INDEX IF NOT EXISTS idx_{table}_date ON {table} '
+                         f"(json_extract(data, '$.{date_field}'), id)")
+            conn.execute(f'CREATE INDEX IF NOT EXISTS idx_{table}_user_date ON {table} '
+                         f"(user_id, json_extract(data, '$.{date_field}'), id)")
+            conn.execute(f'CREATE INDEX IF NOT EXISTS idx_{table}_status_date ON {table} '
+                         f"(status, json_extract(data, '$.{date_field}'), id)")
+
+        conn.execute('CREATE TABLE IF NOT EXISTS trader_stats (id INTEGER PRIMARY KEY, data TEXT NOT NULL)')
+
+        conn.execute('CREATE TABLE IF NOT EXISTS prices (pair TEXT PRIMARY KEY, price REAL NOT NULL)')
+        conn.execute('CREATE TABLE IF NOT EXISTS documents (name TEXT PRIMARY KEY, data TEXT NOT NULL)')
+
+        # Change counter per table, bumped by triggers on every write
+        conn.execute('CREATE TABLE IF NOT EXISTS versions (name TEXT PRIMARY KEY, version INTEGER NOT NULL)')
+        for table, _ in TABLES.values():
+            conn.execute('INSERT OR IGNORE INTO versions (name, version) VALUES (?, 0)', (table,))
+            for event in ('INSERT', 'UPDATE', 'DELETE'):
+                conn.execute(f'CREATE TRIGGER IF NOT EXISTS {table}_{event.lower()}_version AFTER {event} ON {table} '
+                             f"BEGIN UPDATE versions SET version = version + 1 WHERE name = '{table}'; END")
+
+        # Collections that were kept as documents before they got a table
+        for filename in TABLES:
+            row = conn.execute('SELECT data FROM documents WHERE name = ?', (filename,)).fetchone()
+            if row:
+                with self._immediate():
+                    self._replace(filename, serialization.json_loads(row[0]))
+                    conn.execute('DELETE FROM documents WHERE name = ?', (filename,))
+
+    def _row(self, filename, record):
+        table, columns = TABLES[filename]
+        return [record.get('id')] + [record.get(column) for column in columns] + [_dumps(record)]
+
+    def _upsert_sql(self, filename):
+        table, columns = TABLES[filename]
+        names = ', '.join(('id',) + columns + ('data',))
+        marks = ', '.join('?' * (len(columns) + 2))
+        updates = ', '.join(f'{name} = excluded.{name}' for name in columns + ('data',))
+        return f'INSERT INTO {table} ({names}) VALUES ({marks}) ON CONFLICT (id) DO UPDATE SET {updates}'
+
+    def exists(self, filename):
+        if filename in TABLES:
+            return self.conn.execute(f'SELECT 1 FROM {TABLES[filename][0]} LIMIT 1').fetchone() is not None
+        if filename == 'prices.json':
+            return self.conn.execute('SELECT 1 FROM prices LIMIT 1').fetchone() is not None
+        return self.conn.execute('SELECT 1 FROM documents WHERE name = ?', (filename,)).fetchone() is not None
+
+    def load(self, filename):
+        """Load a whole collection"""
+        conn = self.conn
+        if filename in TABLES:
+            table = TABLES[filename][0]
+            return [serialization.json_loads(row[0]) for row in conn.execute(f'SELECT data FROM {table} ORDER BY rowid')]
+        if filename == 'prices.json':
+            return {pair: price for pair, price in conn.execute('SELECT pair, price FROM prices')}
+        row = conn.execute('SELECT data FROM documents WHERE name = ?', (filename,)).fetchone()
+        return serialization.json_loads(row[0]) if row else []
+
+    def save(self, filename, data, wait=None):
+        """Replace a whole collection"""
+        with self._immediate():
+            self._replace(filename, data)
+
+    def version(self, filename):
+        """Get a token that changes whenever the collection changes
+
+        Tables have a change counter kept by triggers (one indexed row
+        read). For other files, every commit appends to the WAL and every
+        checkpoint rewrites the database file, so their signatures cover
+        writes from all processes.
+        """
+        if filename in TABLES:
+            row = self.conn.execute('SELECT version FROM versions WHERE name = ?', (TABLES[filename][0],)).fetchone()
+            return row[0] if row else None
+        return (_file_signature(self.db_path), _file_signature(f"{self.db_path}-wal"))
+
+    @contextmanager
+    def _immediate(self):
+        """Run a block in an IMMEDIATE transaction (takes the write lock up front)"""
+        conn = self.conn
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield conn
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+
+    def _replace(self, filename, data):
+        conn = self.conn
+        if filename in TABLES:
+            conn.execute(f'DELETE FROM {TABLES[filename][0]}')
+            conn.executemany(self._upsert_sql(filename), [self._row(filename, r) for r in data])
+        elif filename == 'prices.json':
+            conn.execute('DELETE FROM prices')
+            conn.executemany('INSERT INTO prices (pair, price) VALUES (?, ?)', list(data.items()))
+        else:
+            conn.execute('INSERT OR REPLACE INTO documents (name, data) VALUES (?, ?)',
+                         (filename, _dumps(data)))
+
+    def get(self, filename, record_id):
+        """Get a single record by id"""
+        if filename not in TABLES:
+            return next((r for r in self.load(filename) if r.get('id') == record_id), None)
+        table = TABLES[filename][0]
+        row = self.conn.execute(f'SELECT data FROM {table} WHERE id = ?', (record_id,)).fetchone()
+        return serialization.json_loads(row[0]) if row else None
+
+    def lookup(self, filename, field, value):
+        """Get the first record whose field equals value (indexed columns use SQLite indexes)"""
+        records = self.find(filename, **{field: value})
+        return records[0] if records else None
+
+    def find(self, filename, **criteria):
+        """Get all records whose fields equal the given values
+
+        Criteria on indexed columns are answered by SQLite, the rest are
+        checked on the decoded rows.
+        """
+        if filename not in TABLES:
+            return [record for record in self.load(filename)
+                    if all(record.get(key) == value for key, value in criteria.items())]
+        table, columns = TABLES[filename]
+        indexed = {key: value for key, value in criteria.items() if key in columns or key == 'id'}
+        remaining = {key: value for key, value in criteria.items() if key not in indexed}
+
+        sql = f'SELECT data FROM {table}'
+        if indexed:
+            sql += ' WHERE ' + ' AND '.join(f'{key} = ?' for key in indexed)
+        records = [serialization.json_loads(row[0]) for row in self.conn.execute(sql + ' ORDER BY rowid', list(indexed.values()))]
+        return [record for record in records
+                if all(record.get(key) == value for key, value in remaining.items())]
+
+    def _where(self, filename, criteria):
+        """Get the table and the WHERE terms and parameters matching criteria"""
+        table, columns = TABLES[filename]
+        where, params = [], []
+        for key, value in criteria.items():
+            where.append(f'{key} = ?' if key in columns or key == 'id' else f"json_extract(data, '$.{key}') = ?")
+            params.append(value)
+        return table, where, params
+
+    def page(self, filename, date_field, before=None, limit=50, **criteria):
+        """Get up to limit matching records, newest (date, id) first, older than before
+
+        Tables are read with a keyset query on the (date, id) index, so the
+        cost depends on the page size and not on how many rows come before.
+        """
+        if filename not in TABLES:
+            return _page(self.load(filename), date_field, before, limit, criteria)
+        table, where, params = self._where(filename, criteria)
+        date = f"json_extract(data, '$.{date_field}')"
+        if before is not None:
+            # Spelled out so SQLite can seek the date index instead of scanning from the top
+            where.append(f'{date} <= ? AND ({date} < ? OR id < ?)')
+            params.extend((before[0], before[0], before[1]))
+        sql = f'SELECT data FROM {table}'
+        if where:
+            sql += ' WHERE ' + ' AND '.join(where)
+        sql += f' ORDER BY {date} DESC, id DESC LIMIT ?'
+        return [serialization.json_loads(row[0]) for row in self.conn.execute(sql, params + [limit])]
+
+    def iter_records(self, filename, date_field=None, start=None, end=None, **criteria):
+        """Yield matching records one at a time, oldest (date, id) first when date_field is given
+
+        Tables are read through a cursor in batches, so memory stays
+        bounded however many rows match.
+        """
+        if filename not in TABLES:
+            for record in self.load(filename):
+                if _matches(record, date_field, start, end, criteria):
+                    yield record
+            return
+        table, where, params = self._where(filename, criteria)
+        order = 'rowid'
+        if date_field:
+            date = f"json_extract(data, '$.{date_field}')"
+            order = f'{date}, id'
+            if start is not None:
+                where.append(f'{date} >= ?')
+                params.append(start)
+            if end is not None:
+                where.append(f'{date} <= ?')
+                params.append(end)
+        sql = f'SELECT data FROM {table}'
+        if where:
+            sql += ' WHERE ' + ' AND '.join(where)
+        # A connection of its own, so the open cursor does not share the
+        # thread's connection with writes made while the caller consumes it
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        try:
+            cursor = conn.execute(f'{sql} ORDER BY {order}', params)
+            while True:
+                rows = cursor.fetchmany(500)
+                if not rows:
+                    break
+                for row in rows:
+                    yield serialization.json_loads(row[0])
+        finally:
+            conn.close()
+
+    def insert(self, filename, record, wait=None, unique=()):
+        """Insert a single record
+
+        With unique field names, the record is only added if no record has
+        the same value in any of them, and whether it was added is returned.
+        The check and the insert run in one IMMEDIATE transaction.
+        """
+        with self._immediate() as conn:
+            if any(self.lookup(filename, field, record.get(field)) for field in unique):
+                return False
+            if filename not in TABLES:
+                self._replace(filename, self.load(filename) + [record])
+            else:
+                conn.execute(self._upsert_sql(filename), self._row(filename, record))
+        return True
+
+    def update(self, filename, record_id, fn, wait=None):
+        """Apply fn to one record and save it when fn returns a result
+
+        The read and the write happen in one IMMEDIATE transaction so
+        concurrent writers cannot lose each other's updates.
+        """
+        if filename not in TABLES:
+            def apply(records):
+                for record in records:
+                    if record.get('id') == record_id:
+                        return fn(record)
+                return None
+
+            return self.mutate(filename, apply)
+
+        table = TABLES[filename][0]
+        with self._immediate() as conn:
+            row = conn.execute(f'SELECT data FROM {table} WHERE id = ?', (record_id,)).fetchone()
+            result = None
+            if row:
+                record = serialization.json_loads(row[0])
+                result = fn(record)
+                if result is not None:
+                    conn.execute(self._upsert_sql(filename), self._row(filename, record))
+            return result
+
+    def update_many(self, filename, updates, wait=None):
+        """Apply {record_id: fn} like update in one IMMEDIATE transaction
+
+        Returns {record_id: result} for the records fn changed.
+        """
+        if filename not in TABLES:
+            def apply(records):
+                results = {}
+                for record in records:
+                    fn = updates.get(record.get('id'))
+                    if fn is not None:
+                        result = fn(record)
+                        if result is not None:
+                            results[record.get('id')] = result
+                return results or None
+
+            return self.mutate(filename, apply) or {}
+
+        table = TABLES[filename][0]
+        ids = list(updates)
+        results = {}
+        with self._immediate() as conn:
+            changed = []
+            for start in range(0, len(ids), 500):
+                chunk = ids[start:start + 500]
+                rows = conn.execute(f'SELECT data FROM {table} WHERE id IN ({", ".join("?" * len(chunk))})', chunk)
+                for (data,) in rows.fetchall():
+                    record = serialization.json_loads(data)
+                    result = updates[record.get('id')](record)
+                    if result is not None:
+                        results[record.get('id')] = result
+                        changed.append(self._row(filename, record))
+            conn.executemany(self._upsert_sql(filename), changed)
+        return results
+
+    def mutate(self, filename, fn, wait=None):
+        """Apply fn to the whole collection and save it when fn returns a result"""
+        with self._immediate():
+            records = self.load(filename)
+            result = fn(records)
+            if result is not None:
+                self._replace(filename, records)
+            return result
+
+    @contextmanager
+    def transaction(self, filename):
+        """Yield a collection for in-place changes and write it on exit
+
+        SQLite's own write lock (BEGIN IMMEDIATE) excludes other processes.
+        """
+        with self._immediate():
+            data = self.load(filename)
+            yield data
+            self._replace(filename, data)
+
+    def import_json(self, source=None):
+        """Copy JSON collections from the data directory into empty tables"""
+        source = source or JSONStorage(self.data_dir)
+        for filename in list(TABLES) + ['prices.json']:
+            if not source.exists(filename):
+                continue
+            if filename in TABLES and self.conn.execute(
+                    f'SELECT 1 FROM {TABLES[filename][0]} LIMIT 1').fetchone():
+                continue
+            if filename == 'prices.json' and self.exists(filename):
+                continue
+            data = source.load(filename)
+            if data:
+                self.save(filename, data)
+                logging.info(f"Imported {len(data)} records from {filename} into SQLite")
+
+
+_storage = None
+_storage_lock = threading.Lock()
+
+
+def get_storage():
+    """Get the configured storage backend (created on first use)"""
+    global _storage
+    if _storage is None:
+        with _storage_lock:
+            if _storage is None:
+                if not os.path.exists(DATA_DIR):
+                    os.makedirs(DATA_DIR)
+                if STORAGE_BACKEND == 'sqlite':
+                    _storage = SQLiteStorage()
+                    _storage.import_json()
+                else:
+                    _storage = JSONStorage()
+                logging.info(f"Using {_storage.name} storage backend")
+    return _storage
@@ -0,0 +1,18 @@
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# The app keeps its data relative to the working directory and picks the
+# storage backend when utils is imported, so both are set before any test
+# imports it. STORAGE_BACKEND=json python -m pytest runs against JSON files.
+DATA_ROOT = tempfile.mkdtemp(prefix='neon-tests-')
+os.chdir(DATA_ROOT)
+os.environ.setdefault('STORAGE_BACKEND', 'sqlite')
+
+
+def pytest_unconfigure(config):
+    # pytest restores the working directory; the exit-time flushes of the
+    # app still write under the relative data directory
+    os.chdir(DATA_ROOT)
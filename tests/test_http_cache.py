@@ -0,0 +1,23 @@
+from flask import Flask
+
+from http_cache import SerializedBody, json_response
+
+app = Flask(__name__)
+
+
+def test_etag_depends_only_on_the_body():
+    # Separate workers (or a restarted one) build their bodies independently
+    assert SerializedBody({'BTC/USDT': 100.0}).etag == SerializedBody({'BTC/USDT': 100.0}).etag
+    assert SerializedBody({'BTC/USDT': 100.0}).etag != SerializedBody({'BTC/USDT': 101.0}).etag
+
+
+def test_matching_etag_is_not_modified():
+    body = SerializedBody({'BTC/USDT': 100.0})
+    etag = f"prices-{body.etag}"
+
+    with app.test_request_context(headers={'If-None-Match': f'"{etag}"'}):
+        assert json_response(body, etag).status_code == 304
+    with app.test_request_context(headers={'If-None-Match': '"prices-stale"'}):
+        response = json_response(body, etag)
+        assert response.status_code == 200
+        assert response.get_etag()[0] == etag
@@ -0,0 +1,59 @@
+import os
+import random
+import time
+import multiprocessing
+
+import pytest
+
+from journal import TradeJournal
+
+fork = multiprocessing.get_context('fork') if hasattr(os, 'fork') else None
+
+
+def append_trades(path, worker, count, compact_bytes, shared):
+    # Forked workers either reuse the parent's journal or open their own
+    journal = shared or TradeJournal(path, compact_bytes=compact_bytes)
+    rng = random.Random(worker)
+    for i in range(count):
+        journal.append('opened', {'id': f"{worker}-{i}", 'pad': 'x' * 200})
+        time.sleep(rng.random() * 0.003)
+    # Let a compaction started by the last append finish before exiting
+    time.sleep(0.3)
+
+
+@pytest.mark.skipif(fork is None, reason='needs fork')
+@pytest.mark.parametrize('inherit', [False, True])
+def test_concurrent_appends_survive_compaction(tmp_path, inherit):
+    path = str(tmp_path / 'trades.json')
+    # Small enough that every worker compacts many times
+    compact_bytes = 3000
+    parent = TradeJournal(path, compact_bytes=compact_bytes)
+    parent.append('opened', {'id': 'parent-0'})
+
+    workers = [fork.Process(target=append_trades, args=(path, worker, 40, compact_bytes, parent if inherit else None))
+               for worker in range(4)]
+    for process in workers:
+        process.start()
+    for process in workers:
+        process.join()
+        assert process.exitcode == 0
+
+    expected = {'parent-0'} | {f"{worker}-{i}" for worker in range(4) for i in range(40)}
+    assert {record['id'] for record in TradeJournal(path).records()} == expected
+    assert {record['id'] for record in parent.records()} == expected
+
+
+def test_compaction_keeps_appends_from_other_journal(tmp_path):
+    path = str(tmp_path / 'trades.json')
+    first = TradeJournal(path, compact_bytes=10 ** 9)
+    second = TradeJournal(path, compact_bytes=10 ** 9)
+    first.append('opened', {'id': 'a'})
+    second.append('opened', {'id': 'b'})
+
+    # first has not replayed b yet; compacting must still keep it
+    first.compact()
+    second.append('opened', {'id': 'c'})
+    second.compact()
+
+    assert {record['id'] for record in TradeJournal(path).records()} == {'a', 'b', 'c'}
+    assert {record['id'] for record in first.records()} == {'a', 'b', 'c'}
@@ -0,0 +1,46 @@
+import pytest
+
+from leaderboard import Leaderboard
+from storage import JSONStorage, SQLiteStorage
+
+
+@pytest.fixture(params=['json', 'sqlite'])
+def storage(request, tmp_path):
+    if request.param == 'json':
+        return JSONStorage(data_dir=str(tmp_path), sync_writes=True)
+    return SQLiteStorage(db_path=str(tmp_path / 'data.db'), data_dir=str(tmp_path))
+
+
+def closed(user_id, amount, profit_loss):
+    return {'user_id': user_id, 'status': 'closed', 'amount': amount, 'profit_loss': profit_loss, 'leverage': 2}
+
+
+def test_record_updates_only_the_traders_involved(storage):
+    board = Leaderboard(storage)
+    board.record([closed(1, 100, 10), closed(2, 100, 50)])
+    board.record([closed(1, 100, 30), {'user_id': 3, 'status': 'open', 'amount': 100}])
+
+    traders = {trader['id']: trader for trader in storage.load('trader_stats.json')}
+    assert set(traders) == {1, 2}
+    assert traders[1]['total_profit'] == 40 and traders[1]['invested'] == 200 and traders[1]['trade_count'] == 2
+    assert traders[2]['total_profit'] == 50 and traders[2]['largest_profit'] == 50
+
+
+def test_top_is_cached_until_stats_change(storage):
+    board = Leaderboard(storage)
+    board.record([closed(1, 100, 10), closed(2, 100, 50)])
+    described = []
+
+    def describe(trader):
+        described.append(trader['id'])
+        return trader['id']
+
+    assert board.top(10, describe) == [2, 1]
+    # Writes to other collections leave the cached result alone
+    storage.save('prices.json', {'BTC/USDT': 100.0})
+    storage.save('jobs.json', [{'id': 'job'}])
+    assert board.top(10, describe) == [2, 1]
+    assert described == [2, 1]
+
+    board.record([closed(1, 100, 200)])
+    assert board.top(10, describe) == [1, 2]
@@ -0,0 +1,66 @@
+import datetime
+import os
+
+from partitions import PartitionArchive
+from storage import JSONStorage
+
+
+def settled_deposits():
+    deposits = []
+    for i in range(24):
+        month = f"{2022 + i // 12}-{i % 12 + 1:02d}"
+        # User 1 only deposits in two months, user 2 in every month
+        user_id = 1 if i in (3, 17) else 2
+        date = f"{month}-10 12:00:00"
+        deposits.append({'id': f"d{i}", 'user_id': user_id, 'amount': 10, 'status': 'approved',
+                         'date': date, 'approved_date': date})
+    deposits.append({'id': 'pending', 'user_id': 1, 'amount': 10, 'status': 'pending', 'date': '2024-01-01 00:00:00'})
+    return deposits
+
+
+def make_archive(tmp_path):
+    store = JSONStorage(data_dir=str(tmp_path), sync_writes=True)
+    store.save('deposits.json', settled_deposits())
+    archive = PartitionArchive(store)
+    assert archive.archive('deposits.json', now=datetime.datetime(2030, 1, 1)) == 24
+    return store, archive
+
+
+def test_unsettled_status_reads_no_partition(tmp_path):
+    store, archive = make_archive(tmp_path)
+
+    assert archive.months('deposits.json', status='pending') == []
+    assert len(archive.months('deposits.json', status='approved')) == 24
+
+
+def test_user_reads_only_their_months(tmp_path):
+    store, archive = make_archive(tmp_path)
+
+    assert archive.months('deposits.json', user_id=1) == ['2022-04', '2023-06']
+    assert archive.months('deposits.json', user_id=3) == []
+    assert [record['id'] for record in archive.iter_records('deposits.json', user_id=1)] == ['d3', 'd17']
+
+    # The index of an archive written before it existed is built on first use
+    os.remove(store.path(archive.users_index('deposits.json')))
+    assert archive.months('deposits.json', user_id=1) == ['2022-04', '2023-06']
+
+
+def test_recent_records_include_newer_archived_ones(monkeypatch, tmp_path):
+    import utils
+
+    store = JSONStorage(data_dir=str(tmp_path), sync_writes=True)
+    archive = PartitionArchive(store)
+    store.save('deposits.json', [
+        {'id': 'new-approved', 'user_id': 1, 'status': 'approved', 'date': '2024-05-02 00:00:00',
+         'approved_date': '2024-05-03 00:00:00'},
+        {'id': 'old-approved', 'user_id': 1, 'status': 'approved', 'date': '2023-01-01 00:00:00',
+         'approved_date': '2023-01-02 00:00:00'},
+    ] + [{'id': f"pending-{i}", 'user_id': 1, 'status': 'pending', 'date': f"2024-0{i + 1}-01 00:00:00"}
+         for i in range(3)])
+    archive.archive('deposits.json', now=datetime.datetime(2030, 1, 1))
+    monkeypatch.setattr(utils, 'store', store)
+    monkeypatch.setattr(utils, 'partition_archive', archive)
+
+    # More pending records than the limit remain live, the approved ones are archived
+    recent = utils.get_recent_records('deposits.json', 2)
+    assert [record['id'] for record in recent] == ['new-approved', 'pending-2']
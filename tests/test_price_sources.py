@@ -0,0 +1,135 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+import pytest
+
+from price_sources import BinanceSource, CircuitBreaker, CoinGeckoSource, OKXSource, PriceAggregator
+
+
+class Stub:
+    """A local HTTP price provider answering every path with one canned response"""
+
+    def __init__(self, body, status=200, delay=0):
+        self.body = body
+        self.status = status
+        self.delay = delay
+        self.requests = []
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                url = urlparse(self.path)
+                stub.requests.append((url.path, parse_qs(url.query)))
+                time.sleep(stub.delay)
+                body = stub.body(url.path, parse_qs(url.query)) if callable(stub.body) else stub.body
+                raw = json.dumps(body).encode()
+                self.send_response(stub.status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(raw)))
+                self.end_headers()
+                self.wfile.write(raw)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def stubs():
+    started = []
+
+    def start(*args, **kwargs):
+        stub = Stub(*args, **kwargs)
+        started.append(stub)
+        return stub
+
+    yield start
+    for stub in started:
+        stub.close()
+
+
+def coingecko(btc, eth):
+    return {'bitcoin': {'usd': btc}, 'ethereum': {'usd': eth}}
+
+
+def binance(btc, eth):
+    return [{'symbol': 'BTCUSDT', 'price': str(btc)}, {'symbol': 'ETHUSDT', 'price': str(eth)}]
+
+
+def okx(btc, eth):
+    prices = {'BTC-USDT': btc, 'ETH-USDT': eth}
+    return lambda path, query: {'code': '0', 'data': [{'instId': query['instId'][0],
+                                                     'last': str(prices[query['instId'][0]])}]}
+
+
+def test_median_and_priority(stubs):
+    sources = [CoinGeckoSource(stubs(coingecko(100, 10)).url, retries=0),
+               BinanceSource(stubs(binance(102, 13)).url, retries=0),
+               OKXSource(stubs(okx(101, 11)).url, retries=0)]
+
+    median = PriceAggregator(sources, strategy='median', deadline=5).fetch(['BTC', 'ETH'])
+    priority = PriceAggregator(sources, strategy='priority', deadline=5).fetch(['BTC', 'ETH'])
+
+    assert median == {'BTC/USDT': 101, 'ETH/USDT': 11}
+    assert priority == {'BTC/USDT': 100, 'ETH/USDT': 10}
+
+
+def test_only_configured_symbols_are_requested(stubs):
+    binance_stub = stubs(binance(102, 13))
+    okx_stub = stubs(okx(101, 11))
+
+    BinanceSource(binance_stub.url, retries=0).fetch(['BTC', 'ETH'])
+    OKXSource(okx_stub.url, retries=0).fetch(['BTC', 'ETH'])
+
+    assert binance_stub.requests == [('/api/v3/ticker/price', {'symbols': ['["BTCUSDT","ETHUSDT"]']})]
+    assert sorted(query['instId'][0] for _, query in okx_stub.requests) == ['BTC-USDT', 'ETH-USDT']
+
+
+def test_slow_source_misses_the_deadline(stubs):
+    fast = CoinGeckoSource(stubs(coingecko(100, 10)).url, retries=0)
+    slow = BinanceSource(stubs(binance(200, 20), delay=1).url, retries=0)
+    aggregator = PriceAggregator([fast, slow], deadline=0.3)
+
+    start = time.monotonic()
+    prices = aggregator.fetch(['BTC', 'ETH'])
+
+    assert time.monotonic() - start < 0.8
+    assert prices == {'BTC/USDT': 100, 'ETH/USDT': 10}
+
+
+def test_breaker_opens_after_failures(stubs):
+    failing = stubs({'error': 'down'}, status=500)
+    source = CoinGeckoSource(failing.url, retries=0, breaker=CircuitBreaker(failure_threshold=2, reset_timeout=60))
+    aggregator = PriceAggregator([source], deadline=5)
+
+    assert aggregator.fetch(['BTC']) == {}
+    assert aggregator.fetch(['BTC']) == {}
+    assert source.breaker.state == 'open'
+
+    # While open the source is not called at all
+    assert aggregator.fetch(['BTC']) == {}
+    assert len(failing.requests) == 2
+    assert source.skipped == 1
+
+
+def test_busy_source_is_skipped(stubs):
+    slow_stub = stubs(coingecko(100, 10), delay=1)
+    slow = CoinGeckoSource(slow_stub.url, retries=0)
+    aggregator = PriceAggregator([slow], deadline=0.2)
+
+    assert aggregator.fetch(['BTC']) == {}
+    # The first call is still running, so the next refresh does not queue another
+    assert aggregator.fetch(['BTC']) == {}
+    assert slow.skipped == 1
+    assert len(slow_stub.requests) == 1
@@ -0,0 +1,135 @@
+import uuid
+import threading
+import pytest
+
+from app import app
+from models import create_user
+from utils import process_deposit, process_withdrawal, adjust_balance, get_user_balance, price_service, store
+
+
+@pytest.fixture
+def admin():
+    app.config['WTF_CSRF_ENABLED'] = False
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['admin'] = True
+    return client
+
+
+@pytest.fixture
+def user():
+    name = f"user-{uuid.uuid4().hex[:8]}"
+    return create_user({'username': name, 'email': f"{name}@example.com", 'name': name,
+                        'password_hash': '', 'balance': 0, 'is_active': True,
+                        'registered_date': '2024-01-01 00:00:00'})
+
+
+def test_approve_deposit_credits_balance(admin, user):
+    deposit_id = process_deposit(user.id, 250, 'tx-approve')
+
+    response = admin.post(f'/admin/request/deposit/{deposit_id}', data={'action': 'approve'})
+
+    assert response.status_code == 302
+    assert store.get('deposits.json', deposit_id)['status'] == 'approved'
+    assert get_user_balance(user.id) == 250
+
+
+def test_approve_deposit_twice_credits_once(admin, user):
+    deposit_id = process_deposit(user.id, 250, 'tx-twice')
+
+    admin.post(f'/admin/request/deposit/{deposit_id}', data={'action': 'approve'})
+    admin.post(f'/admin/request/deposit/{deposit_id}', data={'action': 'approve'})
+
+    assert get_user_balance(user.id) == 250
+
+
+def test_reject_deposit_leaves_balance(admin, user):
+    deposit_id = process_deposit(user.id, 250, 'tx-reject')
+
+    response = admin.post(f'/admin/request/deposit/{deposit_id}',
+                          data={'action': 'reject', 'reject_reason': 'unknown tx'})
+
+    assert response.status_code == 302
+    deposit = store.get('deposits.json', deposit_id)
+    assert deposit['status'] == 'rejected'
+    assert deposit['reject_reason'] == 'unknown tx'
+    assert get_user_balance(user.id) == 0
+
+
+def test_approve_withdrawal_keeps_deduction(admin, user):
+    adjust_balance(user.id, 500)
+    withdrawal_id = process_withdrawal(user.id, 200, 'wallet')
+
+    response = admin.post(f'/admin/request/withdrawal/{withdrawal_id}', data={'action': 'approve'})
+
+    assert response.status_code == 302
+    assert store.get('withdrawals.json', withdrawal_id)['status'] == 'approved'
+    assert get_user_balance(user.id) == 300
+
+
+def test_reject_withdrawal_refunds_balance(admin, user):
+    adjust_balance(user.id, 500)
+    withdrawal_id = process_withdrawal(user.id, 200, 'wallet')
+    assert get_user_balance(user.id) == 300
+
+    response = admin.post(f'/admin/request/withdrawal/{withdrawal_id}',
+                          data={'action': 'reject', 'reject_reason': 'bad address'})
+
+    assert response.status_code == 302
+    assert store.get('withdrawals.json', withdrawal_id)['status'] == 'rejected'
+    assert get_user_balance(user.id) == 500
+
+
+@pytest.fixture
+def trader(user):
+    price_service.publish({'BTC/USDT': 100.0})
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(user.id)
+        session['_fresh'] = True
+    return client
+
+
+def open_btc(client, amount):
+    return client.post('/api/open-position', json={'coin': 'BTC', 'amount': amount, 'leverage': 2, 'type': 'long'}).get_json()
+
+
+def test_open_position_deducts_margin(trader, user):
+    adjust_balance(user.id, 100)
+
+    assert open_btc(trader, 60)['success']
+    assert get_user_balance(user.id) == 40
+    assert open_btc(trader, 60) == {'success': False, 'message': 'Insufficient balance'}
+    assert get_user_balance(user.id) == 40
+
+
+def test_concurrent_opens_cannot_overspend(trader, user):
+    adjust_balance(user.id, 100)
+    results = []
+
+    def open_one():
+        client = app.test_client()
+        with client.session_transaction() as session:
+            session['_user_id'] = str(user.id)
+        results.append(open_btc(client, 80)['success'])
+
+    threads = [threading.Thread(target=open_one) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(results) == [False, False, False, True]
+    assert get_user_balance(user.id) == 20
+
+
+def test_ban_and_unban_user(admin, user):
+    # The page render afterwards needs templates, only the stored user is checked
+    admin.post(f'/admin/user/{user.id}', data={'action': 'ban', 'ban_reason': 'spam'})
+
+    banned = store.get('users.json', user.id)
+    assert banned['is_active'] is False and banned['ban_reason'] == 'spam'
+
+    admin.post(f'/admin/user/{user.id}', data={'action': 'unban'})
+    assert 'ban_reason' not in store.get('users.json', user.id)
+    assert store.get('users.json', user.id)['is_active'] is True
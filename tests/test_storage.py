@@ -0,0 +1,131 @@
+import threading
+
+import pytest
+
+from storage import JSONStorage, SQLiteStorage, ParsedFileCache
+
+
+@pytest.fixture(params=['json', 'sqlite'])
+def storage(request, tmp_path):
+    if request.param == 'json':
+        return JSONStorage(data_dir=str(tmp_path), sync_writes=True)
+    return SQLiteStorage(db_path=str(tmp_path / 'data.db'), data_dir=str(tmp_path))
+
+
+def add_users(storage, count):
+    for i in range(1, count + 1):
+        storage.insert('users.json', {'id': i, 'username': f"user{i}", 'email': f"user{i}@example.com", 'balance': 0})
+
+
+def test_lookup_index_follows_updates_without_rebuild(tmp_path):
+    storage = JSONStorage(data_dir=str(tmp_path), sync_writes=True)
+    add_users(storage, 3)
+    assert storage.lookup('users.json', 'username', 'user2')['id'] == 2
+    index = storage._indexes[('users.json', 'username')][1]
+
+    def credit(user):
+        user['balance'] += 10
+        return user['balance']
+
+    storage.update('users.json', 2, credit)
+    storage.update_many('users.json', {1: credit, 3: credit})
+    storage.insert('users.json', {'id': 4, 'username': 'user4', 'email': 'user4@example.com', 'balance': 0})
+
+    assert storage.lookup('users.json', 'username', 'user2')['balance'] == 10
+    assert storage.lookup('users.json', 'username', 'user3')['balance'] == 10
+    assert storage.lookup('users.json', 'username', 'user4')['id'] == 4
+    # Patched in place, not rebuilt from the whole file
+    assert storage._indexes[('users.json', 'username')][1] is index
+
+
+def test_lookup_index_follows_renames_and_other_writers(tmp_path):
+    storage = JSONStorage(data_dir=str(tmp_path), sync_writes=True)
+    add_users(storage, 3)
+    assert storage.lookup('users.json', 'username', 'user1')['id'] == 1
+
+    def rename(user):
+        user['username'] = 'renamed'
+        return True
+
+    storage.update('users.json', 1, rename)
+    assert storage.lookup('users.json', 'username', 'user1') is None
+    assert storage.lookup('users.json', 'username', 'renamed')['id'] == 1
+
+    # A write from another process (here another storage on the same files)
+    JSONStorage(data_dir=str(tmp_path), sync_writes=True).update('users.json', 2, rename)
+    storage.update('users.json', 3, lambda user: True)
+    assert storage.lookup('users.json', 'id', 2)['username'] == 'renamed'
+    assert storage.lookup('users.json', 'username', 'renamed')['id'] == 1
+
+
+def test_unique_insert_admits_one_of_concurrent_duplicates(storage):
+    add_users(storage, 2)
+    results = []
+
+    def register(i):
+        record = {'id': 100 + i, 'username': 'taken', 'email': f"taken{i}@example.com"}
+        results.append(storage.insert('users.json', record, unique=('username', 'email')))
+
+    threads = [threading.Thread(target=register, args=(i,)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(results) == [False] * 7 + [True]
+    assert len(storage.find('users.json', username='taken')) == 1
+    assert not storage.insert('users.json', {'id': 200, 'username': 'new', 'email': 'user1@example.com'},
+                              unique=('username', 'email'))
+
+
+@pytest.mark.parametrize('filename, date_field', [('deposits.json', 'date'), ('trades.json', 'open_date')])
+def test_status_page_reads_in_index_order(tmp_path, filename, date_field):
+    storage = SQLiteStorage(db_path=str(tmp_path / 'data.db'), data_dir=str(tmp_path))
+    table = filename.split('.')[0]
+    date = f"json_extract(data, '$.{date_field}')"
+    sql = (f'EXPLAIN QUERY PLAN SELECT data FROM {table} WHERE status = ? AND {date} <= ? '
+           f'AND ({date} < ? OR id < ?) ORDER BY {date} DESC, id DESC LIMIT ?')
+    plan = ' '.join(row[-1] for row in storage.conn.execute(sql, ('pending', 'x', 'x', 'y', 50)))
+
+    assert f'idx_{table}_status_date' in plan
+    assert 'TEMP B-TREE' not in plan
+
+
+def test_parse_cache_drops_least_recently_used_files(tmp_path):
+    cache = ParsedFileCache(max_bytes=250)
+    paths = []
+    for name in 'abc':
+        path = tmp_path / f"{name}.json"
+        path.write_bytes(b'[' + b'0,' * 50 + b'0]')
+        paths.append(str(path))
+
+    cache.get(paths[0], bytes)
+    cache.get(paths[1], bytes)
+    cache.get(paths[0], bytes)
+    cache.get(paths[2], bytes)
+
+    # b was used least recently and the three files are over the limit
+    assert cache.stats()['evictions'] == 1
+    assert cache.stats()['bytes'] <= 250
+    misses = cache.misses
+    cache.get(paths[0], bytes)
+    cache.get(paths[1], bytes)
+    assert cache.misses == misses + 1
+
+
+def test_unique_insert_checks_through_the_index(tmp_path):
+    storage = JSONStorage(data_dir=str(tmp_path), sync_writes=True)
+    add_users(storage, 3)
+    assert storage.lookup('users.json', 'username', 'user1')['id'] == 1
+    index = storage._indexes[('users.json', 'username')][1]
+
+    assert storage.insert('users.json', {'id': 4, 'username': 'user4', 'email': 'a@example.com'},
+                          unique=('username', 'email'))
+    assert not storage.insert('users.json', {'id': 5, 'username': 'user4', 'email': 'b@example.com'},
+                              unique=('username', 'email'))
+    assert not storage.insert('users.json', {'id': 6, 'username': 'user6', 'email': 'user2@example.com'},
+                              unique=('username', 'email'))
+
+    assert storage.lookup('users.json', 'username', 'user4')['id'] == 4
+    assert storage.lookup('users.json', 'id', 5) is None
+    assert storage._indexes[('users.json', 'username')][1] is index
@@ -0,0 +1,56 @@
+from user_cache import UserCache
+
+
+def test_entry_is_reloaded_after_version_changes():
+    version = [1]
+    loads = []
+    cache = UserCache(version=lambda: version[0])
+
+    def load(user_id):
+        loads.append(user_id)
+        return {'id': user_id, 'version': version[0]}
+
+    assert cache.get(7, load)['version'] == 1
+    assert cache.get(7, load)['version'] == 1
+    # Written by another process: no invalidate() here
+    version[0] = 2
+    assert cache.get(7, load)['version'] == 2
+    assert loads == [7, 7]
+
+
+def test_fill_racing_invalidate_is_dropped():
+    cache = UserCache()
+    state = {'balance': 0}
+
+    def stale_load(user_id):
+        value = dict(state)
+        # The user changes and is invalidated while this load is in flight
+        state['balance'] = 100
+        cache.invalidate(user_id)
+        return value
+
+    assert cache.get(1, stale_load)['balance'] == 0
+    assert cache.get(1, lambda user_id: dict(state))['balance'] == 100
+
+
+def test_entry_survives_writes_that_keep_its_stamp():
+    version = [1]
+    stamps = {7: 0, 8: 0}
+    loads = []
+    cache = UserCache(version=lambda: version[0], stamp=lambda user_id: stamps[user_id])
+
+    def load(user_id):
+        loads.append(user_id)
+        return {'id': user_id, 'stamp': stamps[user_id]}
+
+    cache.get(7, load)
+    cache.get(8, load)
+    # A balance write to user 8 bumps the file but not user 7's stamp
+    version[0] = 2
+    assert cache.get(7, load)['stamp'] == 0
+    # A profile edit to user 8 bumps its stamp
+    version[0] = 3
+    stamps[8] = 1
+    assert cache.get(8, load)['stamp'] == 1
+    assert cache.get(7, load)['stamp'] == 0
+    assert loads == [7, 8, 8]
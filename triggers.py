@@ -0,0 +1,81 @@
+import math
+import bisect
+import threading
+
+# Which way the price has to move to fire each threshold, per position side
+THRESHOLDS = {
+    'long': (('liquidation_price', 'liquidated', 'below'),
+             ('stop_loss', 'stop_loss', 'below'),
+             ('take_profit', 'take_profit', 'above')),
+    'short': (('liquidation_price', 'liquidated', 'above'),
+              ('stop_loss', 'stop_loss', 'above'),
+              ('take_profit', 'take_profit', 'below')),
+}
+
+
+class TriggerBook:
+    """Sorted trigger prices of open positions, per pair and direction
+
+    Thresholds that fire when the price falls to them (long liquidation and
+    stop loss, short take profit) and ones that fire when it rises to them
+    (long take profit, short liquidation and stop loss) are kept in two
+    bisect-sorted lists of (threshold, position_id, reason) per pair. The
+    triggers crossed at a price are a contiguous slice at one end of each
+    list, found in O(log n + k).
+    """
+
+    def __init__(self):
+        self._lists = {}
+        self._entries = {}
+        self._lock = threading.Lock()
+        self.version = None
+
+    def _list(self, pair, direction):
+        return self._lists.setdefault((pair, direction), [])
+
+    def _add(self, position):
+        pair = f"{position.get('coin')}/USDT"
+        entries = []
+        for field, reason, direction in THRESHOLDS.get(position.get('type'), ()):
+            if position.get(field) is None:
+                continue
+            entry = (float(position[field]), position['id'], reason)
+            bisect.insort(self._list(pair, direction), entry)
+            entries.append((pair, direction, entry))
+        self._entries[position['id']] = entries
+
+    def add(self, position):
+        with self._lock:
+            if position['id'] not in self._entries:
+                self._add(position)
+
+    def remove(self, position_id):
+        with self._lock:
+            for pair, direction, entry in self._entries.pop(position_id, ()):
+                lst = self._lists[(pair, direction)]
+                i = bisect.bisect_left(lst, entry)
+                if i < len(lst) and lst[i] == entry:
+                    del lst[i]
+
+    def rebuild(self, positions, version=None):
+        """Replace the book with the given open positions"""
+        with self._lock:
+            self._lists = {}
+            self._entries = {}
+            for position in positions:
+                if position.get('status') == 'open':
+                    self._add(position)
+            self.version = version
+
+    def crossed(self, pair, price):
+        """Get the (threshold, position_id, reason) triggers the price has reached"""
+        with self._lock:
+            below = self._lists.get((pair, 'below'), [])
+            above = self._lists.get((pair, 'above'), [])
+            # Falling triggers at or above the price, rising ones at or below it
+            fallen = below[bisect.bisect_left(below, (price,)):]
+            risen = above[:bisect.bisect_left(above, (math.nextafter(price, math.inf),))]
+            return fallen + risen
+
+    def __len__(self):
+        return len(self._entries)
@@ -0,0 +1,114 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+
+# Most users kept by the login cache and how long an entry stays valid
+USER_CACHE_SIZE = int(os.environ.get('USER_CACHE_SIZE', 10000))
+USER_CACHE_TTL = float(os.environ.get('USER_CACHE_TTL', 30))
+
+
+def touch_user(user):
+    """Mark a change to the fields cached User objects hold (profile, login, ban)
+
+    Balance and bonus changes need not call this, User objects do not
+    carry them.
+    """
+    user['profile_version'] = user.get('profile_version', 0) + 1
+
+
+class UserCache:
+    """Bounded LRU cache with a TTL for User objects keyed by user id
+
+    flask_login resolves the session user on every request; this keeps the
+    User objects of recently active users so polling endpoints do not hit
+    storage. Each entry keeps the stamp(user_id) of its user (the record's
+    profile_version) and is only served while that is unchanged, so edits
+    and bans made by any process take effect on the next request while
+    other users' writes leave the entry alone. Stamps are only read after
+    the version() of the whole collection moved, so hits on an unchanged
+    collection cost one stat. invalidate() drops an entry right away and
+    also discards fills that were loading meanwhile, which may have read
+    the user from before the change.
+    """
+
+    def __init__(self, max_size=USER_CACHE_SIZE, ttl=USER_CACHE_TTL, version=None, stamp=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.version = version
+        self.stamp = stamp
+        self._entries = OrderedDict()
+        self._generation = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, user_id, load):
+        """Get the cached object for user_id, calling load(user_id) on a miss"""
+        now = time.monotonic()
+        # Read before loading, so a change made during the load outdates the entry
+        version = self.version() if self.version else None
+        with self._lock:
+            entry = self._entries.get(user_id)
+            generation = self._generation
+
+        stamp = None
+        if entry is not None and entry[0] > now:
+            if entry[1] != version and self.stamp is not None:
+                # Something in the collection changed, maybe not this user
+                stamp = self.stamp(user_id)
+                if stamp == entry[2]:
+                    entry = (entry[0], version, stamp, entry[3])
+                    with self._lock:
+                        if self._generation == generation and user_id in self._entries:
+                            self._entries[user_id] = entry
+            if entry[1] == version:
+                with self._lock:
+                    if user_id in self._entries:
+                        self._entries.move_to_end(user_id)
+                    self.hits += 1
+                return entry[3]
+
+        with self._lock:
+            self.misses += 1
+        if stamp is None and self.stamp is not None:
+            stamp = self.stamp(user_id)
+        value = load(user_id)
+        if value is None or self.max_size <= 0:
+            return value
+
+        with self._lock:
+            if self._generation != generation:
+                # invalidate() ran while loading, value may predate the change
+                return value
+            self._entries[user_id] = (now + self.ttl, version, stamp, value)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return value
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._generation += 1
+            if self._entries.pop(user_id, None) is not None:
+                self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups * 100, 2) if lookups else 0,
+            'evictions': self.evictions,
+            'invalidations': self.invalidations,
+            'entries': len(self._entries),
+            'max_size': self.max_size,
+            'ttl': self.ttl
+        }
@@ -1,13 +1,25 @@
 import os
 import json
+import base64
+import heapq
 import uuid
 import datetime
 import threading
 import time
 import logging
-import requests
-import random
 from werkzeug.security import check_password_hash
+from storage import get_storage, DATE_FIELDS
+from partitions import PartitionArchive
+from user_cache import UserCache
+from prices import PriceService, PriceOverrides
+from price_sources import PriceAggregator
+from price_history import PriceHistory
+from events import EventBroadcaster
+from scheduler import Scheduler
+from risk import RiskEngine
+from triggers import TriggerBook
+from position_stats import PositionStats
+from leaderboard import Leaderboard, roi
 
 # Constants
 ADMIN_USERNAME = "shayanghad0"
@@ -36,35 +48,80 @@ DEFAULT_PRICES = {
 if not os.path.exists('data'):
     os.makedirs('data')
 
+# Storage backend selected by STORAGE_BACKEND (json or sqlite)
+store = get_storage()
+
+# Position counts and totals for the admin analysis, updated as positions open and settle
+position_stats = PositionStats(store)
+
+# Per-user totals of closed trades the public leaderboard is ranked from
+leaderboard = Leaderboard(store)
+
+# Monthly partitions that settled trades, deposits and withdrawals move to
+partition_archive = PartitionArchive(store)
+
+# Delayed jobs (bonus expiry, price override expiry), persisted in jobs.json
+scheduler = Scheduler(store)
+
+# Recently active User objects for the flask_login user loader, checked
+# against each user's profile_version so edits from any process show up
+user_cache = UserCache(version=lambda: store.version('users.json'), stamp=lambda user_id: get_user_stamp(user_id))
+
+# How often the background archive job runs (seconds)
+ARCHIVE_INTERVAL = int(os.environ.get('ARCHIVE_INTERVAL', 300))
+
+# Rows per page of the history views, and the most a request may ask for
+PAGE_SIZE = int(os.environ.get('PAGE_SIZE', 50))
+MAX_PAGE_SIZE = int(os.environ.get('MAX_PAGE_SIZE', 500))
+
 def load_data(filename):
-    """Load data from a JSON file in the data directory"""
-    file_path = os.path.join('data', filename)
-    
-    if os.path.exists(file_path):
-        with open(file_path, 'r') as f:
-            try:
-                return json.load(f)
-            except json.JSONDecodeError:
-                logging.error(f"Error decoding JSON from {file_path}")
-                return []
-    else:
-        return []
+    """Load data from a collection in the data directory"""
+    return store.load(filename)
 
-def save_data(filename, data):
-    """Save data to a JSON file in the data directory"""
-    file_path = os.path.join('data', filename)
-    
-    with open(file_path, 'w') as f:
-        json.dump(data, f, indent=4)
+def save_data(filename, data, wait=None):
+    """Save data to a collection in the data directory
+
+    wait=True blocks until the data is on disk, wait=False returns as soon as
+    the write is queued; None follows the SYNC_WRITES setting.
+    """
+    store.save(filename, data, wait=wait)
+
+def transaction(filename):
+    """Lock a collection for a read-modify-write and save it when the block ends
+
+    Usage: with transaction('users.json') as users: ...
+    The lock is shared with other worker processes.
+    """
+    return store.transaction(filename)
+
+def get_data_version(filename):
+    """Get a token that changes whenever a collection changes, without reading it"""
+    return store.version(filename)
+
+def convert_data_format(fmt):
+    """Rewrite every data file in another format (json, compact or msgpack)"""
+    if not hasattr(store, 'convert'):
+        raise ValueError(f"The {store.name} storage backend has no data files to convert")
+    return store.convert(fmt)
+
+def get_cache_stats():
+    """Get counters of the parsed data file cache, the user cache and the price service and sources"""
+    cache = getattr(store, 'cache', None)
+    stats = cache.stats() if cache else {}
+    stats['user_cache'] = user_cache.stats()
+    stats['prices'] = price_service.stats()
+    stats['price_sources'] = price_aggregator.stats()
+    stats['stream'] = broadcaster.stats()
+    stats['scheduler'] = scheduler.stats()
+    stats['risk'] = risk_engine.stats()
+    return stats
 
 def initialize_data_files():
     """Initialize all required data files if they don't exist"""
     data_files = ['users.json', 'trades.json', 'deposits.json', 'withdrawals.json', 'prices.json']
     
     for filename in data_files:
-        file_path = os.path.join('data', filename)
-        
-        if not os.path.exists(file_path):
+        if not store.exists(filename):
             if filename == 'prices.json':
                 # Initialize with default prices
                 save_data(filename, DEFAULT_PRICES)
@@ -72,131 +129,107 @@ def initialize_data_files():
                 save_data(filename, [])
 
 def fetch_crypto_prices():
-    """Fetch cryptocurrency prices from public API or generate realistic ones"""
+    """Fetch cryptocurrency prices from all configured sources concurrently"""
     SUPPORTED_COINS = ["BTC", "ETH", "ETC", "LTC", "BNB", "TRX", "PEPE", "AAVE", "DOGE", 
                       "SOL", "ADA", "AVAX", "SHIB", "TON", "POL", "FIL", "ATOM"]
-    prices = {}
     
-    try:
-        # Try to fetch from CoinGecko API (as alternate to Binance which returns 451)
-        api_ids = {
-            'BTC': 'bitcoin', 'ETH': 'ethereum', 'LTC': 'litecoin', 
-            'BNB': 'binancecoin', 'SOL': 'solana', 'ADA': 'cardano', 
-            'AVAX': 'avalanche-2', 'DOGE': 'dogecoin'
-        }
-        
-        # We'll try the main coins and fallback for the rest
-        response = requests.get('https://api.coingecko.com/api/v3/simple/price?ids=bitcoin,ethereum,litecoin,binancecoin,solana,cardano,avalanche-2,dogecoin&vs_currencies=usd', timeout=5)
-        
-        if response.status_code == 200:
-            data = response.json()
-            
-            # Process the fetched data
-            for coin in SUPPORTED_COINS:
-                pair = f"{coin}/USDT"
-                if coin in api_ids and api_ids[coin] in data:
-                    # Get price from API
-                    price = data[api_ids[coin]]['usd']
-                    prices[pair] = price
-                    logging.info(f"Got price for {coin}: ${price}")
-                else:
-                    # For coins not in API response, use default with variation
-                    default_price = DEFAULT_PRICES.get(pair, 1.0)
-                    variation = random.uniform(-0.05, 0.05)  # +/- 5% variation
-                    prices[pair] = default_price * (1 + variation)
-            
-            logging.info("Successfully fetched some prices from CoinGecko API")
-        else:
-            # If API call fails, use defaults with variations
-            logging.warning(f"Failed to fetch prices, status code: {response.status_code}")
-            raise Exception("API failed")
-            
-    except Exception as e:
-        logging.error(f"Error fetching crypto prices: {str(e)}")
+    prices = price_aggregator.fetch(SUPPORTED_COINS)
+    
+    if not prices:
+        if price_service.current is not None:
+            # Keep serving the last snapshot; it ages until a source recovers
+            raise Exception("No price source answered")
         
-        # Try to load existing prices first
-        existing_prices = load_data('prices.json')
-        if existing_prices and isinstance(existing_prices, dict) and len(existing_prices) > 0:
-            prices = existing_prices
-            
-            # Add some variation to existing prices to make them look fresh
-            for pair in prices:
-                variation = random.uniform(-0.02, 0.02)  # +/- 2% variation
-                prices[pair] = prices[pair] * (1 + variation)
-            
-            logging.info("Using existing prices with variations")
-        else:
-            # If no existing prices, use defaults with variations
-            prices = DEFAULT_PRICES.copy()
-            for pair in prices:
-                variation = random.uniform(-0.05, 0.05)  # +/- 5% variation
-                prices[pair] = prices[pair] * (1 + variation)
-            
-            logging.info("Using default prices with variations")
+        # Nothing fetched yet: start from the saved prices
+        logging.warning("No price source answered, using saved prices")
+        saved = load_data('prices.json')
+        prices = dict(saved) if isinstance(saved, dict) else {}
+    else:
+        logging.info(f"Fetched {len(prices)} prices")
     
     # Make sure we have all the required pairs
+    previous = price_service.current
     for coin in SUPPORTED_COINS:
         pair = f"{coin}/USDT"
         if pair not in prices:
-            prices[pair] = DEFAULT_PRICES.get(pair, 1.0)
+            prices[pair] = previous.prices.get(pair) if previous and pair in previous.prices else DEFAULT_PRICES.get(pair, 1.0)
     
-    # Save the fetched/generated prices
-    save_data('prices.json', prices)
+    # Save the fetched prices so a restart starts from them
+    save_data('prices.json', prices, wait=False)
     
     return prices
 
+# Market price sources, fetched concurrently and combined per pair
+price_aggregator = PriceAggregator.from_env()
+
+# Admin price overrides and the current prices, refreshed from the API in
+# the background with the overrides merged in
+price_overrides = PriceOverrides(store)
+price_service = PriceService(fetch_crypto_prices, price_overrides)
+
+# Tick history of every published price, for the candles API
+price_history = PriceHistory(os.path.join('data', 'price_history'), DEFAULT_PRICES)
+price_service.subscribe(lambda snapshot: price_history.record(snapshot.prices, snapshot.timestamp))
+
+# Price diffs and position events pushed to /api/stream clients
+broadcaster = EventBroadcaster()
+price_service.subscribe(broadcaster.publish_prices)
+
 def load_prices():
-    """Load current prices, fetching from API if possible"""
-    return fetch_crypto_prices()
+    """Get the current prices from the in-memory snapshot"""
+    return dict(price_service.snapshot().prices)
+
+def get_price(pair):
+    """Get the current price of one pair"""
+    override = price_overrides.get(pair)
+    if override is not None:
+        return override
+    return price_service.market_snapshot().prices.get(pair, 0)
 
-def save_prices(prices):
-    """Save updated prices"""
-    save_data('prices.json', prices)
+def get_trade_prices():
+    """Get prices fresh enough to execute trades at (raises StalePricesError)"""
+    return dict(price_service.trade_snapshot().prices)
 
 def update_price(coin, new_price, duration):
-    """Update the price of a coin for a specific duration"""
-    prices = load_prices()
+    """Override the price of a coin for a specific duration (minutes)"""
     pair = f"{coin}/USDT"
-    
-    # Store the original price
-    original_price = prices.get(pair, 0)
+    original_price = price_service.market_snapshot().prices.get(pair, 0)
     
     # Make sure the price is a float
     new_price = float(new_price)
     
-    # Update the price
+    # Layer the override over the market prices; reads ignore it once it
+    # expires and the scheduled job tells stream clients about the revert
     logging.info(f"Changing price for {pair} from {original_price} to {new_price} for {duration} minutes")
-    prices[pair] = new_price
-    save_prices(prices)
-    
-    # Force reload of prices to make sure they are fresh for any API calls
-    updated_prices = load_prices()
-    if updated_prices.get(pair) == new_price:
-        logging.info(f"Price for {pair} successfully updated to {new_price}")
-    else:
-        logging.error(f"Price update failed. Expected {new_price} but got {updated_prices.get(pair)}")
-    
-    # Schedule a task to revert the price after the duration
-    def revert_price():
-        time.sleep(duration * 60)  # Convert minutes to seconds
-        current_prices = load_prices()
-        
-        # Only revert if the price hasn't been changed again by another admin action
-        if abs(current_prices.get(pair, 0) - new_price) < 0.01:  # Allow for tiny float differences
-            current_prices[pair] = original_price
-            save_prices(current_prices)
-            logging.info(f"Price for {pair} reverted to {original_price} after {duration} minutes")
-        else:
-            logging.info(f"Price for {pair} not reverted as it was modified during the duration period")
-    
-    # Start a thread to revert the price
-    revert_thread = threading.Thread(target=revert_price, daemon=True)
-    revert_thread.start()
+    override = price_overrides.set(pair, new_price, duration * 60)
+    price_service.notify()
+    scheduler.schedule('expire_price_override', run_at=override['expires_at'],
+                       job_id=f"price-override-{pair}", pair=pair)
     
     logging.info(f"Price for {pair} updated to {new_price} for {duration} minutes")
     
     return {"success": True, "pair": pair, "price": new_price, "duration": duration}
 
+def expire_price_override(pair):
+    """Drop an expired price override and republish the market price"""
+    price_overrides.purge()
+    price_service.notify()
+    logging.info(f"Price override for {pair} expired")
+
+def get_scheduled_jobs():
+    """List pending delayed jobs, soonest first"""
+    return scheduler.jobs()
+
+def cancel_scheduled_job(job_id):
+    """Cancel a pending delayed job"""
+    return scheduler.cancel(job_id)
+
+def start_scheduler():
+    """Register the job handlers and run jobs persisted by earlier runs"""
+    scheduler.register('expire_bonus', expire_bonus)
+    scheduler.register('expire_price_override', expire_price_override)
+    scheduler.start()
+
 def calculate_liquidation_price(entry_price, leverage, position_type):
     """Calculate liquidation price based on entry price, leverage, and position type"""
     if position_type == 'long':
@@ -208,34 +241,60 @@ def calculate_liquidation_price(entry_price, leverage, position_type):
 
 def get_user_balance(user_id):
     """Get the balance of a user"""
-    users = load_data('users.json')
+    user = store.get('users.json', user_id)
     
-    for user in users:
-        if user.get('id') == user_id:
-            return user.get('balance', 0)
+    if user:
+        return user.get('balance', 0)
     
     return 0
 
+def _apply_balance_change(user, amount):
+    """Add amount to a user record's balance (the balance rules of every credit)"""
+    current_balance = user.get('balance', 0)
+    
+    if amount < 0 and abs(amount) >= current_balance:
+        # Liquidation case - set balance to zero instead of negative
+        user['balance'] = 0
+        logging.info(f"User {user.get('id')} was liquidated. Balance set to 0 (was: {current_balance}, loss: {amount})")
+    else:
+        # Normal case - add amount to balance
+        user['balance'] = current_balance + amount
+    
+    return True
+
+def get_user_stamp(user_id):
+    """Get the profile_version of a user (None if there is no such user)"""
+    user = store.get('users.json', user_id)
+    return None if user is None else user.get('profile_version', 0)
+
 def adjust_balance(user_id, amount):
     """Adjust the balance of a user"""
-    users = load_data('users.json')
-    
-    for user in users:
-        if user.get('id') == user_id:
-            current_balance = user.get('balance', 0)
-            
-            if amount < 0 and abs(amount) >= current_balance:
-                # Liquidation case - set balance to zero instead of negative
-                user['balance'] = 0
-                logging.info(f"User {user_id} was liquidated. Balance set to 0 (was: {current_balance}, loss: {amount})")
-            else:
-                # Normal case - add amount to balance
-                user['balance'] = current_balance + amount
-                
-            save_data('users.json', users)
-            return True
+    def apply(user):
+        return _apply_balance_change(user, amount)
+    
+    return store.update('users.json', user_id, apply) or False
+
+def deduct_balance(user_id, amount):
+    """Take amount from a user's balance if it covers it, returning whether it did
+    
+    The check and the deduction happen under the users lock, so two
+    concurrent requests cannot both spend the same balance.
+    """
+    def deduct(user):
+        if user.get('balance', 0) < amount:
+            return None
+        user['balance'] = user.get('balance', 0) - amount
+        return True
+    
+    return store.update('users.json', user_id, deduct) or False
+
+def set_bonus_flag(user_id, has_bonus):
+    """Mark whether a user still holds the new user bonus"""
+    def apply(user):
+        user['has_bonus'] = has_bonus
+        return True
     
-    return False
+    return store.update('users.json', user_id, apply) or False
 
 def add_bonus_to_new_user(user_id):
     """Add $50 bonus to a new user, valid for 12 hours. 
@@ -244,56 +303,158 @@ def add_bonus_to_new_user(user_id):
     adjust_balance(user_id, 50)
     
     # Mark user as having a bonus so we can apply restrictions
-    users = load_data('users.json')
-    for user in users:
-        if user.get('id') == user_id:
-            user['has_bonus'] = True
-            save_data('users.json', users)
-            break
+    set_bonus_flag(user_id, True)
     
-    # Schedule a task to remove the bonus after 12 hours if not used
-    def remove_bonus():
-        time.sleep(12 * 60 * 60)  # 12 hours in seconds
+    # Remove the bonus after 12 hours if not used
+    scheduler.schedule('expire_bonus', delay=12 * 60 * 60, job_id=f"bonus-{user_id}", user_id=user_id)
+
+def expire_bonus(user_id):
+    """Take back an unused new user bonus"""
+    # Check if the bonus is still there
+    balance = get_user_balance(user_id)
+    if balance >= 50:
+        adjust_balance(user_id, -50)
+        logging.info(f"Removed unused bonus from user {user_id}")
         
-        # Check if the bonus is still there
-        balance = get_user_balance(user_id)
-        if balance >= 50:
-            adjust_balance(user_id, -50)
-            logging.info(f"Removed unused bonus from user {user_id}")
-            
-            # Remove the bonus flag
-            users = load_data('users.json')
-            for user in users:
-                if user.get('id') == user_id:
-                    user['has_bonus'] = False
-                    save_data('users.json', users)
-                    break
-    
-    # Start a thread to remove the bonus
-    threading.Thread(target=remove_bonus, daemon=True).start()
+        # Remove the bonus flag
+        set_bonus_flag(user_id, False)
 
-def get_deposits(user_id=None):
-    """Get deposits for a user or all deposits if user_id is None"""
-    deposits = load_data('deposits.json')
+def use_bonus(user_id):
+    """Keep the bonus of a user who traded with it (cancels its expiry)"""
+    if scheduler.cancel(f"bonus-{user_id}"):
+        logging.info(f"User {user_id} used their bonus, expiry cancelled")
+
+def iter_history(filename, user_id=None, newest_first=False):
+    """Yield records of a collection from the live file and its archive partitions
     
-    if user_id is None:
-        return deposits
+    Partitions are only read as the caller consumes the generator.
+    """
+    live = store.find(filename, user_id=user_id) if user_id is not None else load_data(filename)
+    if newest_first:
+        live.reverse()
+    
+    archived = partition_archive.iter_records(filename, newest_first=newest_first, user_id=user_id)
+    
+    if newest_first:
+        yield from live
+        yield from archived
     else:
-        return [deposit for deposit in deposits if deposit.get('user_id') == user_id]
+        yield from archived
+        yield from live
+
+def get_recent_records(filename, limit, key='date'):
+    """Get the newest records of a collection, reading only as many partitions as needed
+    
+    key is the record's creation date. A partition holds records settled in
+    its month, so none of them is dated after it: once the page is full and
+    its oldest record is from a later month, older partitions cannot change it.
+    """
+    def sort_key(record):
+        return record.get(key) or ''
+    
+    records = heapq.nlargest(limit, load_data(filename), key=sort_key)
+    for month in reversed(partition_archive.months(filename)):
+        if len(records) >= limit and sort_key(records[-1])[:7] > month:
+            break
+        records = heapq.nlargest(limit, records + load_data(partition_archive.partition(filename, month)), key=sort_key)
+    return records
+
+def encode_cursor(date, record_id):
+    """Make an opaque page cursor from the (date, id) of the last record shown"""
+    return base64.urlsafe_b64encode(json.dumps([date, record_id]).encode()).decode().rstrip('=')
+
+def decode_cursor(cursor):
+    """Get the (date, id) of a page cursor, None for the first page"""
+    if not cursor:
+        return None
+    try:
+        date, record_id = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        return (str(date), str(record_id))
+    except (ValueError, TypeError):
+        raise ValueError('Invalid cursor')
+
+def get_history_page(filename, cursor=None, limit=PAGE_SIZE, **filters):
+    """Get one page of a collection's history, newest first
+    
+    Records are ordered by (date, id), so a page starts right after the
+    cursor of the previous one however the history grows meanwhile.
+    filters are field values to match (coin, status, user_id, type); None
+    means no filter. Archive partitions are read newest month first and
+    only until the page is full: a partition holds records settled in its
+    month, so none of them is newer than that month. Partitions that cannot
+    hold matches (an unsettled status, months without the user) are skipped.
+    
+    Returns:
+        {'items': records, 'next_cursor': cursor of the next page or None}
+    """
+    date_field = DATE_FIELDS[filename]
+    before = decode_cursor(cursor)
+    limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+    criteria = {key: value for key, value in filters.items() if value is not None}
+    
+    def key(record):
+        return (record.get(date_field) or '', record.get('id') or '')
+    
+    # One record past the page tells whether there is a next one
+    items = store.page(filename, date_field, before, limit + 1, **criteria)
+    months = partition_archive.months(filename, status=criteria.get('status'), user_id=criteria.get('user_id'))
+    for month in reversed(months):
+        if len(items) > limit and key(items[-1])[0][:7] > month:
+            break
+        archived = store.page(partition_archive.partition(filename, month), date_field, before, limit + 1, **criteria)
+        items = heapq.nlargest(limit + 1, items + archived, key=key)
+    
+    next_cursor = encode_cursor(*key(items[limit - 1])) if len(items) > limit else None
+    return {'items': items[:limit], 'next_cursor': next_cursor}
+
+def iter_export(filename, start=None, end=None, **filters):
+    """Yield the records of a collection for an export, one at a time
+    
+    start and end bound the record date ('%Y-%m-%d %H:%M:%S', inclusive);
+    filters are field values to match, None meaning no filter. Archive
+    partitions come first, oldest month first, then the live file.
+    Partitions settled before start are skipped, as none of their records
+    can be dated after it.
+    """
+    date_field = DATE_FIELDS[filename]
+    criteria = {key: value for key, value in filters.items() if value is not None}
+    for month in partition_archive.months(filename, status=criteria.get('status'), user_id=criteria.get('user_id')):
+        if start is not None and month < start[:7]:
+            continue
+        yield from store.iter_records(partition_archive.partition(filename, month), date_field, start, end, **criteria)
+    yield from store.iter_records(filename, date_field, start, end, **criteria)
+
+def get_trade_history(user_id=None):
+    """Get all trades (open and settled) for a user or for everyone"""
+    return list(iter_history('trades.json', user_id))
+
+def get_deposits(user_id=None):
+    """Get deposits for a user or all deposits if user_id is None"""
+    return list(iter_history('deposits.json', user_id))
 
 def get_withdrawals(user_id=None):
     """Get withdrawals for a user or all withdrawals if user_id is None"""
-    withdrawals = load_data('withdrawals.json')
+    return list(iter_history('withdrawals.json', user_id))
+
+def archive_settled_records():
+    """Move settled trades, deposits and withdrawals into monthly archive partitions"""
+    return partition_archive.archive_all()
+
+def start_archive_job(interval=ARCHIVE_INTERVAL):
+    """Run archive_settled_records in a background thread every interval seconds"""
+    def run():
+        while True:
+            time.sleep(interval)
+            try:
+                archive_settled_records()
+            except Exception as e:
+                logging.error(f"Error archiving settled records: {str(e)}")
     
-    if user_id is None:
-        return withdrawals
-    else:
-        return [withdrawal for withdrawal in withdrawals if withdrawal.get('user_id') == user_id]
+    if partition_archive.enabled:
+        threading.Thread(target=run, daemon=True).start()
 
 def process_deposit(user_id, amount, tx_hash):
     """Process a deposit request"""
-    deposits = load_data('deposits.json')
-    
     # Generate deposit ID
     deposit_id = str(uuid.uuid4())
     
@@ -307,17 +468,16 @@ def process_deposit(user_id, amount, tx_hash):
         'date': datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
     }
     
-    # Add deposit to deposits list
-    deposits.append(deposit_data)
-    
-    # Save deposits data
-    save_data('deposits.json', deposits)
+    # Add deposit to deposits
+    store.insert('deposits.json', deposit_data)
     
     return deposit_id
 
 def process_withdrawal(user_id, amount, wallet_address):
     """Process a withdrawal request"""
-    withdrawals = load_data('withdrawals.json')
+    # Deduct amount from user's balance
+    if not deduct_balance(user_id, amount):
+        return None
     
     # Generate withdrawal ID
     withdrawal_id = str(uuid.uuid4())
@@ -332,21 +492,13 @@ def process_withdrawal(user_id, amount, wallet_address):
         'date': datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
     }
     
-    # Add withdrawal to withdrawals list
-    withdrawals.append(withdrawal_data)
-    
-    # Save withdrawals data
-    save_data('withdrawals.json', withdrawals)
-    
-    # Deduct amount from user's balance
-    adjust_balance(user_id, -amount)
+    # Add withdrawal to withdrawals
+    store.insert('withdrawals.json', withdrawal_data)
     
     return withdrawal_id
 
 def create_position(user_id, coin, amount, leverage, entry_price, liquidation_price, position_type, take_profit=None, stop_loss=None):
     """Create a new trading position"""
-    trades = load_data('trades.json')
-    
     # Generate position ID
     position_id = str(uuid.uuid4())
     
@@ -378,73 +530,213 @@ def create_position(user_id, coin, amount, leverage, entry_price, liquidation_pr
         'open_date': datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
     }
     
-    # Add position to trades list
-    trades.append(position_data)
-    
-    # Save trades data
-    save_data('trades.json', trades)
+    # Add position to trades
+    store.insert('trades.json', position_data)
+    position_stats.record([('opened', position_data)])
+    trigger_book.add(position_data)
+    risk_engine.synced()
+    broadcaster.publish_position('opened', position_data)
     
     logging.info(f"New position opened: {coin} {position_type} with amount ${amount} and leverage {leverage}x")
     
     return position_id
 
-def close_position(position_id, close_price):
-    """Close a trading position"""
-    trades = load_data('trades.json')
-    
-    for trade in trades:
-        if trade.get('id') == position_id and trade.get('status') == 'open':
-            # Ensure all values are proper numeric types
-            entry_price = float(trade.get('entry_price', 0))
-            amount = float(trade.get('amount', 0))
-            leverage = float(trade.get('leverage', 1))
-            position_type = trade.get('type')
-            close_price = float(close_price)
-            
-            if position_type == 'long':
-                price_difference = close_price - entry_price
-            else:  # short
-                price_difference = entry_price - close_price
-            
-            # Calculate profit/loss
-            price_change_percentage = 0
-            if entry_price > 0:
-                price_change_percentage = price_difference / entry_price
-                profit_loss = amount + (amount * leverage * price_change_percentage)
-            else:
-                profit_loss = 0
-                
-            # Round to avoid floating point issues
-            profit_loss = round(profit_loss, 2)
-            
-            # Update trade data
-            trade['close_price'] = close_price
-            trade['profit_loss'] = profit_loss
-            trade['status'] = 'closed'
-            trade['close_date'] = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-            trade['price_change_percentage'] = round(price_change_percentage * 100, 2)
-            
-            # Save trades data
-            save_data('trades.json', trades)
-            
-            logging.info(f"Position {position_id} closed with profit/loss: ${profit_loss}")
-            
-            return {
-                'position_id': position_id,
-                'profit_loss': profit_loss
-            }
-    
-    return None
+def _settle_trade(trade, close_price, reason='closed'):
+    """Close an open trade record at close_price (status liquidated if reason is)"""
+    if trade.get('status') != 'open':
+        return None
+    
+    # Ensure all values are proper numeric types
+    entry_price = float(trade.get('entry_price', 0))
+    amount = float(trade.get('amount', 0))
+    leverage = float(trade.get('leverage', 1))
+    position_type = trade.get('type')
+    price = float(close_price)
+    
+    if position_type == 'long':
+        price_difference = price - entry_price
+    else:  # short
+        price_difference = entry_price - price
+    
+    # Calculate profit/loss
+    price_change_percentage = 0
+    if entry_price > 0:
+        price_change_percentage = price_difference / entry_price
+        profit_loss = amount + (amount * leverage * price_change_percentage)
+    else:
+        profit_loss = 0
+    
+    # A liquidated position loses its margin and nothing more
+    if reason == 'liquidated':
+        profit_loss = max(profit_loss, 0)
+        
+    # Round to avoid floating point issues
+    profit_loss = round(profit_loss, 2)
+    
+    # Update trade data
+    trade['close_price'] = price
+    trade['profit_loss'] = profit_loss
+    trade['status'] = 'liquidated' if reason == 'liquidated' else 'closed'
+    trade['close_reason'] = reason
+    trade['close_date'] = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    trade['price_change_percentage'] = round(price_change_percentage * 100, 2)
+    
+    return {
+        'position_id': trade.get('id'),
+        'profit_loss': profit_loss
+    }
+
+def close_position(position_id, close_price, reason='closed'):
+    """Close a trading position
+    
+    reason is the position event sent to the owner's streams: closed,
+    take_profit or stop_loss.
+    """
+    closed = []
+    
+    def settle(trade):
+        result = _settle_trade(trade, close_price, reason)
+        if result is not None:
+            closed.append(trade)
+        return result
+    
+    result = store.update('trades.json', position_id, settle)
+    trigger_book.remove(position_id)
+    risk_engine.synced()
+    
+    if result:
+        position_stats.record([(closed[0]['status'], closed[0])])
+        leaderboard.record(closed)
+        broadcaster.publish_position(reason, closed[0])
+        logging.info(f"Position {position_id} closed with profit/loss: ${result['profit_loss']}")
+    
+    return result
+
+def _settle_positions(closes):
+    """Close many positions and credit their owners with one write per file
     
+    closes maps position_id -> (close_price, reason). Returns
+    {position_id: result} for the positions that were still open.
+    """
+    settled = []
+    
+    def settler(close_price, reason):
+        def settle(trade):
+            result = _settle_trade(trade, close_price, reason)
+            if result is not None:
+                settled.append(trade)
+            return result
+        return settle
+    
+    results = store.update_many('trades.json', {
+        position_id: settler(close_price, reason) for position_id, (close_price, reason) in closes.items()
+    })
+    
+    # Positions that were already closed elsewhere leave the book as well
+    for position_id in closes:
+        trigger_book.remove(position_id)
+    risk_engine.synced()
+    if not results:
+        return results
+    
+    # Credit every owner in one write
+    credits = {}
+    for trade in settled:
+        credits[trade.get('user_id')] = credits.get(trade.get('user_id'), 0) + trade['profit_loss']
+    
+    def crediter(amount):
+        def apply(user):
+            return _apply_balance_change(user, amount)
+        return apply
+    
+    store.update_many('users.json', {user_id: crediter(amount) for user_id, amount in credits.items()})
+    
+    position_stats.record([(trade['status'], trade) for trade in settled])
+    leaderboard.record(settled)
+    for trade in settled:
+        broadcaster.publish_position(trade['close_reason'], trade)
+    logging.info(f"Settled {len(settled)} positions for {len(credits)} users")
+    
+    return results
+
+def close_positions(position_ids, price_map, reason='closed'):
+    """Close many positions and credit their owners with one write per file
+    
+    price_map maps pairs ('BTC/USDT') to close prices. Returns
+    {position_id: result}, where result has success and profit_loss, or
+    success False and a message for positions that could not be closed.
+    """
+    results = {}
+    closes = {}
+    for position_id in position_ids:
+        position = store.get('trades.json', position_id)
+        if position is None or position.get('status') != 'open':
+            results[position_id] = {'success': False, 'message': 'Position not found'}
+            continue
+        price = price_map.get(f"{position.get('coin')}/USDT", 0)
+        if price <= 0:
+            results[position_id] = {'success': False, 'message': 'Invalid price data'}
+            continue
+        closes[position_id] = (price, reason)
+        results[position_id] = None  # keeps the input order
+    
+    settled = _settle_positions(closes) if closes else {}
+    for position_id in closes:
+        if position_id in settled:
+            results[position_id] = {'success': True, 'profit_loss': settled[position_id]['profit_loss']}
+        else:
+            results[position_id] = {'success': False, 'message': 'Position already closed'}
+    
+    return results
+
+def get_open_position_ids(user_id=None, coin=None):
+    """Get the IDs of open positions, optionally of one user or coin"""
+    criteria = {'status': 'open'}
+    if user_id is not None:
+        criteria['user_id'] = user_id
+    if coin is not None:
+        criteria['coin'] = coin
+    return [position['id'] for position in store.find('trades.json', **criteria)]
+
+# Liquidations, stop losses and take profits, checked on every price snapshot
+# against a per-pair index of the open positions' trigger prices
+trigger_book = TriggerBook()
+risk_engine = RiskEngine(trigger_book,
+                         lambda: store.find('trades.json', status='open'),
+                         lambda: store.version('trades.json'),
+                         _settle_positions)
+price_service.subscribe(risk_engine.on_snapshot)
+
+def start_risk_engine():
+    """Load the trigger book from the open positions in storage"""
+    risk_engine.rebuild()
+
+def ensure_position_stats(rebuild=False):
+    """Compute the position statistics from every trade if they are missing"""
+    if rebuild or not store.exists(position_stats.filename):
+        position_stats.rebuild(iter_history('trades.json'))
+    return position_stats
+
+def check_position_stats():
+    """Compare the position statistics with a full scan of the trades
+
+    Returns {statistic: (stored, scanned)} for the statistics that differ.
+    """
+    return position_stats.check(iter_history('trades.json'))
+
 def get_positions_analysis():
     """Get analysis of all positions for admin dashboard
     
+    Reads the position statistics aggregate, so the cost does not grow
+    with the number of trades.
+    
     Returns:
         Dictionary with position statistics
     """
-    trades = load_data('trades.json')
+    stats = ensure_position_stats().get()
+    total_positions = stats['total_positions']
     
-    if not trades:
+    if total_positions == 0:
         return {
             'total_positions': 0,
             'open_count': 0,
@@ -462,134 +754,67 @@ def get_positions_analysis():
             'total_volume': 0
         }
     
-    # Basic counts
-    total_positions = len(trades)
-    open_count = sum(1 for t in trades if t.get('status') == 'open')
-    closed_count = sum(1 for t in trades if t.get('status') == 'closed')
-    liquidated_count = sum(1 for t in trades if t.get('status') == 'liquidated')
-    
-    # Position types
-    long_positions = sum(1 for t in trades if t.get('type') == 'long')
-    short_positions = total_positions - long_positions
-    
-    # Calculate percentages
-    long_percentage = round((long_positions / total_positions * 100) if total_positions > 0 else 0, 1)
-    short_percentage = round((short_positions / total_positions * 100) if total_positions > 0 else 0, 1)
-    
-    # Calculate profit/loss
-    total_profit = 0
-    total_loss = 0
-    
-    for trade in trades:
-        if trade.get('status') in ['closed', 'liquidated'] and 'profit_loss' in trade:
-            pl = float(trade.get('profit_loss', 0))
-            if pl > 0:
-                total_profit += pl
-            else:
-                total_loss += abs(pl)
-    
-    net_profit_loss = total_profit - total_loss
-    
-    # Distribution by coin
-    coin_distribution = {}
-    for t in trades:
-        coin = t.get('coin')
-        if coin not in coin_distribution:
-            coin_distribution[coin] = 0
-        coin_distribution[coin] += 1
-    
-    # Average leverage
-    total_leverage = sum(float(t.get('leverage', 1)) for t in trades)
-    avg_leverage = total_leverage / total_positions if total_positions > 0 else 0
-    
-    # Total volume
-    total_volume = sum(float(t.get('amount', 0)) for t in trades)
+    long_positions = stats['long_positions']
+    short_positions = stats['short_positions']
+    total_profit = stats['total_profit']
+    total_loss = stats['total_loss']
     
     return {
         'total_positions': total_positions,
-        'open_count': open_count,
-        'closed_count': closed_count,
-        'liquidated_count': liquidated_count,
+        'open_count': stats['open_count'],
+        'closed_count': stats['closed_count'],
+        'liquidated_count': stats['liquidated_count'],
         'long_positions': long_positions,
         'short_positions': short_positions,
-        'long_percentage': long_percentage,
-        'short_percentage': short_percentage,
+        'long_percentage': round(long_positions / total_positions * 100, 1),
+        'short_percentage': round(short_positions / total_positions * 100, 1),
         'total_profit': round(total_profit, 2),
         'total_loss': round(total_loss, 2),
-        'net_profit_loss': round(net_profit_loss, 2),
-        'coin_distribution': coin_distribution,
-        'avg_leverage': round(avg_leverage, 2),
-        'total_volume': round(total_volume, 2)
+        'net_profit_loss': round(total_profit - total_loss, 2),
+        'coin_distribution': dict(stats['coin_distribution']),
+        'avg_leverage': round(stats['total_leverage'] / total_positions, 2),
+        'total_volume': round(stats['total_volume'], 2)
     }
 
+def ensure_leaderboard(rebuild=False):
+    """Compute the per-user trading totals from every trade if they are missing"""
+    if rebuild or not store.exists(leaderboard.filename):
+        leaderboard.rebuild(iter_history('trades.json'))
+    return leaderboard
+
 def get_leaderboard(limit=10):
     """Get the top traders leaderboard based on profit percentage
     
+    Ranks the per-user totals kept up to date as positions close; the
+    result is reused until those totals change.
+    
     Args:
         limit: Maximum number of users to return
         
     Returns:
         List of top users with their trading stats
     """
-    users = load_data('users.json')
-    trades = load_data('trades.json')
-    
-    # Calculate total profit/loss and success rate for each user
-    leaderboard_data = {}
-    
-    for user in users:
-        user_id = user.get('id')
-        username = user.get('username')
+    def describe(trader):
+        user = store.get('users.json', trader['id'])
         
         # Skip admin from leaderboard
-        if username == ADMIN_USERNAME:
-            continue
-            
-        # Get all closed trades for this user
-        user_trades = [t for t in trades if t.get('user_id') == user_id and t.get('status') == 'closed']
-        
-        if not user_trades:
-            continue
-            
-        # Calculate total profits
-        total_profit = sum(float(t.get('profit_loss', 0)) for t in user_trades)
-        total_invested = sum(float(t.get('amount', 0)) for t in user_trades)
-        
-        # Calculate win rate
-        profitable_trades = sum(1 for t in user_trades if float(t.get('profit_loss', 0)) > 0)
-        win_rate = (profitable_trades / len(user_trades)) * 100 if user_trades else 0
+        if user is None or user.get('username') == ADMIN_USERNAME:
+            return None
         
-        # Calculate average leverage
-        total_leverage = sum(float(t.get('leverage', 1)) for t in user_trades)
-        avg_leverage = total_leverage / len(user_trades) if user_trades else 0
-        
-        # Calculate ROI (Return on Investment)
-        roi = (total_profit / total_invested) * 100 if total_invested > 0 else 0
-        
-        # Track largest single profit
-        largest_profit = max([float(t.get('profit_loss', 0)) for t in user_trades]) if user_trades else 0
-        
-        leaderboard_data[user_id] = {
-            'user_id': user_id,
-            'username': username,
+        trade_count = trader['trade_count']
+        return {
+            'user_id': trader['id'],
+            'username': user.get('username'),
             'name': user.get('name', ''),
-            'total_profit': round(total_profit, 2),
-            'win_rate': round(win_rate, 2),
-            'avg_leverage': round(avg_leverage, 2),
-            'roi': round(roi, 2),
-            'trade_count': len(user_trades),
-            'largest_profit': round(largest_profit, 2)
+            'total_profit': round(trader['total_profit'], 2),
+            'win_rate': round(trader['wins'] / trade_count * 100, 2),
+            'avg_leverage': round(trader['leverage_sum'] / trade_count, 2),
+            'roi': round(roi(trader), 2),
+            'trade_count': trade_count,
+            'largest_profit': round(trader['largest_profit'], 2)
         }
     
-    # Sort users by ROI (Return on Investment)
-    sorted_users = sorted(
-        leaderboard_data.values(), 
-        key=lambda x: x['roi'], 
-        reverse=True
-    )
-    
-    # Return top users up to the limit
-    return sorted_users[:limit]
+    return ensure_leaderboard().top(limit, describe)
 
 def authenticate_admin(username, password):
     """Authenticate admin user"""
@@ -0,0 +1,210 @@
+import os
+import time
+import queue
+import atexit
+import threading
+import logging
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows, fall back to thread locking
+    fcntl = None
+
+# How long the writer waits for more mutations before flushing a group
+WRITE_BATCH_WINDOW = float(os.environ.get('WRITE_BATCH_WINDOW', 0.005))
+WRITE_BATCH_SIZE = int(os.environ.get('WRITE_BATCH_SIZE', 500))
+
+
+def write_atomic(file_path, content):
+    """Write a file (str or bytes) through a temp file, fsync and rename"""
+    tmp_path = f"{file_path}.tmp.{os.getpid()}.{threading.get_ident()}"
+    with open(tmp_path, 'wb' if isinstance(content, bytes) else 'w') as f:
+        f.write(content)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, file_path)
+
+
+class FileLock:
+    """Exclusive lock on a data file shared by threads and processes
+
+    Threads of one process serialize on an RLock; the first acquisition in a
+    process also takes an fcntl advisory lock on <file>.lock so gunicorn
+    workers exclude each other. The lock file is opened on every outermost
+    acquisition so forked workers never share a lock description.
+    """
+
+    def __init__(self, file_path):
+        self.path = f"{file_path}.lock"
+        self._mutex = threading.RLock()
+        self._depth = 0
+        self._fd = None
+
+    def acquire(self):
+        self._mutex.acquire()
+        if self._depth == 0 and fcntl is not None:
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+            except Exception:
+                os.close(fd)
+                self._mutex.release()
+                raise
+            self._fd = fd
+        self._depth += 1
+
+    def release(self):
+        self._depth -= 1
+        if self._depth == 0 and self._fd is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            os.close(self._fd)
+            self._fd = None
+        self._mutex.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+
+
+class PendingWrite:
+    """Handle for a mutation queued on a FileWriter"""
+
+    def __init__(self, fn=None, data=None):
+        self.fn = fn
+        self.data = data
+        self._result = None
+        self._error = None
+        self._applied = threading.Event()
+        self._durable = threading.Event()
+
+    def result(self, durable=True, timeout=None):
+        """Wait until the mutation is applied (and flushed if durable) and return its result"""
+        event = self._durable if durable else self._applied
+        if not event.wait(timeout):
+            raise TimeoutError('Write not completed in time')
+        if self._error is not None:
+            raise self._error
+        return self._result
+
+
+class FileWriter:
+    """Single writer thread for one data file with group commit
+
+    Request threads submit mutations; the writer applies everything that
+    arrives within a short window to one copy of the current state and
+    writes it once (temp file, fsync, rename). Callers either wait for that
+    flush or continue as soon as the mutation is queued. The read, apply and
+    write of a group happen under the file's lock, so groups from different
+    processes never overwrite each other.
+    """
+
+    def __init__(self, name, read, write, lock, window=WRITE_BATCH_WINDOW, max_batch=WRITE_BATCH_SIZE):
+        self.name = name
+        self._read = read
+        self._write = write
+        self._lock = lock
+        self.window = window
+        self.max_batch = max_batch
+        self._queue = queue.Queue()
+        self._thread = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+        self.flushes = 0
+        self.mutations = 0
+
+    def _ensure_thread(self):
+        # A forked worker inherits the thread object but not the thread itself
+        if self._pid != os.getpid():
+            with self._start_lock:
+                if self._pid != os.getpid():
+                    self._queue = queue.Queue()
+                    self._thread = threading.Thread(target=self._run, name=f"writer-{self.name}", daemon=True)
+                    self._thread.start()
+                    if self._pid is None:
+                        atexit.register(self.close)
+                    self._pid = os.getpid()
+
+    def submit(self, fn):
+        """Queue fn(state) -> result; a result of None means nothing changed"""
+        self._ensure_thread()
+        pending = PendingWrite(fn=fn)
+        self._queue.put(pending)
+        return pending
+
+    def replace(self, data):
+        """Queue a replacement of the whole state"""
+        self._ensure_thread()
+        pending = PendingWrite(data=data)
+        self._queue.put(pending)
+        return pending
+
+    def close(self):
+        """Flush everything queued and stop the writer thread"""
+        if self._pid == os.getpid() and self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+
+    def _run(self):
+        while True:
+            first = self._queue.get()
+            if first is None:
+                return
+            batch = [first]
+            stop = False
+            deadline = time.monotonic() + self.window
+            while len(batch) < self.max_batch:
+                try:
+                    pending = self._queue.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    break
+                if pending is None:
+                    stop = True
+                    break
+                batch.append(pending)
+
+            self._commit(batch)
+            if stop:
+                return
+
+    def _commit(self, batch):
+        try:
+            with self._lock:
+                self._commit_locked(batch)
+        except Exception as e:
+            logging.error(f"Error locking {self.name}: {str(e)}")
+            for pending in batch:
+                pending._error = pending._error or e
+                pending._applied.set()
+
+        self.mutations += len(batch)
+        for pending in batch:
+            pending._durable.set()
+
+    def _commit_locked(self, batch):
+        state = self._read()
+        changed = False
+
+        for pending in batch:
+            try:
+                if pending.fn is None:
+                    state = pending.data
+                    pending._result = True
+                else:
+                    pending._result = pending.fn(state)
+                changed = changed or pending._result is not None
+            except Exception as e:
+                logging.error(f"Error applying write to {self.name}: {str(e)}")
+                pending._error = e
+            pending._applied.set()
+
+        if changed:
+            try:
+                self._write(state)
+                self.flushes += 1
+            except Exception as e:
+                logging.error(f"Error flushing {self.name}: {str(e)}")
+                for pending in batch:
+                    pending._error = pending._error or e